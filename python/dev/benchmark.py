@@ -0,0 +1,140 @@
+# Benchmarks the runner's real scheduler and deployment() code paths against the fake API server
+# uv run --frozen --module python.dev.benchmark --jobs 10,50,100
+
+import argparse
+import asyncio
+import os
+import time
+import tracemalloc
+from kubernetes_asyncio import client
+from .fake_apiserver import FakeApiServer
+from ..jobs.functions import capacity, logger, readiness, teardown, timing
+from ..jobs.functions.clients import ClientManager
+from ..jobs.functions.helpers import markdown_table
+from ..jobs.functions.informer import stop_informers
+from ..jobs.functions.scheduler import Scheduler, validate_manifest
+
+
+def build_manifest(job_count, concurrency):
+    """One environment job that every other job depends on, the last job is the completion job"""
+    jobs = [{"name": "env", "command": ["sleep", "1"]}]
+    jobs += [
+        {"name": f"app-{index}", "depends_on": ["env"], "command": ["sleep", "1"]}
+        for index in range(1, job_count)
+    ]
+    return validate_manifest({
+        "completion_job": jobs[-1]["name"],
+        "concurrency": concurrency,
+        "defaults": {"namespace": "bench", "cpu_limit": "10m", "memory_limit": "16Mi"},
+        "jobs": jobs,
+    })
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+async def run_once(job_count, args):
+    """Runs job_count jobs against a fresh fake API server, returning the measurements"""
+    server = FakeApiServer(
+        rollout_delay=args.rollout_delay,
+        rollout_jitter=args.rollout_jitter,
+        failure_rate=args.failure_rate,
+        throttle_rate=args.throttle_rate,
+        watch_timeout=args.watch_timeout,
+    )
+    configuration = client.Configuration()
+    configuration.host = await server.start()
+
+    os.environ["NAME_APPEND"] = f"bench/bench-{job_count}"
+    readiness.reset()
+    timing.reset()
+    clients = ClientManager()
+    api_client = await clients.start(configuration)
+
+    tracemalloc.start()
+    started = time.monotonic()
+    try:
+        scheduler = Scheduler(build_manifest(job_count, args.concurrency), api_client=api_client, simulated_run_seconds=0)
+        job_results = await scheduler.run()
+        await teardown.teardown_run(api_client)
+    finally:
+        elapsed = time.monotonic() - started
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        await stop_informers()
+        await capacity.stop_inventories()
+        client_metrics = clients.metrics()
+        await clients.close()
+        await server.stop()
+
+    # Time between the server flipping a Deployment to Available and the job acting on it
+    detect = []
+    for job in scheduler.jobs:
+        kwargs = scheduler._job_kwargs(job)
+        timer = timing.get_timer(kwargs["log_name"])
+        ready_at = server.ready_at.get((kwargs["namespace"], kwargs["name"]))
+        if ready_at is not None and "available" in timer.marks:
+            detect.append(timer.marks["available"] - ready_at)
+
+    return {
+        "jobs": job_count,
+        "failed": sum(1 for _, status in job_results if status == "Failed"),
+        "elapsed": elapsed,
+        "detect_p50": percentile(detect, 0.5),
+        "detect_p99": percentile(detect, 0.99),
+        "api_calls": sum(server.call_counts.values()),
+        "watches": server.call_counts["watch deployments"],
+        "call_counts": dict(server.call_counts),
+        "connections": client_metrics["connections_created"],
+        "peak_memory_mb": peak_memory / 2**20,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark the runner against an in-process fake API server")
+    parser.add_argument("--jobs", default="10,50,100", help="Comma separated job counts to run")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--rollout-delay", type=float, default=1.0)
+    parser.add_argument("--rollout-jitter", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--watch-timeout", type=float, default=None, help="Server side watch cap, forces reconnects")
+    args = parser.parse_args()
+
+    logger.configure()
+    log = logger.get_logger("Benchmark")
+    results = []
+    for job_count in (int(count) for count in args.jobs.split(",")):
+        log.info("Running %d jobs..", job_count)
+        results.append(await run_once(job_count, args))
+        log.info("API calls: %s", results[-1]["call_counts"])
+
+    # Write out the queued records first, so the table comes last
+    logger.shutdown()
+    print(
+        markdown_table(
+            ["Jobs", "Failed", "End-to-end", "Detect Ready p50", "Detect Ready p99", "API calls", "Watches", "Connections", "Peak memory"],
+            [
+                [
+                    result["jobs"],
+                    result["failed"],
+                    f"{result['elapsed']:.2f}s",
+                    f"{result['detect_p50'] * 1000:.1f}ms",
+                    f"{result['detect_p99'] * 1000:.1f}ms",
+                    result["api_calls"],
+                    result["watches"],
+                    result["connections"],
+                    f"{result['peak_memory_mb']:.1f}MiB",
+                ]
+                for result in results
+            ],
+        )
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,375 @@
+# In-process stand-in for the Kubernetes API server, enough of apps/v1 Deployments to drive the runner
+# without a cluster: create/apply/get/list/watch/delete with configurable rollouts, failures, 429s and watch timeouts
+
+import asyncio
+import collections
+import datetime
+import json
+import random
+import time
+from aiohttp import web
+
+
+class FakeApiServer:
+    """Serves Deployments from memory and rolls them out after a configurable delay"""
+
+    def __init__(
+        self,
+        rollout_delay=1.0,
+        rollout_jitter=0.5,
+        failure_rate=0.0,
+        throttle_rate=0.0,
+        watch_timeout=None,
+        bookmark_interval=5,
+        history_limit=10000,
+        nodes=3,
+        node_cpu="64",
+        node_memory="256Gi",
+    ):
+        self.rollout_delay = rollout_delay
+        self.rollout_jitter = rollout_jitter
+        # Fraction of Deployments that end with ProgressDeadlineExceeded instead of becoming Available
+        self.failure_rate = failure_rate
+        # Fraction of create/apply calls answered with 429 Too Many Requests
+        self.throttle_rate = throttle_rate
+        # Server side cap on watch duration, shorter than the client's timeoutSeconds to force reconnects
+        self.watch_timeout = watch_timeout
+        self.bookmark_interval = bookmark_interval
+        # Faults answered to the next Deployment watches in order, ("status", code) fails the request with that
+        # HTTP status, ("event", code) sends an ERROR event with that code and ("truncated", None) a cut off
+        # event line before closing the stream
+        self.watch_faults = collections.deque()
+        # resourceVersion every Deployment watch asked to resume from
+        self.watch_versions = []
+        # Static, Ready worker nodes for capacity admission, pods are never scheduled onto them
+        self.nodes = [
+            {
+                "kind": "Node",
+                "apiVersion": "v1",
+                "metadata": {"name": f"node-{index}", "labels": {"kubernetes.io/os": "linux"}, "resourceVersion": "1"},
+                "spec": {},
+                "status": {
+                    "allocatable": {"cpu": node_cpu, "memory": node_memory},
+                    "conditions": [{"type": "Ready", "status": "True"}],
+                },
+            }
+            for index in range(nodes)
+        ]
+
+        self.deployments = {}
+        self.resource_version = 0
+        self.history = collections.deque(maxlen=history_limit)
+        self.watchers = set()
+        self.call_counts = collections.Counter()
+        # (namespace, name) -> monotonic time the Deployment became Available, to measure detection latency
+        self.ready_at = {}
+        self._rollouts = set()
+        self._runner = None
+        self.url = None
+
+    # Server lifecycle
+
+    def app(self):
+        app = web.Application(middlewares=[self._count_calls])
+        deployments = "/apis/apps/v1/namespaces/{namespace}/deployments"
+        app.router.add_get(deployments, self.list_deployments)
+        app.router.add_post(deployments, self.create_deployment)
+        app.router.add_get(deployments + "/{name}", self.get_deployment)
+        app.router.add_patch(deployments + "/{name}", self.apply_deployment)
+        app.router.add_delete(deployments + "/{name}", self.delete_deployment)
+        app.router.add_get("/apis/apps/v1/deployments", self.list_deployments)
+        # Pods and events are served empty, the runner only reads them for timings
+        app.router.add_get("/api/v1/namespaces/{namespace}/pods", self.empty_list)
+        app.router.add_get("/api/v1/namespaces/{namespace}/events", self.empty_list)
+        app.router.add_get("/api/v1/nodes", self.list_nodes)
+        app.router.add_get("/api/v1/pods", self.empty_list)
+        return app
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        for rollout in list(self._rollouts):
+            rollout.cancel()
+        for queue in list(self.watchers):
+            queue.put_nowait(None)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @web.middleware
+    async def _count_calls(self, request, handler):
+        """Counts calls by verb and resource, e.g. create deployments or watch deployments"""
+        resource = next((kind for kind in ("deployments", "pods", "events", "nodes") if f"/{kind}" in request.path), request.path)
+        named = not request.path.endswith(f"/{resource}")
+        if request.method == "GET":
+            verb = "get" if named else "watch" if request.query.get("watch", "").lower() == "true" else "list"
+        else:
+            verb = {"POST": "create", "PATCH": "patch" if request.content_type == "application/merge-patch+json" else "apply", "DELETE": "delete"}.get(request.method, request.method)
+        self.call_counts[f"{verb} {resource}"] += 1
+        return await handler(request)
+
+    # Object store
+
+    def _next_version(self):
+        self.resource_version += 1
+        return str(self.resource_version)
+
+    def _emit(self, event_type, obj):
+        event = (int(obj["metadata"]["resourceVersion"]), event_type, json.loads(json.dumps(obj)))
+        self.history.append(event)
+        for queue in list(self.watchers):
+            queue.put_nowait(event)
+
+    def _store(self, namespace, obj, event_type):
+        obj["metadata"]["namespace"] = namespace
+        obj["metadata"]["resourceVersion"] = self._next_version()
+        self.deployments[(namespace, obj["metadata"]["name"])] = obj
+        self._emit(event_type, obj)
+
+    def _new_deployment(self, namespace, body):
+        obj = json.loads(json.dumps(body))
+        obj.setdefault("apiVersion", "apps/v1")
+        obj.setdefault("kind", "Deployment")
+        obj["metadata"].setdefault("labels", {})
+        obj["metadata"]["uid"] = f"{namespace}-{obj['metadata']['name']}-{self.resource_version}"
+        obj["metadata"]["creationTimestamp"] = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        obj["metadata"]["generation"] = 1
+        obj["status"] = {
+            "replicas": 0,
+            "conditions": [
+                {"type": "Progressing", "status": "True", "reason": "NewReplicaSetCreated", "message": "Created new replica set"},
+                {"type": "Available", "status": "False", "reason": "MinimumReplicasUnavailable", "message": "Deployment does not have minimum availability."},
+            ],
+        }
+        return obj
+
+    async def _rollout(self, namespace, name):
+        await asyncio.sleep(max(0.0, self.rollout_delay + random.uniform(-self.rollout_jitter, self.rollout_jitter)))
+        obj = self.deployments.get((namespace, name))
+        if obj is None:
+            return
+        replicas = obj["spec"].get("replicas", 1)
+        if random.random() < self.failure_rate:
+            obj["status"]["conditions"][0] = {
+                "type": "Progressing",
+                "status": "False",
+                "reason": "ProgressDeadlineExceeded",
+                "message": f'ReplicaSet "{name}" has timed out progressing.',
+            }
+        else:
+            obj["status"].update(replicas=replicas, readyReplicas=replicas, availableReplicas=replicas)
+            obj["status"]["conditions"] = [
+                {"type": "Progressing", "status": "True", "reason": "NewReplicaSetAvailable", "message": "ReplicaSet has successfully progressed."},
+                {"type": "Available", "status": "True", "reason": "MinimumReplicasAvailable", "message": "Deployment has minimum availability."},
+            ]
+            self.ready_at[(namespace, name)] = time.monotonic()
+        self._store(namespace, obj, "MODIFIED")
+
+    def _start_rollout(self, namespace, name):
+        rollout = asyncio.create_task(self._rollout(namespace, name))
+        self._rollouts.add(rollout)
+        rollout.add_done_callback(self._rollouts.discard)
+
+    # Selectors
+
+    @staticmethod
+    def _matches(obj, request):
+        namespace = request.match_info.get("namespace")
+        if namespace is not None and obj["metadata"].get("namespace") != namespace:
+            return False
+        labels = obj["metadata"].get("labels") or {}
+        for requirement in filter(None, request.query.get("labelSelector", "").split(",")):
+            if "=" in requirement:
+                key, value = requirement.split("=", 1)
+                if labels.get(key) != value:
+                    return False
+            elif requirement not in labels:
+                return False
+        for requirement in filter(None, request.query.get("fieldSelector", "").split(",")):
+            key, value = requirement.split("=", 1)
+            if key == "metadata.name" and obj["metadata"]["name"] != value:
+                return False
+            if key == "metadata.namespace" and obj["metadata"].get("namespace") != value:
+                return False
+        return True
+
+    # Handlers
+
+    def _throttled(self):
+        if random.random() < self.throttle_rate:
+            return web.json_response(
+                {"kind": "Status", "status": "Failure", "reason": "TooManyRequests", "code": 429},
+                status=429,
+                headers={"Retry-After": "1"},
+            )
+        return None
+
+    @staticmethod
+    def _status(code, reason, message):
+        return web.json_response(
+            {"kind": "Status", "apiVersion": "v1", "status": "Failure", "reason": reason, "message": message, "code": code},
+            status=code,
+        )
+
+    async def empty_list(self, request, items=()):
+        if request.query.get("watch", "").lower() == "true":
+            return await self.watch_static(request)
+        return web.json_response({"kind": "List", "apiVersion": "v1", "metadata": {"resourceVersion": str(self.resource_version)}, "items": list(items)})
+
+    async def list_nodes(self, request):
+        return await self.empty_list(request, self.nodes)
+
+    async def watch_static(self, request):
+        """Watches of resources that never change, held open until the watch timeout with bookmarks"""
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        await response.prepare(request)
+        timeout = float(request.query.get("timeoutSeconds", 1800))
+        if self.watch_timeout is not None:
+            timeout = min(timeout, self.watch_timeout)
+        deadline = time.monotonic() + timeout
+        try:
+            while (remaining := deadline - time.monotonic()) > 0:
+                await asyncio.sleep(min(remaining, 5))
+                if request.query.get("allowWatchBookmarks", "").lower() == "true":
+                    await self._write(response, "BOOKMARK", {"kind": "Status", "metadata": {"resourceVersion": str(self.resource_version)}})
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        return response
+
+    async def list_deployments(self, request):
+        if request.query.get("watch", "").lower() == "true":
+            return await self.watch_deployments(request)
+        items = [obj for obj in self.deployments.values() if self._matches(obj, request)]
+        return web.json_response({
+            "kind": "DeploymentList",
+            "apiVersion": "apps/v1",
+            "metadata": {"resourceVersion": str(self.resource_version)},
+            "items": items,
+        })
+
+    async def watch_deployments(self, request):
+        self.watch_versions.append(request.query.get("resourceVersion"))
+        fault, code = self.watch_faults.popleft() if self.watch_faults else (None, None)
+        if fault == "status":
+            return self._status(code, "Expired" if code == 410 else "InternalError", f"injected {code}")
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        await response.prepare(request)
+        if fault == "event":
+            await self._write(response, "ERROR", {"kind": "Status", "code": code, "reason": "Expired", "message": f"injected {code}"})
+            return response
+        if fault == "truncated":
+            await response.write(b'{"type": "MODIFIED", "object": {"metadata": {"na\n')
+            return response
+
+        timeout = float(request.query.get("timeoutSeconds", 1800))
+        if self.watch_timeout is not None:
+            timeout = min(timeout, self.watch_timeout)
+        deadline = time.monotonic() + timeout
+        bookmarks = request.query.get("allowWatchBookmarks", "").lower() == "true"
+        since = int(request.query.get("resourceVersion") or self.resource_version)
+
+        queue = asyncio.Queue()
+        self.watchers.add(queue)
+        try:
+            # Replay what the client missed, or tell it to relist when that history has been compacted
+            if self.history and since < self.history[0][0] - 1:
+                await self._write(response, "ERROR", {"kind": "Status", "code": 410, "reason": "Expired", "message": f"too old resource version: {since}"})
+                return response
+            for event in list(self.history):
+                if event[0] > since:
+                    queue.put_nowait(event)
+
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=min(remaining, self.bookmark_interval))
+                except TimeoutError:
+                    if bookmarks:
+                        await self._write(response, "BOOKMARK", {"kind": "Deployment", "apiVersion": "apps/v1", "metadata": {"resourceVersion": str(self.resource_version)}})
+                    continue
+                if event is None:
+                    break
+                version, event_type, obj = event
+                if version > since and self._matches(obj, request):
+                    await self._write(response, event_type, obj)
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            self.watchers.discard(queue)
+        return response
+
+    @staticmethod
+    async def _write(response, event_type, obj):
+        await response.write((json.dumps({"type": event_type, "object": obj}) + "\n").encode())
+
+    async def create_deployment(self, request):
+        throttled = self._throttled()
+        if throttled is not None:
+            return throttled
+        namespace = request.match_info["namespace"]
+        body = await request.json()
+        name = body["metadata"]["name"]
+        if (namespace, name) in self.deployments:
+            return self._status(409, "AlreadyExists", f'deployments.apps "{name}" already exists')
+        obj = self._new_deployment(namespace, body)
+        self._store(namespace, obj, "ADDED")
+        self._start_rollout(namespace, name)
+        return web.json_response(obj, status=201)
+
+    async def apply_deployment(self, request):
+        if request.content_type == "application/merge-patch+json":
+            return await self.merge_patch_deployment(request)
+        throttled = self._throttled()
+        if throttled is not None:
+            return throttled
+        namespace, name = request.match_info["namespace"], request.match_info["name"]
+        body = json.loads(await request.text())
+        existing = self.deployments.get((namespace, name))
+        if existing is None:
+            obj = self._new_deployment(namespace, body)
+            self._store(namespace, obj, "ADDED")
+            self._start_rollout(namespace, name)
+            return web.json_response(obj, status=201)
+        existing["spec"] = body.get("spec", existing["spec"])
+        existing["metadata"]["labels"] = {**existing["metadata"].get("labels", {}), **body["metadata"].get("labels", {})}
+        existing["metadata"]["annotations"] = {**existing["metadata"].get("annotations", {}), **body["metadata"].get("annotations", {})}
+        self._store(namespace, existing, "MODIFIED")
+        return web.json_response(existing)
+
+    async def merge_patch_deployment(self, request):
+        """Merges metadata labels and annotations, a resourceVersion in the patch is a precondition"""
+        namespace, name = request.match_info["namespace"], request.match_info["name"]
+        existing = self.deployments.get((namespace, name))
+        if existing is None:
+            return self._status(404, "NotFound", f'deployments.apps "{name}" not found')
+        metadata = (await request.json()).get("metadata", {})
+        if metadata.get("resourceVersion") not in (None, existing["metadata"]["resourceVersion"]):
+            return self._status(409, "Conflict", f'Operation cannot be fulfilled on deployments.apps "{name}": the object has been modified')
+        for field in ("labels", "annotations"):
+            merged = {**(existing["metadata"].get(field) or {}), **(metadata.get(field) or {})}
+            existing["metadata"][field] = {key: value for key, value in merged.items() if value is not None}
+        self._store(namespace, existing, "MODIFIED")
+        return web.json_response(existing)
+
+    async def get_deployment(self, request):
+        obj = self.deployments.get((request.match_info["namespace"], request.match_info["name"]))
+        if obj is None:
+            return self._status(404, "NotFound", f'deployments.apps "{request.match_info["name"]}" not found')
+        return web.json_response(obj)
+
+    async def delete_deployment(self, request):
+        obj = self.deployments.pop((request.match_info["namespace"], request.match_info["name"]), None)
+        if obj is None:
+            return self._status(404, "NotFound", f'deployments.apps "{request.match_info["name"]}" not found')
+        obj["metadata"]["resourceVersion"] = self._next_version()
+        self._emit("DELETED", obj)
+        return web.json_response({"kind": "Status", "apiVersion": "v1", "status": "Success"})
@@ -0,0 +1,120 @@
+# Benchmarks the runner's cold start, from importing its entrypoint to its first ApiClient, against a budget
+# uv run --frozen --module python.dev.startup --budget-ms 1000
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from ..jobs.functions.helpers import markdown_table
+
+# Root of the checkout, the entrypoint is imported as python.main from here
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+PHASES = ("import", "kubeconfig", "client")
+
+# Runs in a fresh interpreter, the kubeconfig phase includes importing the client package it needs
+PROBE = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from kubernetes_asyncio import client, config
+
+
+async def connect():
+    await config.load_kube_config(config_file=sys.argv[1])
+    loaded = time.perf_counter()
+    api_client = client.ApiClient()
+    built = time.perf_counter()
+    await api_client.close()
+    return loaded, built
+
+
+loaded, built = asyncio.run(connect())
+print(json.dumps({{"import": imported - start, "kubeconfig": loaded - imported, "client": built - loaded}}))
+"""
+
+# Token auth against an address that is never called, loading it reads no files and opens no connections
+KUBECONFIG = """
+apiVersion: v1
+kind: Config
+clusters:
+  - name: startup
+    cluster: {server: "https://127.0.0.1:6443", insecure-skip-tls-verify: true}
+users:
+  - name: startup
+    user: {token: startup}
+contexts:
+  - name: startup
+    context: {cluster: startup, user: startup}
+current-context: startup
+"""
+
+
+def parse_importtime(output):
+    """Parses -X importtime output into {module: (self us, cumulative us)}"""
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure(module, kubeconfig, importtime=False):
+    """Starts the runner in a fresh interpreter, returning the milliseconds of each phase and, under importtime,
+    {module: (self us, cumulative us)} of every import
+    """
+    result = subprocess.run(
+        [sys.executable, *(["-X", "importtime"] if importtime else []), "-c", PROBE.format(module=module), kubeconfig],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    phases = {phase: seconds * 1000 for phase, seconds in json.loads(result.stdout).items()}
+    return phases, parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the runner's cold start against a budget")
+    parser.add_argument("--module", default="python.main")
+    parser.add_argument("--kubeconfig", help="Kubeconfig to load, an offline one by default")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", 1000)))
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".yaml") as fh:
+        fh.write(KUBECONFIG)
+        fh.flush()
+        kubeconfig = args.kubeconfig or fh.name
+
+        # The first run compiles bytecode, it isn't what a runner pod with a built image pays
+        measure(args.module, kubeconfig)
+        runs = [measure(args.module, kubeconfig)[0] for _ in range(args.runs)]
+        _, imports = measure(args.module, kubeconfig, importtime=True)
+
+    rows = []
+    for phase in (*PHASES, "total"):
+        times = [sum(run.values()) if phase == "total" else run[phase] for run in runs]
+        rows.append([phase, f"{statistics.median(times):.1f}ms", f"{min(times):.1f}ms", f"{max(times):.1f}ms"])
+    median = statistics.median(sum(run.values()) for run in runs)
+    print(markdown_table(["Phase", "Median", "Min", "Max"], rows))
+    print()
+    print(f"Budget: {args.budget_ms:.0f}ms over {args.runs} runs of {args.module}")
+    print()
+    slowest = sorted(imports.items(), key=lambda item: item[1][0], reverse=True)[: args.top]
+    print(markdown_table(["Import", "Self", "Cumulative"], [[name, f"{s / 1000:.1f}ms", f"{c / 1000:.1f}ms"] for name, (s, c) in slowest]))
+
+    if median > args.budget_ms:
+        print(f"{args.module} took {median:.1f}ms to its first ApiClient, over the {args.budget_ms:.0f}ms budget", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+# Capacity-aware admission, jobs are only submitted once a node in their worker pool has room for their requests
+
+import asyncio
+import decimal
+import os
+import re
+from kubernetes_asyncio import client
+from .informer import Informer
+from .logger import get_logger
+
+_BINARY_SUFFIXES = {"Ki": 2**10, "Mi": 2**20, "Gi": 2**30, "Ti": 2**40, "Pi": 2**50, "Ei": 2**60}
+_DECIMAL_SUFFIXES = {"n": "1e-9", "u": "1e-6", "m": "1e-3", "": "1", "k": "1e3", "M": "1e6", "G": "1e9", "T": "1e12", "P": "1e15", "E": "1e18"}
+_QUANTITY = re.compile(r"^([+-]?[0-9.]+(?:[eE][+-]?[0-9]+)?)([a-zA-Z]*)$")
+
+log = get_logger("Capacity")
+
+
+class CapacityError(Exception):
+    """Raised when a job's requests can never fit on any node of its worker pool"""
+
+
+def parse_quantity(quantity):
+    """Parses a Kubernetes resource quantity such as 100m, 1.5 or 512Mi into a Decimal"""
+    if quantity is None:
+        return decimal.Decimal(0)
+    match = _QUANTITY.match(str(quantity).strip())
+    if match is None:
+        raise ValueError(f"Invalid resource quantity {quantity!r}")
+    number, suffix = match.groups()
+    if suffix in _BINARY_SUFFIXES:
+        return decimal.Decimal(number) * _BINARY_SUFFIXES[suffix]
+    if suffix in _DECIMAL_SUFFIXES:
+        return decimal.Decimal(number) * decimal.Decimal(_DECIMAL_SUFFIXES[suffix])
+    raise ValueError(f"Invalid resource quantity {quantity!r}")
+
+
+def _resources(requests):
+    requests = requests or {}
+    return (parse_quantity(requests.get("cpu")), parse_quantity(requests.get("memory")))
+
+
+def pod_requests(pod):
+    """Effective (cpu, memory) requests of a raw pod, the larger of its containers' sum and any init container"""
+    spec = pod.get("spec") or {}
+    cpu, memory = decimal.Decimal(0), decimal.Decimal(0)
+    for container in spec.get("containers") or ():
+        container_cpu, container_memory = _resources((container.get("resources") or {}).get("requests"))
+        cpu, memory = cpu + container_cpu, memory + container_memory
+    for container in spec.get("initContainers") or ():
+        init_cpu, init_memory = _resources((container.get("resources") or {}).get("requests"))
+        cpu, memory = max(cpu, init_cpu), max(memory, init_memory)
+    return cpu, memory
+
+
+class Node:
+    """The scheduling relevant parts of a node, as decoded from the API's JSON"""
+
+    __slots__ = ("name", "labels", "taints", "cpu", "memory", "schedulable")
+
+    def __init__(self, name, labels=None, taints=(), cpu=0, memory=0, schedulable=True):
+        self.name = name
+        self.labels = labels or {}
+        self.taints = taints
+        self.cpu = decimal.Decimal(cpu)
+        self.memory = decimal.Decimal(memory)
+        self.schedulable = schedulable
+
+    @classmethod
+    def from_raw(cls, obj):
+        metadata = obj.get("metadata") or {}
+        spec = obj.get("spec") or {}
+        status = obj.get("status") or {}
+        ready = any(
+            condition.get("type") == "Ready" and condition.get("status") == "True"
+            for condition in status.get("conditions") or ()
+        )
+        cpu, memory = _resources(status.get("allocatable"))
+        return cls(
+            name=metadata.get("name"),
+            labels=metadata.get("labels") or {},
+            taints=tuple((taint.get("key"), taint.get("value"), taint.get("effect")) for taint in spec.get("taints") or ()),
+            cpu=cpu,
+            memory=memory,
+            schedulable=ready and not spec.get("unschedulable", False),
+        )
+
+    def matches(self, node_selector_key, node_selector_value):
+        """Whether the pool's node selector selects the node and the pool's toleration tolerates its taints"""
+        if self.labels.get(node_selector_key) != node_selector_value:
+            return False
+        # Jobs tolerate only their pool's NoSchedule taint, see build_tolerations
+        return all(
+            effect == "PreferNoSchedule" or (key == node_selector_key and value == node_selector_value and effect == "NoSchedule")
+            for key, value, effect in self.taints
+        )
+
+
+class _NodeInformer(Informer):
+    def __init__(self, inventory, api_client):
+        super().__init__(api_client, "nodes")
+        self.inventory = inventory
+
+    async def _list(self, **kwargs):
+        return await client.CoreV1Api(api_client=self.api_client).list_node(**kwargs)
+
+    def _project(self, obj):
+        return Node.from_raw(obj)
+
+    def _relist(self, items):
+        self.inventory.nodes = {node.name: node for node in items}
+        self.inventory.changed()
+
+    def _dispatch(self, event_type, node):
+        if event_type == "DELETED":
+            self.inventory.nodes.pop(node.name, None)
+        else:
+            self.inventory.nodes[node.name] = node
+        self.inventory.changed()
+
+    def _fail(self, e):
+        super()._fail(e)
+        self.inventory.changed()
+
+
+class _PodInformer(Informer):
+    """Bound, non-terminal pods across the cluster, what they request and the job they belong to, the load on each node"""
+
+    def __init__(self, inventory, api_client):
+        super().__init__(api_client, "pods")
+        self.inventory = inventory
+
+    async def _list(self, **kwargs):
+        # Pods that have finished no longer hold their requests, they leave the watch as DELETED
+        return await client.CoreV1Api(api_client=self.api_client).list_pod_for_all_namespaces(
+            field_selector="status.phase!=Succeeded,status.phase!=Failed", **kwargs
+        )
+
+    def _project(self, obj):
+        metadata = obj.get("metadata") or {}
+        # Jobs label their pods app=<name>, see build_pod_template
+        owner = (metadata.get("namespace"), (metadata.get("labels") or {}).get("app"))
+        return (metadata.get("namespace"), metadata.get("name")), (obj.get("spec") or {}).get("nodeName"), pod_requests(obj), owner
+
+    def _relist(self, items):
+        self.inventory.pods = {key: (node_name, requests, owner) for key, node_name, requests, owner in items}
+        self.inventory.changed()
+
+    def _dispatch(self, event_type, item):
+        key, node_name, requests, owner = item
+        if event_type == "DELETED":
+            self.inventory.pods.pop(key, None)
+        else:
+            self.inventory.pods[key] = (node_name, requests, owner)
+        self.inventory.changed()
+
+    def _fail(self, e):
+        super()._fail(e)
+        self.inventory.changed()
+
+
+class Reservation:
+    """Requests held on nodes for an admitted job until its pods are counted by the pod watch
+
+    owner is the (namespace, app label) of the job's pods, each of them bound to a node takes over one placement.
+    """
+
+    def __init__(self, inventory, placements, owner=None):
+        self.inventory = inventory
+        self.placements = placements
+        self.owner = owner
+
+    def pending(self, bound):
+        """The placements not yet taken over by one of the job's bound pods"""
+        return self.placements[bound:]
+
+    def release(self):
+        if self.placements:
+            self.placements = []
+            self.inventory.reservations.discard(self)
+            self.inventory.changed()
+
+
+class ClusterInventory:
+    """Node allocatable resources and pod requests kept current by watches, admission makes no API calls"""
+
+    def __init__(self, api_client):
+        self.api_client = api_client
+        self.nodes = {}
+        self.pods = {}
+        self.reservations = set()
+        # Replaced on every change, so a queued job waits on the event current when it last checked
+        self._changed = asyncio.Event()
+        self._informers = [_NodeInformer(self, api_client), _PodInformer(self, api_client)]
+
+    def start(self):
+        for informer in self._informers:
+            informer.start()
+
+    async def stop(self):
+        for informer in self._informers:
+            await informer.stop()
+
+    async def sync(self):
+        """Waits for the first list of nodes and pods, raising the error of a watch that couldn't list"""
+        for informer in self._informers:
+            await informer.synced.wait()
+        self._check()
+
+    def _check(self):
+        """Raises the error of a node or pod watch that failed for good"""
+        for informer in self._informers:
+            if informer.error is not None:
+                raise informer.error
+
+    def changed(self):
+        """Wakes every queued job to check whether it now fits"""
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def free(self):
+        """Free (cpu, memory) per schedulable node, after pod requests and reservations
+
+        A bound pod counts on its node, so it no longer counts in its job's reservation.
+        """
+        used = {}
+        bound = {}
+        for node_name, (cpu, memory), owner in self.pods.values():
+            if node_name:
+                node_cpu, node_memory = used.get(node_name, (0, 0))
+                used[node_name] = (node_cpu + cpu, node_memory + memory)
+                bound[owner] = bound.get(owner, 0) + 1
+        for reservation in self.reservations:
+            for node_name, (cpu, memory) in reservation.pending(bound.get(reservation.owner, 0)):
+                node_cpu, node_memory = used.get(node_name, (0, 0))
+                used[node_name] = (node_cpu + cpu, node_memory + memory)
+        return {
+            node.name: (node.cpu - used.get(node.name, (0, 0))[0], node.memory - used.get(node.name, (0, 0))[1])
+            for node in self.nodes.values()
+            if node.schedulable
+        }
+
+    def place(self, node_selector_key, node_selector_value, requests, replicas):
+        """Places each replica on the matching node with the most free CPU, returning the placements or None"""
+        free = self.free()
+        candidates = [node.name for node in self.nodes.values() if node.name in free and node.matches(node_selector_key, node_selector_value)]
+        placements = []
+        for _ in range(replicas):
+            fitting = [name for name in candidates if free[name][0] >= requests[0] and free[name][1] >= requests[1]]
+            if not fitting:
+                return None
+            name = max(fitting, key=lambda name: free[name][0])
+            free[name] = (free[name][0] - requests[0], free[name][1] - requests[1])
+            placements.append((name, requests))
+        return placements
+
+    def check_fits_at_all(self, node_selector_key, node_selector_value, requests):
+        """Raises CapacityError when no node of the pool could hold the requests even when empty"""
+        pool = [node for node in self.nodes.values() if node.matches(node_selector_key, node_selector_value)]
+        if not pool:
+            raise CapacityError(f"No nodes match {node_selector_key}={node_selector_value}")
+        if not any(node.cpu >= requests[0] and node.memory >= requests[1] for node in pool):
+            largest = max(pool, key=lambda node: (node.cpu, node.memory))
+            raise CapacityError(
+                f"Requests of cpu={requests[0]} memory={requests[1]} don't fit on any {node_selector_key}={node_selector_value} node, "
+                f"the largest ({largest.name}) has cpu={largest.cpu} memory={largest.memory} allocatable"
+            )
+
+    async def admit(self, node_selector_key, node_selector_value, cpu, memory, replicas=1, log_name="Capacity", owner=None):
+        """Waits until the job's replicas fit on its pool and reserves room for them, returning a Reservation
+
+        owner is the (namespace, app label) of the job's pods. Raises CapacityError right away if they never can,
+        and the error of a node or pod watch that fails while queued. Cancel or time out the call to give up queueing.
+        """
+        await self.sync()
+
+        requests = (parse_quantity(cpu), parse_quantity(memory))
+        self.check_fits_at_all(node_selector_key, node_selector_value, requests)
+        queued = False
+        while True:
+            changed = self._changed
+            placements = self.place(node_selector_key, node_selector_value, requests, replicas)
+            if placements is not None:
+                reservation = Reservation(self, placements, owner)
+                self.reservations.add(reservation)
+                if queued:
+                    log.info("Capacity freed up, admitted onto %s", [name for name, _ in placements], extra={"job": log_name})
+                return reservation
+            if not queued:
+                log.info(
+                    "No room for %s x cpu=%s memory=%s on %s=%s nodes, queued until capacity frees up..",
+                    replicas, cpu, memory, node_selector_key, node_selector_value, extra={"job": log_name},
+                )
+                queued = True
+            await changed.wait()
+            self._check()
+            # The pool may have shrunk while queued
+            self.check_fits_at_all(node_selector_key, node_selector_value, requests)
+
+
+_inventories = {}
+
+
+def get_inventory(api_client):
+    """Returns the client's shared inventory, starting its node and pod watches on first use"""
+    inventory = _inventories.get(api_client)
+    if inventory is None:
+        inventory = _inventories[api_client] = ClusterInventory(api_client)
+        inventory.start()
+    return inventory
+
+
+async def stop_inventories(api_client=None):
+    """Stops the inventories using api_client, or every inventory, before the client they use is closed"""
+    for key, inventory in list(_inventories.items()):
+        if api_client is None or key is api_client:
+            await inventory.stop()
+            del _inventories[key]
+
+
+def is_enabled(kwargs):
+    return str(kwargs.get("admission", os.getenv("CAPACITY_ADMISSION", "False"))).lower() == "true"
@@ -0,0 +1,91 @@
+# Shared Kubernetes API client, one pooled aiohttp session reused by every job in the run
+
+import os
+import ssl
+import aiohttp
+from kubernetes_asyncio import client
+
+
+class ClientManager:
+    """Owns the run's ApiClient, its connection pool limits and connection reuse metrics"""
+
+    def __init__(self, pool_size=None, limit_per_host=None, keepalive_timeout=None):
+        self.pool_size = int(pool_size or os.getenv("CLIENT_POOL_SIZE", 100))
+        # 0 leaves the per-host limit to the overall pool size
+        self.limit_per_host = int(limit_per_host or os.getenv("CLIENT_LIMIT_PER_HOST", 0))
+        self.keepalive_timeout = float(keepalive_timeout or os.getenv("CLIENT_KEEPALIVE_TIMEOUT", 30))
+        self.api_client = None
+        self.stats = {
+            "requests": 0,
+            "in_flight": 0,
+            "peak_in_flight": 0,
+            "connections_created": 0,
+            "connections_reused": 0,
+        }
+
+    def _ssl_context(self, configuration):
+        ssl_context = ssl.create_default_context(cafile=configuration.ssl_ca_cert)
+        if configuration.cert_file:
+            ssl_context.load_cert_chain(configuration.cert_file, keyfile=configuration.key_file)
+        if not configuration.verify_ssl:
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+        return ssl_context
+
+    def _trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            self.stats["requests"] += 1
+            self.stats["in_flight"] += 1
+            self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.stats["in_flight"])
+
+        async def on_request_done(session, context, params):
+            self.stats["in_flight"] -= 1
+
+        async def on_connection_create_end(session, context, params):
+            self.stats["connections_created"] += 1
+
+        async def on_connection_reuseconn(session, context, params):
+            self.stats["connections_reused"] += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_done)
+        trace_config.on_request_exception.append(on_request_done)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        return trace_config
+
+    async def start(self, configuration=None):
+        """Builds the ApiClient from the loaded kubeconfig, swapping in a session with the configured limits"""
+        configuration = configuration or client.Configuration.get_default_copy()
+        configuration.connection_pool_maxsize = self.pool_size
+        self.api_client = client.ApiClient(configuration=configuration)
+
+        rest_client = self.api_client.rest_client
+        await rest_client.pool_manager.close()
+        rest_client.pool_manager = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ssl=self._ssl_context(configuration),
+            ),
+            trust_env=True,
+            trace_configs=[self._trace_config()],
+            # Matches the kubernetes_asyncio default, large watch events can exceed aiohttp's read buffer
+            read_bufsize=2**21,
+        )
+        return self.api_client
+
+    def metrics(self):
+        """Returns a snapshot of the request and connection counters"""
+        metrics = dict(self.stats)
+        opened = metrics["connections_created"] + metrics["connections_reused"]
+        metrics["reuse_ratio"] = round(metrics["connections_reused"] / opened, 3) if opened else 0.0
+        return metrics
+
+    async def close(self):
+        if self.api_client is not None:
+            await self.api_client.close()
+            self.api_client = None
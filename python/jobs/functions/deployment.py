@@ -3,272 +3,502 @@
 import asyncio
 import json
 import os
-import sys
-import traceback
-from kubernetes_asyncio import client, watch
-from .helpers import get_timestamp
+import random
+import aiohttp
+from kubernetes_asyncio import client
+from kubernetes_asyncio.client.exceptions import ApiException
+from .helpers import get_run_id, RUN_LABEL
+from .informer import get_informer, stop_informers
+from .logger import bind, get_logger
+from . import capacity, history, logs, readiness, reuse, teardown
+from .timing import collect_pod_timings, get_timer
+
+log = get_logger()
 
 
 async def main(**kwargs):
-    try:
-        if kwargs.get("monitor", False):
-            status = await deployment(**kwargs)
-            return status
-        else:
-            name, status = await deployment(**kwargs)
-            return name, status
+    # Unexpected errors propagate to the run's supervisor, which reports the job as Failed
+    if kwargs.get("monitor", False):
+        status = await deployment(**kwargs)
+        return status
+    else:
+        name, status = await deployment(**kwargs)
+        return name, status
+
+
+def _compact(obj):
+    """Drops unset fields, a None in a request body would be sent as an explicit null"""
+    return {key: value for key, value in obj.items() if value is not None}
+
+
+def build_tolerations(node_selector_key, node_selector_value):
+    """Tolerates the NoSchedule taint of the worker pool selected by the node selector"""
+    return [
+        {
+            "key": node_selector_key,
+            "operator": "Equal",
+            "value": node_selector_value,
+            "effect": "NoSchedule",
+        }
+    ]
+
+
+def build_pod_template(restart_policy=None, **kwargs):
+    """Renders the pod template a job's Deployment or Job runs, from the same arguments deployment() takes"""
+    name = kwargs["name"]
+    image = kwargs["image"]
+    container_name = kwargs["container_name"]
+    command = json.loads(kwargs["command"])
+    cpu_limit = kwargs.get("cpu_limit")
+    memory_limit = kwargs.get("memory_limit")
+    node_selector_key = kwargs.get("node_selector_key")
+    node_selector_value = kwargs.get("node_selector_value")
+
+    labels = {"app": name, RUN_LABEL: get_run_id()}
+
+    return {
+        "metadata": {"labels": labels},
+        "spec": _compact({
+            "containers": [
+                {
+                    "name": container_name,
+                    "image": image,
+                    "command": command,
+                    "resources": {
+                        "requests": {
+                            "cpu": cpu_limit,
+                            "memory": memory_limit,
+                        },
+                        "limits": {
+                            "cpu": cpu_limit,
+                            "memory": memory_limit,
+                        },
+                    },
+                },
+            ],
+            "nodeSelector": {node_selector_key: node_selector_value},
+            "tolerations": build_tolerations(node_selector_key, node_selector_value),
+            "restartPolicy": restart_policy,
+        }),
+    }
+
+
+def build_deployment_body(**kwargs):
+    """Renders the apps/v1 Deployment for a job from the same arguments deployment() takes
+
+    Bodies are plain dicts in the API's JSON shape, building them doesn't need the client's generated models.
+    """
+    name = kwargs["name"]
+    replicas = int(kwargs.get("replicas", 1))
+    progress_deadline_seconds = kwargs.get("progress_deadline_seconds")
+    if progress_deadline_seconds is not None:
+        progress_deadline_seconds = int(progress_deadline_seconds)
+
+    return {
+        "apiVersion": "apps/v1",
+        "kind": "Deployment",
+        "metadata": {"name": name, "labels": {"app": name, RUN_LABEL: get_run_id()}},
+        "spec": _compact({
+            "replicas": replicas,
+            "progressDeadlineSeconds": progress_deadline_seconds,
+            "selector": {"matchLabels": {"app": name}},
+            "template": build_pod_template(**kwargs),
+        }),
+    }
+
+
+def build_job_body(**kwargs):
+    """Renders the batch/v1 Job for a job whose workload runs to completion, replicas run as parallel pods
+
+    A failed perf run is reported rather than retried by default, and the Job can't outlive the job's watch.
+    ttlSecondsAfterFinished lets the cluster remove a finished Job the run could not clean up itself.
+    """
+    name = kwargs["name"]
+    replicas = int(kwargs.get("replicas", 1))
+    active_deadline_seconds = kwargs.get("active_deadline_seconds", kwargs.get("watch_timeout", 1200))
+    ttl_seconds_after_finished = kwargs.get("ttl_seconds_after_finished", 600)
+
+    return {
+        "apiVersion": "batch/v1",
+        "kind": "Job",
+        "metadata": {"name": name, "labels": {"app": name, RUN_LABEL: get_run_id()}},
+        "spec": _compact({
+            "completions": replicas,
+            "parallelism": replicas,
+            "backoffLimit": int(kwargs.get("backoff_limit", 0)),
+            "activeDeadlineSeconds": int(float(active_deadline_seconds)) if active_deadline_seconds is not None else None,
+            "ttlSecondsAfterFinished": int(ttl_seconds_after_finished) if ttl_seconds_after_finished is not None else None,
+            "template": build_pod_template(restart_policy="Never", **kwargs),
+        }),
+    }
+
+
+def build_body(**kwargs):
+    """Renders the Deployment, or the Job when the job's workload is job"""
+    if get_kind(kwargs) == "Job":
+        return build_job_body(**kwargs)
+    return build_deployment_body(**kwargs)
+
+
+def get_kind(kwargs):
+    """Kind of object a job runs, Deployments stay up until the completion job is done, Jobs run to completion"""
+    return "Job" if str(kwargs.get("workload", "deployment")).lower() == "job" else "Deployment"
+
+
+def _retry_delay(e, attempt, base_delay=0.5, max_delay=30):
+    """Honors Retry-After (capped at max_delay) when the API server sends it, otherwise exponential backoff with full jitter"""
+    retry_after = e.headers.get("Retry-After") if isinstance(e, ApiException) and e.headers else None
+    if retry_after is not None:
+        try:
+            return min(max_delay, max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+def _is_retryable(e):
+    if isinstance(e, ApiException):
+        return e.status == 429 or e.status >= 500
+    return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+async def submit_workload(api_client, body, namespace, server_side_apply=False, max_retries=5, field_manager="k8s-action-runner"):
+    """Creates or server-side applies a Deployment or Job, retrying throttled (429) and server (5xx) errors
+
+    Returns the number of attempts it took. Server-side apply makes re-submissions of the same spec
+    idempotent, where a plain create would fail with 409 Conflict.
+    """
+    if body["kind"] == "Job":
+        batch_api = client.BatchV1Api(api_client=api_client)
+        create, patch = batch_api.create_namespaced_job, batch_api.patch_namespaced_job
+    else:
+        apps_api = client.AppsV1Api(api_client=api_client)
+        create, patch = apps_api.create_namespaced_deployment, apps_api.patch_namespaced_deployment
+    # Set once a create was retried after a transport error, the lost request may have landed on the server
+    create_may_exist = False
+    for attempt in range(max_retries + 1):
+        try:
+            if server_side_apply:
+                await patch(
+                    name=body["metadata"]["name"],
+                    namespace=namespace,
+                    body=body,
+                    field_manager=field_manager,
+                    force=True,
+                    _content_type="application/apply-patch+yaml",
+                )
+            else:
+                await create(namespace=namespace, body=body)
+            return attempt + 1
+
+        except Exception as e:
+            if create_may_exist and isinstance(e, ApiException) and e.status == 409:
+                # Our earlier create landed but its response was lost
+                return attempt + 1
+            if attempt == max_retries or not _is_retryable(e):
+                raise
+            if not server_side_apply and not isinstance(e, ApiException):
+                create_may_exist = True
+            await asyncio.sleep(_retry_delay(e, attempt))
+
+
+def _completed_key(namespace, completion_job_name):
+    return f"{namespace}/{completion_job_name}:completed"
+
 
-    except Exception as e:
-        print(f"[{get_timestamp()}] Unexpected Error: ", e)
-        traceback.print_exc(file=sys.stdout)
-        exit(1)
+async def _wait_for_completion(informer, completion_job_name, log_name, show_status=False, simulated_run_seconds=15, kind="Deployment"):
+    """Waits for the completion job to run, returning Completed, or Failed if it fails or is deleted first
+
+    A completion Deployment is given simulated_run_seconds once it is up, a completion Job is done when it succeeds.
+    """
+    # The first job to see the completion job finish publishes the outcome, so a job that only becomes
+    # ready after the completion job has been cleaned up doesn't wait on events that will never come
+    completed_key = _completed_key(informer.namespace, completion_job_name)
+    if readiness.is_done(completed_key):
+        return "Completed" if readiness.is_ready(completed_key) else "Failed"
+
+    async with informer.subscribe(completion_job_name) as events:
+        async for event_type, status in events:
+            if show_status:
+                log.debug("Monitoring main job status..\n %s", status, extra={"job": log_name, "phase": "Watch"})
+
+            if event_type == "DELETED" and readiness.is_ready(completed_key):
+                return "Completed"
+
+            if status.failed or event_type == "DELETED":
+                log.warning(
+                    "Completion job %s did not complete: %s %s", completion_job_name, event_type, status, extra={"job": log_name, "phase": "Watch"}
+                )
+                readiness.mark_failed(completed_key, f"{event_type} {status}")
+                return "Failed"
+
+            if kind == "Job":
+                if status.succeeded:
+                    readiness.mark_ready(completed_key)
+                    return "Completed"
+
+            elif status.is_ready(status.replicas):
+                # Sleep to simulate the application run, 15 seconds by default
+                await asyncio.sleep(simulated_run_seconds)
+                readiness.mark_ready(completed_key)
+                return "Completed"
 
 
 async def deployment(**kwargs):
     try:
         # Setting variables
         monitor = kwargs["monitor"]
-        completion_job_name = os.getenv("COMPLETION_JOB_NAME")
-        completion_job_namespace = os.getenv("COMPLETION_JOB_NAMESPACE")
+        completion_job_name = kwargs.get("completion_job_name", os.getenv("COMPLETION_JOB_NAME"))
+        completion_job_namespace = kwargs.get("completion_job_namespace", os.getenv("COMPLETION_JOB_NAMESPACE"))
+        completion_job_kind = get_kind({"workload": kwargs.get("completion_job_workload", os.getenv("COMPLETION_JOB_WORKLOAD"))})
 
         name = kwargs["name"]
         namespace = kwargs["namespace"]
 
-        replicas = kwargs.get("replicas", 1)
-        progress_deadline_seconds = kwargs.get("progress_deadline_seconds")
-
-        image = kwargs["image"]
-        container_name = kwargs["container_name"]
-        command = json.loads(kwargs["command"])
-        cpu_limit = kwargs.get("cpu_limit")
-        memory_limit = kwargs.get("memory_limit")
-        node_selector_key = kwargs.get("node_selector_key")
-        node_selector_value = kwargs.get("node_selector_value")
+        replicas = int(kwargs.get("replicas", 1))
 
         set_ready = kwargs["set_ready"]
         wait_for_ready = kwargs["wait_for_ready"]
         wait_for_ready_var = kwargs["wait_for_ready_var"]
         wait_description = kwargs["wait_description"]
+        wait_timeout = kwargs.get("wait_timeout", 600)
+        watch_timeout = float(kwargs.get("watch_timeout", 1200))
         main_job_description = kwargs.get("main_job_description", "GitHub Action Job")
 
         log_name = kwargs["log_name"]
+        # Every record this job logs, and those of the tasks it starts, carries the job and its namespace
+        bind(job=log_name, namespace=namespace, phase=None)
         log_description = kwargs["log_description"]
         cleanup_object = kwargs["cleanup_object"]
+        # Jobs run their workload to completion and are done when it exits, Deployments stay up until the completion job is
+        kind = get_kind(kwargs)
 
-        # Initialize Kubernetes client
-        api_client = client.ApiClient()
-        apps_api = client.AppsV1Api(api_client=api_client)
-        rest_client = api_client.rest_client
+        # Reused environments are adopted from earlier runs by spec hash and released instead of deleted.
+        # The completion job is always created fresh, other jobs watch for it under the run's label
+        reusable = (
+            str(kwargs.get("reuse", False)).lower() == "true" and not monitor and name != completion_job_name and kind == "Deployment"
+        )
+        reuse_ttl = float(kwargs.get("reuse_ttl", 3600))
+        # The lease outlives the longest this job can run, a run that dies holds it no longer than that
+        lease_seconds = watch_timeout + 300
+        leased = False
+        reservation = None
+
+        # Use the run's shared client when provided, otherwise own a client for this job
+        api_client = kwargs.get("api_client")
+        owns_client = api_client is None
+        if owns_client:
+            api_client = client.ApiClient()
+        created = False
+        timer = get_timer(log_name, namespace, name)
+        timer.mark("queued")
+        if not monitor:
+            timer.spec = history.spec_key(kwargs)
 
         # Create if not monitoring
         if not monitor:
-            try:
+            if wait_for_ready:
+                bind(phase="Dependencies")
+                log.info("Waiting for %s to be ready..", wait_description)
+                # Wake up as soon as the upstream job publishes its readiness, or give up after the edge timeout.
+                # Either way the job is reported as Failed rather than exiting, so the run can still summarize it
+                try:
+                    await readiness.wait_for(wait_for_ready_var, timeout=wait_timeout)
+                except readiness.DependencyFailed as e:
+                    log.warning("%s failed, not creating %s: %s", wait_description, log_description, e)
+                    return log_name, "Skipped"
+                except TimeoutError:
+                    log.error('%s is not ready, timed out after %s seconds waiting for "%s"', wait_description, wait_timeout, wait_for_ready_var)
+                    return log_name, "Failed"
+            timer.mark("dependencies_ready")
 
-                creation_proceed = True
-                if wait_for_ready:
-                    creation_proceed = False
-                    print(
-                        f"[{get_timestamp()}][{log_name}] Waiting for {wait_description} to be ready.."
-                    )
-                    # Check if the designated env var is marked as ready before proceeding, timeout after 10 minutes max
-                    for _ in range(0, 120):
-                        if os.getenv(f"{wait_for_ready_var}", "False").lower() == "true":
-                            creation_proceed = True
-                            break
-                        # Sleep for 5 seconds before the next env check
-                        await asyncio.sleep(5)
-
-                if creation_proceed:
-                    print(
-                        f"[{get_timestamp()}][{log_name}] Setting up {log_description}"
-                    )
-                    body = client.V1Deployment(
-                        api_version="apps/v1",
-                        kind="Deployment",
-                        metadata=client.V1ObjectMeta(name=name),
-                        spec=client.V1DeploymentSpec(
+            # Queue until the worker pool has room for the job, rather than finding out at the progress deadline
+            if capacity.is_enabled(kwargs):
+                bind(phase="Admission")
+                admission_timeout = float(kwargs.get("admission_timeout", wait_timeout))
+                try:
+                    reservation = await asyncio.wait_for(
+                        capacity.get_inventory(api_client).admit(
+                            kwargs.get("node_selector_key"),
+                            kwargs.get("node_selector_value"),
+                            kwargs.get("cpu_limit"),
+                            kwargs.get("memory_limit"),
                             replicas=replicas,
-                            progress_deadline_seconds=progress_deadline_seconds,
-                            selector=client.V1LabelSelector(match_labels={"app": name}),
-                            template=client.V1PodTemplateSpec(
-                                metadata=client.V1ObjectMeta(labels={"app": name}),
-                                spec=client.V1PodSpec(
-                                    containers=[
-                                        client.V1Container(
-                                            name=container_name,
-                                            image=image,
-                                            command=command,
-                                            resources=client.V1ResourceRequirements(
-                                                        requests={
-                                                            "cpu": cpu_limit,
-                                                            "memory": memory_limit,
-                                                        },
-                                                        limits={
-                                                            "cpu": cpu_limit,
-                                                            "memory": memory_limit,
-                                                        }
-                                                        ),
-                                        ),
-                                    ],
-                                    node_selector={node_selector_key: node_selector_value},
-                                    tolerations=[
-                                        client.V1Toleration(
-                                            key=node_selector_key,
-                                            operator="Equal",
-                                            value=node_selector_value,
-                                            effect="NoSchedule",
-                                        )
-                                    ],
-                                ),
-                            ),
+                            log_name=log_name,
+                            owner=(namespace, name),
                         ),
+                        timeout=admission_timeout,
                     )
+                    timer.mark("admitted")
+                except capacity.CapacityError as e:
+                    log.error("%s can never be scheduled, not creating it: %s", log_description, e)
+                    return log_name, "Failed"
+                except TimeoutError:
+                    log.error("Timed out after %s seconds waiting for capacity for %s", admission_timeout, log_description)
+                    return log_name, "Failed"
+                except Exception as e:
+                    log.warning("Capacity admission unavailable, creating %s without it: %s", log_description, e)
 
-                    await apps_api.create_namespaced_deployment(
-                        namespace=namespace, body=body
-                    )
+            try:
+                bind(phase="Create")
+                log.info("Setting up %s", log_description)
+                body = build_body(**kwargs)
+                adopted = None
+                timer.mark("create_sent")
+                if reusable:
+                    digest = reuse.spec_hash(body)
+                    adopted = await reuse.acquire(api_client, namespace, digest, lease_seconds, reuse_ttl, log_name)
+
+                if adopted is not None:
+                    # Watch and report on the adopted Deployment from here on
+                    name = timer.name = adopted
+                    leased = True
                 else:
-                    raise Exception(
-                        f'{wait_description} is not ready, timed out after 10 minutes waiting for "{wait_for_ready_var}"'
+                    if reusable:
+                        reuse.mark_reusable(body, digest, lease_seconds, reuse_ttl)
+                        leased = True
+                    # Set before submitting, a create that errors may still have landed and needs cleaning up
+                    created = True
+                    if cleanup_object and not reusable:
+                        teardown.track(namespace, name, log_name, kind=kind, api_client=None if owns_client else api_client)
+                    await submit_workload(
+                        api_client,
+                        body,
+                        namespace,
+                        server_side_apply=str(kwargs.get("server_side_apply", False)).lower() == "true",
                     )
+                timer.mark("created")
+                if logs.is_enabled(kwargs):
+                    # Reusable environments' pods carry the reusable label instead of the run's
+                    logs.start(api_client, namespace, name, log_name, label_selector=f"{reuse.REUSABLE_LABEL}=true" if leased else None)
 
             except Exception as e:
-                print(
-                    f"[{get_timestamp()}][{log_name}] Error creating {log_description}: ",
-                    e,
-                )
-                exit(1)
-
-        # Watch for the job to complete
-        w = watch.Watch()
-        async for event in w.stream(
-            apps_api.list_namespaced_deployment,
-            namespace=namespace,
-            field_selector=f"metadata.name={name}",
-            pretty="true",
-            timeout_seconds=600,
-        ):
-
-            deployment = event["object"]
-            status = {
-                "name": deployment.metadata.name if deployment.metadata.name else None,
-                "available_replicas": deployment.status.available_replicas if deployment.status.available_replicas else None,
-                "message": deployment.status.conditions[0].message if deployment.status.conditions and deployment.status.conditions[0] else None,
-                "reason": deployment.status.conditions[0].reason if deployment.status.conditions and deployment.status.conditions[0] else None,
-                "status": deployment.status.conditions[0].status if deployment.status.conditions and deployment.status.conditions[0] else None,
-                "type": deployment.status.conditions[0].type if deployment.status.conditions and deployment.status.conditions[0] else None,
-            }
-            if status is not None:
-                if monitor:
-                    # Check if the pod is running, and report status to monitoring environment
-                    if (
-                        status["status"] == "False"
-                        and status["reason"]
-                        == "ProgressDeadlineExceeded"
-                    ):
-                        await w.close()
-                        return log_name, "Failed"
-                    if (
-                        status["available_replicas"] == replicas
-                        and status["status"] == "True"
-                    ):
-                        await w.close()
-                        return log_name, "Ready"
+                log.error("Error creating %s: %s", log_description, e)
+                return log_name, "Failed"
 
-                else:
-                    print(f"[{get_timestamp()}][{log_name}][Watch] {status}")
-
-                    # Check if the pod has failed
-                    if (
-                        status["status"] == "False"
-                        and status["reason"]
-                        == "ProgressDeadlineExceeded"
-                    ):
-                        await w.close()
-                        job_status = "Failed"
-                        break
-
-                    # Continue when pods are running
-                    if (
-                        status["available_replicas"] == replicas
-                        and status["status"] == "True"
-                    ):
-                        # Monitor the Completion job
-                        print(
-                            f"[{get_timestamp()}][{log_name}][Watch] {log_description} is running, monitoring {main_job_description}.."
-                        )
-                        os.environ[set_ready] = "True"
-                        
-                        wC = watch.Watch()
-                        async for event in w.stream(
-                                apps_api.list_namespaced_deployment,
-                                namespace=completion_job_namespace,
-                                field_selector=f"metadata.name={completion_job_name}",
-                                pretty="true",
-                                timeout_seconds=600,
-                        ):
-                                
-                            deploymentC = event["object"]
-                            statusC = {
-                                "name": deploymentC.metadata.name if deploymentC.metadata.name else None,
-                                "available_replicas": deploymentC.status.available_replicas if deploymentC.status.available_replicas else None,
-                                "message": deploymentC.status.conditions[0].message if deploymentC.status.conditions and deploymentC.status.conditions[0] else None,
-                                "reason": deploymentC.status.conditions[0].reason if deploymentC.status.conditions and deploymentC.status.conditions[0] else None,
-                                "status": deploymentC.status.conditions[0].status if deploymentC.status.conditions and deploymentC.status.conditions[0] else None,
-                                "type": deploymentC.status.conditions[0].type if deploymentC.status.conditions and deploymentC.status.conditions[0] else None,
-                            }
-                            
-                            if statusC is not None:
-                                if name == completion_job_name:
-                                    print(f"[{get_timestamp()}][{log_name}][Watch] Monitoring main job status..\n {status}")
-                                
-                                if (
-                                    statusC["available_replicas"] == replicas
-                                    and statusC["status"] == "True"
-                                ):
-                                    # Sleep for 15 seconds to simulate application run
-                                    await asyncio.sleep(15)
-                                    await wC.close()
+        # Watch for the job to complete through the namespace's shared informer, which only emits real state changes.
+        # Monitored Deployments were not created by this run and don't carry its label, so they are watched by name
+        if monitor:
+            informer = get_informer(namespace, api_client, field_selector=f"metadata.name={name}", kind=kind)
+        elif reusable:
+            informer = get_informer(namespace, api_client, label_selector=f"{reuse.REUSABLE_LABEL}=true")
+        else:
+            informer = get_informer(namespace, api_client, kind=kind)
+        bind(phase="Watch")
+        # The deadline covers both the wait for this Deployment and for the completion job, watches now resume indefinitely
+        try:
+            async with asyncio.timeout(watch_timeout):
+                async with informer.subscribe(name) as events:
+                    async for event_type, status in events:
+                        if monitor:
+                            # Check if the pod is running, and report status to monitoring environment
+                            if status.failed or event_type == "DELETED":
+                                return log_name, "Failed"
+                            if status.is_ready(replicas):
+                                return log_name, "Ready"
+
+                        else:
+                            log.debug("%s %s", event_type, status)
+
+                            # Check if the pod has failed, or was deleted from under the job
+                            if status.failed or event_type == "DELETED":
+                                log.error("%s failed: %s %s", log_description, event_type, status)
+                                job_status = "Failed"
+                                break
+
+                            if kind == "Job":
+                                if status.active:
+                                    timer.mark("available")
+                                    # The pod watch counts the job's pods from here on
+                                    if reservation is not None:
+                                        reservation.release()
+
+                                # The run moves on the moment the workload exits, dependents start on its completion
+                                if status.succeeded:
+                                    log.info("%s has completed", log_description)
+                                    timer.mark("completed")
+                                    readiness.mark_ready(set_ready)
+                                    if name == completion_job_name:
+                                        readiness.mark_ready(_completed_key(namespace, name))
+                                    await collect_pod_timings(api_client, timer)
+                                    job_status = "Completed"
                                     break
-                                
-                                else:
-                                    # Sleep for 10 seconds before the next watch request
-                                    await asyncio.sleep(10)
-                                
-                        await w.close()
-                        job_status = "Completed"
-                        break
-
-            # Sleep for 10 seconds before the next watch request
-            await asyncio.sleep(10)
+                                continue
 
-        return log_name, job_status
+                            # Continue when pods are running
+                            if status.is_ready(replicas):
+                                # Monitor the Completion job
+                                log.info("%s is running, monitoring %s..", log_description, main_job_description)
+                                readiness.mark_ready(set_ready)
+                                timer.mark("available")
+                                # The pod watch counts the job's pods from here on
+                                if reservation is not None:
+                                    reservation.release()
+                                await collect_pod_timings(api_client, timer)
+                                job_status = await _wait_for_completion(
+                                    # The completion job may run on another shard, watched through that shard's client
+                                    get_informer(completion_job_namespace, kwargs.get("completion_api_client") or api_client, kind=completion_job_kind),
+                                    completion_job_name,
+                                    log_name,
+                                    show_status=name == completion_job_name,
+                                    simulated_run_seconds=float(kwargs.get("simulated_run_seconds", 15)),
+                                    kind=completion_job_kind,
+                                )
+                                timer.mark("completed")
+                                break
 
-    except Exception as e:
-        print(f"[{get_timestamp()}] Unexpected Error: ", e)
-        traceback.print_exc(file=sys.stdout)
-        exit(1)
+        except TimeoutError:
+            log.error("Timed out after %s seconds waiting for %s to complete", watch_timeout, log_description)
+            job_status = "Failed"
+
+        return log_name, job_status
 
     finally:
-        # Clean up the job resources
-        if cleanup_object and not monitor:
-            try:
-                await apps_api.delete_namespaced_deployment(
-                    namespace=namespace, name=name
-                )
-                print(
-                    f"[{get_timestamp()}][{log_name}] {log_description} has been cleaned up."
-                )
+        if reservation is not None:
+            reservation.release()
 
-            except Exception as e:
-                print(
-                    f"[{get_timestamp()}][{log_name}] Error deleting {log_description}: ",
-                    e,
+        # Let dependent jobs fail fast if this job never became ready
+        if not monitor:
+            readiness.mark_failed(set_ready, f"{log_description} did not become ready")
+            # Jobs waiting on a completion Job that failed, or that they subscribe to after it's gone, stop right away
+            if kind == "Job" and name == completion_job_name:
+                readiness.mark_failed(_completed_key(namespace, name), f"{log_description} did not complete")
+
+        bind(phase="Cleanup")
+        # Flush the job's container output before its pods are deleted
+        await teardown.shielded(logs.stop(log_name))
+
+        # Keep a healthy reused environment up for the next run, one that never became ready is deleted
+        if leased and readiness.is_ready(set_ready):
+            await teardown.shielded(reuse.release(api_client, namespace, name, reuse_ttl, log_name))
+
+        # Clean up the job resources, skipped when the job never got as far as submitting them
+        elif cleanup_object and created:
+            timer.mark("delete_sent")
+            # Cancelled siblings of a failed job still finish deleting their Deployment
+            deleted = await teardown.shielded(
+                teardown.delete_deployment(
+                    api_client,
+                    namespace,
+                    name,
+                    log_name,
+                    propagation_policy=kwargs.get("propagation_policy"),
+                    wait=kwargs.get("wait_for_deletion"),
+                    label_selector=f"{reuse.REUSABLE_LABEL}=true" if reusable else None,
+                    kind=kind,
                 )
+            )
+            if deleted != "Failed":
+                timer.mark("deleted")
+                log.info("%s has been cleaned up.", log_description)
 
-        # Clean up unclosed sessions
-        if rest_client is not None:
-            await rest_client.pool_manager.close()
+        # Clean up the session when this job owns it, after stopping the informers watching through it.
+        # The shared client and its informers are closed by the run
+        if owns_client:
+            await stop_informers(api_client)
+            await logs.stop_pod_informers(api_client)
+            await capacity.stop_inventories(api_client)
+            await api_client.close()
 
 
 if __name__ == "__main__":
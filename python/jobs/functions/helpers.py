@@ -1,11 +1,23 @@
-import datetime
 import os
+import re
 import uuid
 
+# Label applied to every resource created by a run, used to select and clean up the run's resources
+RUN_LABEL = "k8s-action-runner/run"
 
-def get_timestamp():
-    """Returns the current timestamp as a formatted string."""
-    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def get_run_id():
+    """Returns the run identifier from NAME_APPEND, sanitized to be a valid label value."""
+    run_id = os.getenv("NAME_APPEND").split("/", 1)[1].lower()
+    run_id = re.sub(r"[^a-z0-9_.-]", "-", run_id)[:63]
+    return run_id.strip("-_.")
+
+
+def markdown_table(headers, rows):
+    """Renders rows as a GitHub flavored markdown table."""
+    lines = ["| " + " | ".join(headers) + " |", "|" + "---|" * len(headers)]
+    lines += ["| " + " | ".join(str(cell) for cell in row) + " |" for row in rows]
+    return "\n".join(lines)
 
 
 ############################
@@ -0,0 +1,204 @@
+# Run history, every run's job outcomes and phase durations in a SQLite file and a regression check against earlier runs
+
+import hashlib
+import json
+import os
+import sqlite3
+import statistics
+import time
+from .helpers import get_run_id, markdown_table, set_output, set_summary
+from .logger import get_logger
+
+log = get_logger("History")
+
+# Statuses of jobs that ran to the end, only these make up the baseline
+SUCCEEDED = ("Completed", "Ready")
+# Spec fields that change what a job measures, jobs are only compared with runs of the same spec
+SPEC_FIELDS = (
+    "workload",
+    "image",
+    "command",
+    "replicas",
+    "cpu_limit",
+    "memory_limit",
+    "node_selector_key",
+    "node_selector_value",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    recorded_at REAL NOT NULL,
+    verdict TEXT
+);
+CREATE TABLE IF NOT EXISTS job_phases (
+    run_id TEXT NOT NULL,
+    job TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    status TEXT,
+    phase TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (run_id, job, phase)
+);
+CREATE INDEX IF NOT EXISTS job_phases_baseline ON job_phases (job, spec, phase);
+"""
+
+
+def get_history_path():
+    return os.getenv("RUN_HISTORY_DB")
+
+
+def spec_key(kwargs):
+    """Hashes the job arguments that change what it measures, names and timeouts are left out"""
+    spec = {field: str(kwargs.get(field)) for field in SPEC_FIELDS}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def compare(samples, value, threshold=0.1, z_threshold=3.0):
+    """Compares a duration against baseline samples, returning (median, change, z, regressed)
+
+    The spread is the median absolute deviation, so one slow run in the baseline doesn't hide the next.
+    A regression is both significant (z above z_threshold) and large (slower than the median by more than threshold).
+    """
+    median = statistics.median(samples)
+    spread = 1.4826 * statistics.median(abs(sample - median) for sample in samples)
+    change = (value - median) / median if median else 0.0
+    if spread:
+        z = (value - median) / spread
+    else:
+        z = float("inf") if value > median else 0.0
+    return median, change, z, z > z_threshold and change > threshold
+
+
+class RunHistory:
+    """Per-run, per-job phase durations and outcomes, keyed by the job's spec"""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def record(self, run_id, timers, recorded_at=None):
+        """Stores every timed job of the run, a re-run under the same run id replaces it"""
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO runs (run_id, recorded_at) VALUES (?, ?)", (run_id, recorded_at or time.time()))
+            self.db.execute("DELETE FROM job_phases WHERE run_id = ?", (run_id,))
+            self.db.executemany(
+                "INSERT INTO job_phases (run_id, job, spec, status, phase, seconds) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (run_id, timer.job, timer.spec, timer.status, phase, seconds)
+                    for timer in timers
+                    if timer.spec is not None
+                    for phase, seconds in {**timer.phases(), "total": timer.total()}.items()
+                ],
+            )
+
+    def baseline(self, run_id, job, spec, phase, runs=10):
+        """Durations of the phase in the latest successful earlier runs of the same job and spec"""
+        rows = self.db.execute(
+            "SELECT job_phases.seconds FROM job_phases JOIN runs USING (run_id)"
+            " WHERE job = ? AND spec = ? AND phase = ? AND run_id != ? AND status IN (?, ?)"
+            " ORDER BY runs.recorded_at DESC LIMIT ?",
+            (job, spec, phase, run_id, *SUCCEEDED, runs),
+        )
+        return [seconds for (seconds,) in rows]
+
+    def check(self, run_id, runs=10, min_runs=5, threshold=0.1, z_threshold=3.0):
+        """Compares each successful job of the run with its baseline, returning a result dict per job phase
+
+        Phases with fewer than min_runs earlier samples are reported without a verdict.
+        """
+        results = []
+        rows = self.db.execute(
+            "SELECT job, spec, phase, seconds FROM job_phases WHERE run_id = ? AND status IN (?, ?) ORDER BY job, phase",
+            (run_id, *SUCCEEDED),
+        ).fetchall()
+        for job, spec, phase, seconds in rows:
+            samples = self.baseline(run_id, job, spec, phase, runs)
+            result = {"job": job, "phase": phase, "seconds": seconds, "samples": len(samples)}
+            if len(samples) >= min_runs:
+                median, change, z, regressed = compare(samples, seconds, threshold, z_threshold)
+                result.update(baseline=median, change=change, z=z, regressed=regressed)
+            results.append(result)
+        return results
+
+    def set_verdict(self, run_id, verdict):
+        with self.db:
+            self.db.execute("UPDATE runs SET verdict = ? WHERE run_id = ?", (verdict, run_id))
+
+
+def verdict_of(results):
+    """regressed if any phase regressed, insufficient_history if none could be compared, pass otherwise"""
+    if any(result.get("regressed") for result in results):
+        return "regressed"
+    if not any("regressed" in result for result in results):
+        return "insufficient_history"
+    return "pass"
+
+
+def report(results, verdict):
+    """Logs the comparison and writes the verdict to the outputs and step summary"""
+    regressions = [result for result in results if result.get("regressed")]
+    for result in regressions:
+        log.warning(
+            "%s %s regressed: %.1fs against a baseline of %.1fs (%+.0f%%, z=%.1f)",
+            result["job"], result["phase"], result["seconds"], result["baseline"], result["change"] * 100, result["z"],
+        )
+    log.info("Performance verdict: %s, %d regressions over %d compared phases", verdict, len(regressions), sum("regressed" in result for result in results))
+
+    if os.getenv("GITHUB_OUTPUT"):
+        set_output("perf_verdict", verdict)
+        set_output("perf_regressions", json.dumps(regressions))
+    if os.getenv("GITHUB_STEP_SUMMARY"):
+        rows = [
+            [
+                result["job"],
+                result["phase"],
+                f"{result['seconds']:.1f}s",
+                f"{result['baseline']:.1f}s" if "baseline" in result else "-",
+                f"{result['change'] * 100:+.0f}%" if "change" in result else "-",
+                "Regressed" if result.get("regressed") else "-" if "regressed" not in result else "OK",
+            ]
+            for result in results
+        ]
+        set_summary(
+            f"### Performance Verdict: {verdict}\n\n"
+            + markdown_table(["Job", "Phase", "This run", "Baseline (median)", "Change", "Result"], rows)
+        )
+
+
+def record_and_check(timers):
+    """Records the run in RUN_HISTORY_DB and checks it for regressions, returning the verdict or None when disabled
+
+    HISTORY_BASELINE_RUNS earlier runs make up the baseline and at least HISTORY_MIN_RUNS are needed to compare.
+    A phase regressed when it is REGRESSION_THRESHOLD (a fraction) slower than the baseline median and its
+    robust z-score is above REGRESSION_Z_THRESHOLD.
+    """
+    path = get_history_path()
+    if not path:
+        return None
+    run_id = get_run_id()
+    history = RunHistory(path)
+    try:
+        history.record(run_id, timers)
+        results = history.check(
+            run_id,
+            runs=int(os.getenv("HISTORY_BASELINE_RUNS", 10)),
+            min_runs=int(os.getenv("HISTORY_MIN_RUNS", 5)),
+            threshold=float(os.getenv("REGRESSION_THRESHOLD", 0.1)),
+            z_threshold=float(os.getenv("REGRESSION_Z_THRESHOLD", 3.0)),
+        )
+        verdict = verdict_of(results)
+        history.set_verdict(run_id, verdict)
+    finally:
+        history.close()
+    report(results, verdict)
+    return verdict
+
+
+def should_fail(verdict):
+    """Whether the run fails on the verdict, set FAIL_ON_REGRESSION=true to gate on it"""
+    return verdict == "regressed" and os.getenv("FAIL_ON_REGRESSION", "False").lower() == "true"
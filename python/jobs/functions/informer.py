@@ -0,0 +1,267 @@
+# Shared informers, one list+watch per resource, namespace and selector fanned out to every waiting job
+
+import asyncio
+import contextlib
+import contextvars
+import json
+from kubernetes_asyncio import client
+from kubernetes_asyncio.client.exceptions import ApiException
+from .helpers import get_run_id, RUN_LABEL
+from .logger import get_logger
+from .status import DeploymentStatus, JobStatus
+
+log = get_logger("Informer")
+
+
+class Informer:
+    """Keeps a resource's objects current with one list followed by a resumable watch
+
+    Subclasses provide the list call, how raw objects are projected and what a relist or an event does.
+    """
+
+    def __init__(self, api_client, log_name, watch_timeout_seconds=300):
+        self.api_client = api_client
+        self.log_name = log_name
+        self.watch_timeout_seconds = watch_timeout_seconds
+        self.error = None
+        # Set once the first full list has been applied, or the informer has failed
+        self.synced = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            # Shared informers outlive the job that happened to start them, they don't log under its context
+            self._task = asyncio.create_task(self._run(), context=contextvars.Context())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _list(self, **kwargs):
+        """Calls the resource's list function with _preload_content=False and the given arguments"""
+        raise NotImplementedError
+
+    def _project(self, obj):
+        """Projects a raw object decoded from the API's JSON"""
+        raise NotImplementedError
+
+    def _relist(self, items):
+        raise NotImplementedError
+
+    def _dispatch(self, event_type, item):
+        raise NotImplementedError
+
+    async def _request(self, **kwargs):
+        """Calls the list function returning the raw response, the JSON is decoded by the caller"""
+        resp = await self._list(_preload_content=False, **kwargs)
+        if resp.status != 200:
+            body = await resp.text()
+            resp.release()
+            raise ApiException(status=resp.status, reason=f"{resp.reason}: {body}")
+        return resp
+
+    async def _run(self):
+        resource_version = None
+        while True:
+            try:
+                # List only on first start or after the watched version has expired
+                if resource_version is None:
+                    resp = await self._request()
+                    listed = json.loads(await resp.read())
+                    self._relist([self._project(obj) for obj in listed.get("items") or ()])
+                    resource_version = listed["metadata"]["resourceVersion"]
+                    self.synced.set()
+
+                # Server side timeouts end the stream cleanly, the loop then resumes from the last seen version
+                resp = await self._request(
+                    watch=True,
+                    resource_version=resource_version,
+                    allow_watch_bookmarks=True,
+                    timeout_seconds=self.watch_timeout_seconds,
+                    _request_timeout=(30, self.watch_timeout_seconds + 30),
+                )
+                try:
+                    async for line in resp.content:
+                        if not line.strip():
+                            continue
+                        event = json.loads(line)
+                        obj = event["object"]
+                        if event["type"] == "ERROR":
+                            raise ApiException(status=obj.get("code"), reason=f"{obj.get('reason')}: {obj.get('message')}")
+
+                        resource_version = obj["metadata"]["resourceVersion"]
+                        if event["type"] != "BOOKMARK":
+                            self._dispatch(event["type"], self._project(obj))
+                finally:
+                    resp.release()
+
+            except asyncio.CancelledError:
+                raise
+
+            except ApiException as e:
+                if e.status == 410:
+                    # The resource version is too old to resume from, relist to rebuild the cache
+                    log.info("Watch of %s expired (410 Gone), relisting..", self.log_name)
+                    resource_version = None
+                elif _is_fatal(e):
+                    self._fail(e)
+                    return
+                else:
+                    log.warning("Watch of %s errored, reconnecting: %s", self.log_name, e)
+                    await asyncio.sleep(1)
+
+            except (client.ApiValueError, client.ApiTypeError) as e:
+                # Invalid arguments such as a missing namespace, retrying will not help. A garbled or
+                # truncated watch line is a stream error like any other and resumes from the last version
+                self._fail(e)
+                return
+
+            except Exception as e:
+                log.warning("Watch of %s errored, reconnecting: %s", self.log_name, e, exc_info=True)
+                await asyncio.sleep(1)
+
+    def _fail(self, e):
+        """Stops the informer for good, subclasses extend it to raise the error to their waiters"""
+        log.error("Watch of %s failed, giving up: %s", self.log_name, e)
+        self.error = e
+        self.synced.set()
+
+
+class CachedInformer(Informer):
+    """Keeps an in-memory cache of the run's objects in a namespace and sends watch events to subscribers
+
+    Subclasses provide the namespaced list call and the status projection.
+    """
+
+    def __init__(self, namespace, api_client, label_selector=None, field_selector=None, watch_timeout_seconds=300):
+        super().__init__(api_client, namespace, watch_timeout_seconds)
+        self.namespace = namespace
+        self.label_selector = label_selector
+        self.field_selector = field_selector
+        self.cache = {}
+        self._subscribers = {}
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, name):
+        """Yields an async iterator of (event_type, status) tuples for the named object
+
+        The iterator raises the informer's error if its watch failed with an error that will not clear.
+        """
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(name, set()).add(queue)
+        # Replay the cached state so late subscribers don't miss an object that is already up
+        if self.error is not None:
+            queue.put_nowait(("ERROR", self.error))
+        elif name in self.cache:
+            queue.put_nowait(("ADDED", self.cache[name]))
+
+        async def events():
+            while True:
+                event_type, status = await queue.get()
+                if event_type == "ERROR":
+                    raise status
+                yield event_type, status
+
+        try:
+            yield events()
+        finally:
+            self._subscribers[name].discard(queue)
+            if not self._subscribers[name]:
+                del self._subscribers[name]
+
+    def _dispatch(self, event_type, status):
+        """Updates the cache and notifies subscribers, only when the projected state actually changed"""
+        name = status.name
+        if event_type == "DELETED":
+            self.cache.pop(name, None)
+        elif self.cache.get(name) == status:
+            self.cache[name] = status
+            return
+        else:
+            self.cache[name] = status
+        for queue in self._subscribers.get(name, ()):
+            queue.put_nowait((event_type, status))
+
+    def _relist(self, items):
+        """Reconciles the cache against a fresh list, emitting the events missed while disconnected"""
+        listed = {status.name: status for status in items}
+        for name in [name for name in self.cache if name not in listed]:
+            self._dispatch("DELETED", self.cache[name])
+        for status in listed.values():
+            self._dispatch("ADDED" if status.name not in self.cache else "MODIFIED", status)
+
+    def _fail(self, e):
+        """Stops the informer for good and raises the error in every subscriber"""
+        super()._fail(e)
+        for queues in self._subscribers.values():
+            for queue in queues:
+                queue.put_nowait(("ERROR", e))
+
+
+class DeploymentInformer(CachedInformer):
+    async def _list(self, **kwargs):
+        return await client.AppsV1Api(api_client=self.api_client).list_namespaced_deployment(
+            namespace=self.namespace,
+            label_selector=self.label_selector,
+            field_selector=self.field_selector,
+            **kwargs,
+        )
+
+    def _project(self, obj):
+        return DeploymentStatus.from_raw(obj)
+
+
+class JobInformer(CachedInformer):
+    async def _list(self, **kwargs):
+        return await client.BatchV1Api(api_client=self.api_client).list_namespaced_job(
+            namespace=self.namespace,
+            label_selector=self.label_selector,
+            field_selector=self.field_selector,
+            **kwargs,
+        )
+
+    def _project(self, obj):
+        return JobStatus.from_raw(obj)
+
+
+# Workload kind -> the informer watching it
+INFORMERS = {"Deployment": DeploymentInformer, "Job": JobInformer}
+
+
+def _is_fatal(e):
+    """Client errors other than 410 Gone and 429 Too Many Requests, e.g. 403 from RBAC or 404 for a missing namespace"""
+    return e.status is not None and 400 <= e.status < 500 and e.status not in (410, 429)
+
+
+_informers = {}
+
+
+def get_informer(namespace, api_client, label_selector=None, field_selector=None, kind="Deployment"):
+    """Returns the shared informer for the client, namespace, selectors and kind, starting it on first use
+
+    Informers are scoped to the client they watch with, stop them with stop_informers(api_client) before
+    that client is closed. Without selectors the informer watches the objects labelled with this run,
+    pass a field selector to watch objects this run did not create. kind is Deployment or Job.
+    """
+    if label_selector is None and field_selector is None:
+        label_selector = f"{RUN_LABEL}={get_run_id()}"
+    key = (api_client, namespace, label_selector, field_selector, kind)
+    informer = _informers.get(key)
+    if informer is None:
+        informer = INFORMERS[kind](
+            namespace, api_client, label_selector=label_selector, field_selector=field_selector
+        )
+        _informers[key] = informer
+        informer.start()
+    return informer
+
+
+async def stop_informers(api_client=None):
+    """Stops the informers using api_client, or every informer, before the client they use is closed"""
+    for key, informer in list(_informers.items()):
+        if api_client is None or informer.api_client is api_client:
+            await informer.stop()
+            del _informers[key]
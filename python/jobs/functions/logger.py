@@ -0,0 +1,138 @@
+# Non-blocking structured logging, records are queued by the event loop and formatted and written by a background thread
+
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+ROOT = "k8s_action_runner"
+# Fields every record carries, taken from the logging task's context unless passed in extra
+CONTEXT_FIELDS = ("job", "namespace", "phase")
+
+_context = contextvars.ContextVar("log_context", default={})
+_listener = None
+
+
+def bind(**fields):
+    """Adds fields such as job, namespace and phase to the records logged by the current task and the tasks it starts"""
+    _context.set({**_context.get(), **fields})
+
+
+class _ContextFilter(logging.Filter):
+    """Stamps the logging task's context onto the record, before it leaves the event loop's thread"""
+
+    def filter(self, record):
+        context = _context.get()
+        for field in CONTEXT_FIELDS:
+            if getattr(record, field, None) is None:
+                setattr(record, field, context.get(field))
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Only merge the arguments in, formatting is left to the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_text = logging.Formatter().formatException(record.exc_info) if record.exc_info else None
+        record.exc_info = None
+        return record
+
+
+class _Formatter(logging.Formatter):
+    """Formats timestamps once per second, every record logged in the same second shares the string"""
+
+    _time_format = "%Y-%m-%d %H:%M:%S"
+
+    def __init__(self):
+        super().__init__()
+        self._second = None
+        self._timestamp = None
+
+    def timestamp(self, record):
+        second = int(record.created)
+        if second != self._second:
+            self._second = second
+            self._timestamp = datetime.datetime.fromtimestamp(second).strftime(self._time_format)
+        return self._timestamp
+
+    @staticmethod
+    def component(record):
+        return record.name[len(ROOT) + 1:] if record.name.startswith(ROOT + ".") else None
+
+
+class TextFormatter(_Formatter):
+    """[time][component][job][phase] message, the same shape the runner has always printed"""
+
+    def format(self, record):
+        tags = "".join(f"[{tag}]" for tag in (self.component(record), record.job, record.phase) if tag)
+        line = f"[{self.timestamp(record)}]{tags} {record.msg}"
+        if record.levelno >= logging.WARNING:
+            line = f"[{self.timestamp(record)}]{tags} {record.levelname}: {record.msg}"
+        return f"{line}\n{record.exc_text}" if record.exc_text else line
+
+
+class JsonFormatter(_Formatter):
+    """One JSON object per line, for log shippers"""
+
+    _time_format = "%Y-%m-%dT%H:%M:%S"
+
+    def format(self, record):
+        entry = {
+            "time": f"{self.timestamp(record)}.{int(record.msecs):03d}",
+            "level": record.levelname,
+            "component": self.component(record),
+            **{field: getattr(record, field) for field in CONTEXT_FIELDS},
+            "message": record.msg,
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps({key: value for key, value in entry.items() if value is not None}, default=str)
+
+
+def configure(level=None, fmt=None, stream=None):
+    """Routes the runner's records through a queue to a writer thread, LOG_LEVEL and LOG_FORMAT (text or json) by default
+
+    Watch events are only logged at DEBUG. Calling it again replaces the previous configuration.
+    """
+    global _listener
+    shutdown()
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "text")).lower()
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    handler.addFilter(_ContextFilter())
+
+    root = logging.getLogger(ROOT)
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    root.propagate = False
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+
+
+def shutdown():
+    """Writes out every queued record and stops the writer thread"""
+    global _listener
+    if _listener is not None:
+        root = logging.getLogger(ROOT)
+        root.handlers[:] = []
+        root.propagate = True
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(component=None):
+    """Returns the runner's logger, or a component's such as Scheduler, records are written once configure() has run"""
+    return logging.getLogger(f"{ROOT}.{component}" if component else ROOT)
+
+
+atexit.register(shutdown)
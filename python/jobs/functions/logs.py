@@ -0,0 +1,251 @@
+# Pod log streaming, follows the containers behind each job into a per-job file and keeps a tail for failed jobs
+
+import asyncio
+import collections
+import os
+import re
+from kubernetes_asyncio import client
+from .helpers import get_run_id, set_summary, RUN_LABEL
+from .informer import Informer
+from .logger import get_logger
+
+log = get_logger("Logs")
+
+
+def is_enabled(kwargs):
+    return str(kwargs.get("stream_logs", os.getenv("STREAM_LOGS", "False"))).lower() == "true"
+
+
+def get_log_dir():
+    return os.getenv("JOB_LOG_DIR", "job-logs")
+
+
+def get_tail_lines():
+    return int(os.getenv("LOG_TAIL_LINES", 50))
+
+
+class _PodInformer(Informer):
+    """The run's pods in a namespace and which of their container instances have started
+
+    Shared by every job in the namespace, each pod goes to the stream registered for its app label.
+    """
+
+    def __init__(self, api_client, namespace, label_selector):
+        super().__init__(api_client, f"{namespace} pods")
+        self.namespace = namespace
+        self.label_selector = label_selector
+        # pod name -> (app label, started instances), replayed to a stream registering after its pods came up
+        self.pods = {}
+        # app label -> the job's log stream
+        self.streams = {}
+
+    async def _list(self, **kwargs):
+        return await client.CoreV1Api(api_client=self.api_client).list_namespaced_pod(
+            namespace=self.namespace, label_selector=self.label_selector, **kwargs
+        )
+
+    def _project(self, obj):
+        metadata = obj["metadata"]
+        statuses = (obj.get("status") or {}).get("containerStatuses") or ()
+        # A restarted container is a new instance with its own log, keyed by its restart count
+        started = tuple(
+            (status.get("name"), status.get("restartCount", 0))
+            for status in statuses
+            if {"running", "terminated"} & set(status.get("state") or {})
+        )
+        return metadata["name"], (metadata.get("labels") or {}).get("app"), started
+
+    def _relist(self, items):
+        self.pods = {}
+        for item in items:
+            self._dispatch("ADDED", item)
+
+    def _dispatch(self, event_type, item):
+        pod, app, started = item
+        if event_type == "DELETED":
+            self.pods.pop(pod, None)
+            return
+        self.pods[pod] = (app, started)
+        stream = self.streams.get(app)
+        if stream is not None:
+            for container, restart_count in started:
+                stream.follow(pod, container, restart_count)
+
+    def register(self, stream):
+        self.streams[stream.name] = stream
+        for pod, (app, started) in list(self.pods.items()):
+            if app == stream.name:
+                for container, restart_count in started:
+                    stream.follow(pod, container, restart_count)
+
+    def unregister(self, stream):
+        if self.streams.get(stream.name) is stream:
+            del self.streams[stream.name]
+
+
+# (client, namespace, label selector) -> the namespace's shared pod informer
+_informers = {}
+
+
+def get_pod_informer(api_client, namespace, label_selector=None):
+    """Returns the shared pod informer of the client and namespace, starting it on first use
+
+    It watches the pods labelled with this run unless label_selector is given, e.g. for reusable environments.
+    """
+    label_selector = label_selector or f"{RUN_LABEL}={get_run_id()}"
+    key = (api_client, namespace, label_selector)
+    informer = _informers.get(key)
+    if informer is None:
+        informer = _informers[key] = _PodInformer(api_client, namespace, label_selector)
+        informer.start()
+    return informer
+
+
+async def stop_pod_informers(api_client=None):
+    """Stops the pod informers using api_client, or every pod informer, before the client they use is closed"""
+    for key, informer in list(_informers.items()):
+        if api_client is None or informer.api_client is api_client:
+            await informer.stop()
+            del _informers[key]
+
+
+class LogStream:
+    """Streams the logs of every container behind a job into its file through a bounded buffer
+
+    A chatty pod fills the buffer and is then read no faster than the file is written, instead of holding
+    up the event loop or growing without bound. The last tail_lines lines are kept for the step summary.
+    """
+
+    def __init__(self, api_client, namespace, name, log_name, path, buffer_lines=1000, tail_lines=50, label_selector=None):
+        self.api_client = api_client
+        self.namespace = namespace
+        self.name = name
+        self.log_name = log_name
+        self.path = path
+        self.label_selector = label_selector
+        self.tail = collections.deque(maxlen=tail_lines)
+        self._buffer = asyncio.Queue(maxsize=buffer_lines)
+        self._followed = set()
+        self._streams = set()
+        self._informer = None
+        self._writer = None
+        self._file = None
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a")
+        self._writer = asyncio.create_task(self._write())
+        self._informer = get_pod_informer(self.api_client, self.namespace, self.label_selector)
+        self._informer.register(self)
+
+    async def stop(self):
+        """Stops following the pods and flushes what was already read into the file"""
+        if self._informer is not None:
+            self._informer.unregister(self)
+            self._informer = None
+        for stream in list(self._streams):
+            stream.cancel()
+        await asyncio.gather(*self._streams, return_exceptions=True)
+        if self._writer is not None:
+            await self._buffer.put(None)
+            await self._writer
+            self._writer = None
+            self._file.close()
+
+    def follow(self, pod, container, restart_count):
+        if (pod, container, restart_count) in self._followed:
+            return
+        self._followed.add((pod, container, restart_count))
+        stream = asyncio.create_task(self._stream(pod, container, restart_count))
+        self._streams.add(stream)
+        stream.add_done_callback(self._streams.discard)
+
+    async def _stream(self, pod, container, restart_count):
+        prefix = f"[{pod}/{container}{f' restart {restart_count}' if restart_count else ''}] "
+        core_api = client.CoreV1Api(api_client=self.api_client)
+        try:
+            # Follows until the container exits, a restart shows up as a new instance on the pod watch
+            resp = await core_api.read_namespaced_pod_log(
+                name=pod,
+                namespace=self.namespace,
+                container=container,
+                follow=True,
+                _preload_content=False,
+                _request_timeout=(30, None),
+            )
+            try:
+                async for line in resp.content:
+                    await self._buffer.put(prefix + line.decode(errors="replace").rstrip("\r\n"))
+            finally:
+                resp.release()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("Log stream of %s/%s ended: %s", pod, container, e, extra={"job": self.log_name})
+
+    async def _write(self):
+        """Drains the buffer in batches, writing off the event loop"""
+        while True:
+            lines = [await self._buffer.get()]
+            while not self._buffer.empty():
+                lines.append(self._buffer.get_nowait())
+            done = None in lines
+            lines = [line for line in lines if line is not None]
+            self.tail.extend(lines)
+            if lines:
+                await asyncio.to_thread(self._file.write, "".join(line + "\n" for line in lines))
+            if done:
+                return
+
+
+# log name -> the job's log stream, kept after the stream stops so failed jobs can be reported
+_streams = {}
+
+
+def start(api_client, namespace, name, log_name, label_selector=None):
+    """Starts streaming the logs of the job's pods into <JOB_LOG_DIR>/<log name>.log
+
+    Pass the label_selector of the job's pods when they don't carry the run label, as in reusable environments.
+    """
+    path = os.path.join(get_log_dir(), re.sub(r"[^A-Za-z0-9_.-]", "-", log_name) + ".log")
+    stream = _streams[log_name] = LogStream(
+        api_client, namespace, name, log_name, path, tail_lines=get_tail_lines(), label_selector=label_selector
+    )
+    stream.start()
+    log.info("Streaming pod logs to %s", path, extra={"job": log_name})
+    return stream
+
+
+async def stop(log_name):
+    stream = _streams.get(log_name)
+    if stream is not None:
+        await stream.stop()
+
+
+async def stop_streams():
+    """Stops every log stream and the pod informers feeding them, before the client they use is closed"""
+    for stream in _streams.values():
+        await stream.stop()
+    await stop_pod_informers()
+
+
+def report_failures(job_results):
+    """Prints the last lines logged by each failed job and attaches them to the step summary"""
+    sections = []
+    for log_name, status in job_results:
+        stream = _streams.get(log_name)
+        if status != "Failed" or stream is None:
+            continue
+        log.info(
+            "Last %d log lines, the full log is in %s:\n%s", len(stream.tail), stream.path, "\n".join(stream.tail), extra={"job": log_name}
+        )
+        sections.append(f"#### {log_name}\n\n```\n" + "\n".join(stream.tail) + "\n```")
+
+    if sections and os.getenv("GITHUB_STEP_SUMMARY"):
+        set_summary("### Failed Job Logs\n\n" + "\n\n".join(sections))
+    return sections
+
+
+def reset():
+    """Forgets every log stream, for running several runs in one process"""
+    _streams.clear()
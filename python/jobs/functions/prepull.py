@@ -0,0 +1,265 @@
+# Image pre-pull warmup, a short lived DaemonSet per worker pool pulls the run's images onto every matching node
+
+import asyncio
+import datetime
+import hashlib
+import os
+from kubernetes_asyncio import client
+from .deployment import build_tolerations
+from .helpers import get_run_id, markdown_table, set_summary, RUN_LABEL
+from .informer import Informer
+from .logger import get_logger
+from .timing import event_time
+from . import teardown
+
+# Waiting reasons while the image is still being pulled, any other state means the image is on the node
+PULLING_REASONS = ("ContainerCreating", "PodInitializing", "ErrImagePull", "ImagePullBackOff")
+
+log = get_logger("Prepull")
+
+
+def collect_images(specs):
+    """Groups the images of job specs by worker pool, returning {(node_selector_key, node_selector_value): [images]}"""
+    pools = {}
+    for spec in specs:
+        pool = (spec.get("node_selector_key"), spec.get("node_selector_value"))
+        images = pools.setdefault(pool, [])
+        if spec.get("image") and spec["image"] not in images:
+            images.append(spec["image"])
+    return {pool: images for pool, images in pools.items() if images}
+
+
+def build_daemonset_body(name, images, node_selector_key, node_selector_value):
+    """One container per image that only idles, the pull is the point, so a missing sleep binary is harmless"""
+    labels = {"app": name, RUN_LABEL: get_run_id()}
+    return {
+        "apiVersion": "apps/v1",
+        "kind": "DaemonSet",
+        "metadata": {"name": name, "labels": labels},
+        "spec": {
+            "selector": {"matchLabels": {"app": name}},
+            "template": {
+                "metadata": {"labels": labels},
+                "spec": {
+                    "containers": [
+                        {
+                            "name": f"image-{index}",
+                            "image": image,
+                            "command": ["sleep", "3600"],
+                            "resources": {
+                                "requests": {"cpu": "1m", "memory": "8Mi"},
+                                "limits": {"cpu": "10m", "memory": "16Mi"},
+                            },
+                        }
+                        for index, image in enumerate(images)
+                    ],
+                    "nodeSelector": {node_selector_key: node_selector_value},
+                    "tolerations": build_tolerations(node_selector_key, node_selector_value),
+                    "terminationGracePeriodSeconds": 0,
+                },
+            },
+        },
+    }
+
+
+def is_pulled(pod):
+    """Whether every container of a raw pod has its image on the node"""
+    statuses = (pod.get("status") or {}).get("containerStatuses")
+    if not statuses or len(statuses) < len((pod.get("spec") or {}).get("containers") or ()):
+        return False
+    for status in statuses:
+        waiting = (status.get("state") or {}).get("waiting")
+        if waiting is not None and waiting.get("reason") in PULLING_REASONS:
+            return False
+    return True
+
+
+def _daemonset_name(node_selector_key, node_selector_value):
+    pool = hashlib.sha256(f"{node_selector_key}={node_selector_value}".encode()).hexdigest()[:8]
+    return f"prepull-{pool}-{get_run_id()}"[:63].rstrip("-_.")
+
+
+class _DaemonSetInformer(Informer):
+    """How many nodes the DaemonSet landed on, None until its controller has seen the current spec"""
+
+    def __init__(self, warmup):
+        super().__init__(warmup.api_client, f"{warmup.name} daemonset")
+        self.warmup = warmup
+
+    async def _list(self, **kwargs):
+        return await client.AppsV1Api(api_client=self.api_client).list_namespaced_daemon_set(
+            namespace=self.warmup.namespace, field_selector=f"metadata.name={self.warmup.name}", **kwargs
+        )
+
+    def _project(self, obj):
+        status = obj.get("status") or {}
+        # A new DaemonSet reports 0 desired pods until its controller has processed it
+        if status.get("observedGeneration", 0) < (obj.get("metadata") or {}).get("generation", 0):
+            return None
+        return status.get("desiredNumberScheduled")
+
+    def _relist(self, items):
+        self.warmup.desired = items[0] if items else None
+        self.warmup.changed()
+
+    def _dispatch(self, event_type, desired):
+        self.warmup.desired = None if event_type == "DELETED" else desired
+        self.warmup.changed()
+
+    def _fail(self, e):
+        super()._fail(e)
+        self.warmup.changed()
+
+
+class _PodInformer(Informer):
+    """The DaemonSet's pods, name -> (node, creation time, whether its images are pulled)"""
+
+    def __init__(self, warmup):
+        super().__init__(warmup.api_client, f"{warmup.name} pods")
+        self.warmup = warmup
+
+    async def _list(self, **kwargs):
+        return await client.CoreV1Api(api_client=self.api_client).list_namespaced_pod(
+            namespace=self.warmup.namespace, label_selector=f"app={self.warmup.name}", **kwargs
+        )
+
+    def _project(self, obj):
+        metadata = obj["metadata"]
+        created = metadata.get("creationTimestamp")
+        return metadata["name"], (
+            (obj.get("spec") or {}).get("nodeName"),
+            datetime.datetime.fromisoformat(created) if created else None,
+            is_pulled(obj),
+        )
+
+    def _relist(self, items):
+        self.warmup.pods = dict(items)
+        self.warmup.changed()
+
+    def _dispatch(self, event_type, item):
+        name, pod = item
+        if event_type == "DELETED":
+            self.warmup.pods.pop(name, None)
+        else:
+            self.warmup.pods[name] = pod
+        self.warmup.changed()
+
+    def _fail(self, e):
+        super()._fail(e)
+        self.warmup.changed()
+
+
+class PoolWarmup:
+    """Watches one pool's pre-pull DaemonSet and its pods, waiting needs no polling"""
+
+    def __init__(self, api_client, namespace, name):
+        self.api_client = api_client
+        self.namespace = namespace
+        self.name = name
+        self.desired = None
+        self.pods = {}
+        # Replaced on every change, like the cluster inventory's
+        self._changed = asyncio.Event()
+        self._informers = [_DaemonSetInformer(self), _PodInformer(self)]
+
+    def start(self):
+        for informer in self._informers:
+            informer.start()
+
+    async def stop(self):
+        for informer in self._informers:
+            await informer.stop()
+
+    def changed(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def _check(self):
+        for informer in self._informers:
+            if informer.error is not None:
+                raise informer.error
+
+    async def wait(self):
+        """Waits until a pod on every node of the pool has pulled its images, returning False when no node matches"""
+        for informer in self._informers:
+            await informer.synced.wait()
+        while True:
+            changed = self._changed
+            self._check()
+            if self.desired == 0:
+                return False
+            if self.desired and len(self.pods) >= self.desired and all(pulled for _, _, pulled in self.pods.values()):
+                return True
+            await changed.wait()
+
+
+async def _pull_times(core_api, namespace, pods):
+    """Seconds from each pod's creation to its last Pulled event, by node, from the events of the pods themselves"""
+
+    async def pulled_at(pod_name):
+        events = await core_api.list_namespaced_event(
+            namespace=namespace, field_selector=f"involvedObject.name={pod_name},reason=Pulled"
+        )
+        return max((when for event in events.items if (when := event_time(event)) is not None), default=None)
+
+    names = [name for name, (node, created, _) in pods.items() if node and created]
+    pulled = await asyncio.gather(*(pulled_at(name) for name in names))
+    return {
+        pods[name][0]: round((when - pods[name][1]).total_seconds(), 1)
+        for name, when in zip(names, pulled)
+        if when is not None
+    }
+
+
+async def _warm_pool(api_client, namespace, pool, images, timeout):
+    """Runs one pre-pull DaemonSet to completion, returning (node, seconds or None) for each node it landed on"""
+    apps_api = client.AppsV1Api(api_client=api_client)
+    name = _daemonset_name(*pool)
+    log.info("Pulling %s onto %s=%s nodes through %s/%s", images, pool[0], pool[1], namespace, name)
+    # Tracked before creating, so a run that dies part way still deletes it, the sweeper covers a killed runner
+    teardown.track(namespace, name, "Prepull", kind="DaemonSet", api_client=api_client)
+    warmup = PoolWarmup(api_client, namespace, name)
+    try:
+        await apps_api.create_namespaced_daemon_set(namespace=namespace, body=build_daemonset_body(name, images, *pool))
+        warmup.start()
+        try:
+            async with asyncio.timeout(timeout):
+                if not await warmup.wait():
+                    log.warning("No nodes match %s=%s", pool[0], pool[1])
+                    return []
+        except TimeoutError:
+            log.warning("Timed out after %s seconds pulling %s", timeout, images)
+
+        times = await _pull_times(client.CoreV1Api(api_client=api_client), namespace, warmup.pods)
+        return [(node, times.get(node) if pulled else None) for node, _, pulled in warmup.pods.values() if node]
+
+    finally:
+        await warmup.stop()
+        await teardown.delete_deployment(api_client, namespace, name, "Prepull", propagation_policy="Background", wait=False, kind="DaemonSet")
+
+
+async def warmup(api_client, specs, namespace=None, timeout=None):
+    """Pre-pulls every image the jobs use onto the nodes of their worker pools, reporting the pull time per node
+
+    Meant to run alongside the jobs, cancelling it still removes its DaemonSets.
+    """
+    namespace = namespace or os.getenv("PREPULL_NAMESPACE", "default")
+    timeout = float(timeout or os.getenv("PREPULL_TIMEOUT", 600))
+    pools = collect_images(specs)
+    results = await asyncio.gather(
+        *(_warm_pool(api_client, namespace, pool, images, timeout) for pool, images in pools.items()),
+        return_exceptions=True,
+    )
+
+    rows = []
+    for (pool, images), result in zip(pools.items(), results):
+        if isinstance(result, BaseException):
+            log.error("Error pre-pulling onto %s=%s nodes: %s", pool[0], pool[1], result)
+            continue
+        for node, seconds in result:
+            rows.append([f"{pool[0]}={pool[1]}", node, ", ".join(images), "Failed" if seconds is None else f"{seconds:.1f}s"])
+            log.info("%s: %s", node, "not pulled" if seconds is None else f"{seconds:.1f}s")
+
+    if rows and os.getenv("GITHUB_STEP_SUMMARY"):
+        set_summary("### Image Pre-pull\n\n" + markdown_table(["Pool", "Node", "Images", "Pull time"], rows))
+    return rows
@@ -0,0 +1,56 @@
+# In-process readiness registry, lets jobs wake up the moment an upstream job is ready
+
+import asyncio
+
+
+class DependencyFailed(Exception):
+    """Raised to waiters when the upstream job they depend on has failed"""
+
+
+_signals = {}
+
+
+def _get_signal(key):
+    signal = _signals.get(key)
+    if signal is None:
+        signal = asyncio.get_running_loop().create_future()
+        _signals[key] = signal
+    return signal
+
+
+def mark_ready(key):
+    """Marks the job published under key as ready, waking every waiter"""
+    signal = _get_signal(key)
+    if not signal.done():
+        signal.set_result(True)
+
+
+def mark_failed(key, reason):
+    """Marks the job published under key as failed, waiters raise DependencyFailed"""
+    signal = _get_signal(key)
+    if not signal.done():
+        signal.set_exception(DependencyFailed(f'"{key}" failed: {reason}'))
+        # Mark the exception as retrieved so a failure nobody waits on isn't reported as unhandled
+        signal.exception()
+
+
+def is_done(key):
+    """Whether the job published under key has been marked ready or failed"""
+    signal = _signals.get(key)
+    return signal is not None and signal.done()
+
+
+def is_ready(key):
+    signal = _signals.get(key)
+    return signal is not None and signal.done() and signal.exception() is None
+
+
+async def wait_for(key, timeout=None):
+    """Waits until the job published under key is ready, raising TimeoutError or DependencyFailed"""
+    # Shield the shared future so a timed out waiter doesn't cancel it for everyone else
+    await asyncio.wait_for(asyncio.shield(_get_signal(key)), timeout=timeout)
+
+
+def reset():
+    """Forgets every readiness signal, for running several runs in one process"""
+    _signals.clear()
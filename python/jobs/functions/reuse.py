@@ -0,0 +1,171 @@
+# Warm environment reuse, Deployments are adopted across runs by a hash of their spec under an exclusive lease
+
+import datetime
+import hashlib
+import json
+from kubernetes_asyncio import client
+from kubernetes_asyncio.client.exceptions import ApiException
+from .helpers import get_run_id, RUN_LABEL
+from .logger import get_logger
+
+# Reusable Deployments are selected by label, they don't carry a run label so the sweeper leaves them alone
+REUSABLE_LABEL = "k8s-action-runner/reusable"
+SPEC_HASH_ANNOTATION = "k8s-action-runner/spec-hash"
+# Run holding the lease and when it lapses, a run that dies keeps the lease only until then
+LEASE_HOLDER_ANNOTATION = "k8s-action-runner/lease-holder"
+LEASE_EXPIRES_ANNOTATION = "k8s-action-runner/lease-expires"
+# An environment nobody leases after this time is deleted by the sweeper
+REUSE_UNTIL_ANNOTATION = "k8s-action-runner/reuse-until"
+
+log = get_logger("Reuse")
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _format_time(when):
+    return when.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc)
+
+
+def spec_hash(body):
+    """Hashes what the environment runs (replicas, image, command, resources, node selector and tolerations)
+
+    Names and labels are left out as they carry the run that created the Deployment.
+    """
+    spec = {"replicas": body["spec"]["replicas"], "pod": body["spec"]["template"]["spec"]}
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def mark_reusable(body, digest, lease_seconds, ttl_seconds):
+    """Labels a new Deployment as reusable and leases it to this run from the start"""
+    now = _now()
+    for metadata in (body["metadata"], body["spec"]["template"]["metadata"]):
+        metadata["labels"].pop(RUN_LABEL, None)
+        metadata["labels"][REUSABLE_LABEL] = "true"
+    body["metadata"]["annotations"] = {
+        **(body["metadata"].get("annotations") or {}),
+        SPEC_HASH_ANNOTATION: digest,
+        LEASE_HOLDER_ANNOTATION: get_run_id(),
+        LEASE_EXPIRES_ANNOTATION: _format_time(now + datetime.timedelta(seconds=lease_seconds)),
+        REUSE_UNTIL_ANNOTATION: _format_time(now + datetime.timedelta(seconds=lease_seconds + ttl_seconds)),
+    }
+    return body
+
+
+def is_leased(deployment, run_id=None, now=None):
+    """Whether another run holds an unexpired lease on the Deployment"""
+    annotations = deployment.metadata.annotations or {}
+    holder = annotations.get(LEASE_HOLDER_ANNOTATION)
+    expires = _parse_time(annotations.get(LEASE_EXPIRES_ANNOTATION))
+    if not holder or holder == run_id:
+        return False
+    return expires is None or expires > (now or _now())
+
+
+def is_healthy(deployment):
+    """Available, with every replica available and the rollout not failed"""
+    status = deployment.status
+    if status is None or deployment.metadata.deletion_timestamp is not None:
+        return False
+    conditions = {condition.type: condition for condition in status.conditions or ()}
+    available = conditions.get("Available")
+    progressing = conditions.get("Progressing")
+    if progressing is not None and progressing.status == "False":
+        return False
+    return available is not None and available.status == "True" and status.available_replicas == deployment.spec.replicas
+
+
+def find_adoptable(deployments, digest, run_id, now=None):
+    """Returns the healthy, unleased Deployments with the same spec hash"""
+    return [
+        deployment
+        for deployment in deployments
+        if (deployment.metadata.annotations or {}).get(SPEC_HASH_ANNOTATION) == digest
+        and is_healthy(deployment)
+        and not is_leased(deployment, run_id, now)
+    ]
+
+
+def is_expired(deployment, now=None):
+    """Whether a reusable Deployment is unleased and past its reuse-until time"""
+    annotations = deployment.metadata.annotations or {}
+    reuse_until = _parse_time(annotations.get(REUSE_UNTIL_ANNOTATION))
+    return not is_leased(deployment, now=now) and reuse_until is not None and reuse_until <= (now or _now())
+
+
+async def _patch_annotations(api_client, namespace, name, annotations, resource_version=None):
+    """Merge patches the annotations, failing with 409 Conflict if the Deployment changed since resource_version"""
+    metadata = {"annotations": annotations}
+    if resource_version is not None:
+        metadata["resourceVersion"] = resource_version
+    apps_api = client.AppsV1Api(api_client=api_client)
+    await apps_api.patch_namespaced_deployment(
+        name=name,
+        namespace=namespace,
+        body={"metadata": metadata},
+        _content_type="application/merge-patch+json",
+    )
+
+
+async def acquire(api_client, namespace, digest, lease_seconds, ttl_seconds, log_name):
+    """Leases a healthy Deployment with the same spec hash to this run, returning its name or None
+
+    The lease is taken with the Deployment's resourceVersion as a precondition, so when two runs race
+    for the same environment only one of them wins and the other moves on to the next candidate.
+    """
+    apps_api = client.AppsV1Api(api_client=api_client)
+    deployments = await apps_api.list_namespaced_deployment(namespace=namespace, label_selector=f"{REUSABLE_LABEL}=true")
+    run_id = get_run_id()
+    now = _now()
+    for deployment in find_adoptable(deployments.items, digest, run_id, now):
+        try:
+            await _patch_annotations(
+                api_client,
+                namespace,
+                deployment.metadata.name,
+                {
+                    LEASE_HOLDER_ANNOTATION: run_id,
+                    LEASE_EXPIRES_ANNOTATION: _format_time(now + datetime.timedelta(seconds=lease_seconds)),
+                    REUSE_UNTIL_ANNOTATION: _format_time(now + datetime.timedelta(seconds=lease_seconds + ttl_seconds)),
+                },
+                resource_version=deployment.metadata.resource_version,
+            )
+        except ApiException as e:
+            if e.status in (404, 409):
+                # Another run leased or deleted it first
+                continue
+            raise
+        log.info("Adopted %s/%s with spec hash %s", namespace, deployment.metadata.name, digest[:12], extra={"job": log_name})
+        return deployment.metadata.name
+    return None
+
+
+async def release(api_client, namespace, name, ttl_seconds, log_name):
+    """Gives up this run's lease, the environment stays up for other runs for ttl_seconds"""
+    apps_api = client.AppsV1Api(api_client=api_client)
+    try:
+        deployment = await apps_api.read_namespaced_deployment(name=name, namespace=namespace)
+        if (deployment.metadata.annotations or {}).get(LEASE_HOLDER_ANNOTATION) != get_run_id():
+            log.warning("Lease on %s/%s already lapsed, not releasing", namespace, name, extra={"job": log_name})
+            return
+        await _patch_annotations(
+            api_client,
+            namespace,
+            name,
+            {
+                LEASE_HOLDER_ANNOTATION: None,
+                LEASE_EXPIRES_ANNOTATION: None,
+                REUSE_UNTIL_ANNOTATION: _format_time(_now() + datetime.timedelta(seconds=ttl_seconds)),
+            },
+            resource_version=deployment.metadata.resource_version,
+        )
+        log.info("Released %s/%s, kept for reuse for %s seconds", namespace, name, ttl_seconds, extra={"job": log_name})
+    except Exception as e:
+        log.error("Error releasing %s/%s: %s", namespace, name, e, extra={"job": log_name})
@@ -0,0 +1,312 @@
+# Declarative job scheduler, runs a manifest of Deployment and Job jobs as a dependency graph
+
+import asyncio
+import json
+import os
+import time
+import yaml
+from .deployment import main as create_deployment
+from .logger import get_logger
+from . import readiness, shards as sharding, supervisor
+from .timing import get_timer
+
+log = get_logger("Scheduler")
+
+
+# Manifest keys that are passed through to the deployment builder unchanged
+JOB_FIELDS = (
+    "namespace",
+    "replicas",
+    "progress_deadline_seconds",
+    "image",
+    "container_name",
+    "command",
+    "cpu_limit",
+    "memory_limit",
+    "node_selector_key",
+    "node_selector_value",
+    "wait_timeout",
+    "watch_timeout",
+    "log_name",
+    "log_description",
+    "cleanup_object",
+    "propagation_policy",
+    "wait_for_deletion",
+    "reuse",
+    "reuse_ttl",
+    "admission",
+    "admission_timeout",
+    "workload",
+    "backoff_limit",
+    "active_deadline_seconds",
+    "ttl_seconds_after_finished",
+    "stream_logs",
+    "server_side_apply",
+)
+
+
+def load_manifest(path):
+    """Loads a YAML or JSON run manifest and validates its dependency graph"""
+    with open(path) as fh:
+        manifest = yaml.safe_load(fh)
+    return validate_manifest(manifest, path)
+
+
+def validate_manifest(manifest, path="<manifest>"):
+    """Checks the manifest's structure, concurrency and dependency graph, returning it unchanged"""
+    if not isinstance(manifest, dict):
+        raise ValueError(f"Run manifest {path} is empty or not a mapping")
+
+    concurrency = manifest.get("concurrency")
+    if concurrency is not None and (not isinstance(concurrency, int) or concurrency < 1):
+        raise ValueError(f"concurrency must be an integer of at least 1, got {concurrency!r}")
+
+    jobs = manifest.get("jobs") or []
+    names = [job["name"] for job in jobs]
+    if len(names) != len(set(names)):
+        raise ValueError(f"Duplicate job names in manifest {path}")
+
+    for job in jobs:
+        if not isinstance(job.get("depends_on", []), list):
+            raise ValueError(f'Job "{job["name"]}" depends_on must be a list of job names')
+        for dependency in job.get("depends_on", []):
+            if dependency not in names:
+                raise ValueError(f'Job "{job["name"]}" depends on unknown job "{dependency}"')
+
+    if manifest.get("shards") is not None:
+        shard_names = [shard["name"] for shard in sharding.validate_shards(manifest["shards"], path)]
+        for job in jobs:
+            if job.get("shard") is not None and job["shard"] not in shard_names:
+                raise ValueError(f'Job "{job["name"]}" has affinity to unknown shard "{job["shard"]}"')
+
+    completion_job = manifest.get("completion_job")
+    if completion_job not in names:
+        raise ValueError(f'Completion job "{completion_job}" is not defined in the manifest')
+
+    # Reject cycles up front, they would otherwise wait until every edge timed out
+    visited, visiting = set(), set()
+    by_name = {job["name"]: job for job in jobs}
+
+    def visit(name):
+        if name in visiting:
+            raise ValueError(f'Dependency cycle detected at job "{name}"')
+        if name not in visited:
+            visiting.add(name)
+            for dependency in by_name[name].get("depends_on", []):
+                visit(dependency)
+            visiting.discard(name)
+            visited.add(name)
+
+    for name in names:
+        visit(name)
+
+    return manifest
+
+
+class Scheduler:
+    """Starts each manifest job as soon as its dependencies are ready, capping how many jobs are starting at once"""
+
+    def __init__(self, manifest, shards=(), **kwargs):
+        self.manifest = manifest
+        # Jobs run on the shard they are placed on when there are shards, on the run's client otherwise
+        self.shards = list(shards)
+        self.placement = {}
+        self.defaults = manifest.get("defaults", {})
+        self.jobs = manifest.get("jobs", [])
+        self.concurrency = int(manifest.get("concurrency", len(self.jobs) or 1))
+        self.job_kwargs = kwargs
+        self.run_suffix = os.getenv("NAME_APPEND").split("/", 1)[1]
+        # The whole run's deadline, and whether the first failed job cancels the others
+        self.run_timeout = manifest.get("run_timeout", supervisor.get_run_timeout())
+        self.fail_fast = manifest.get("fail_fast", supervisor.get_fail_fast())
+        self.timings = {}
+
+        # The job whose Availability, or completion for a Job workload, marks the main workload as done, every other job waits on it
+        self.completion_job = manifest["completion_job"]
+
+    def _render_name(self, name):
+        return name + "-" + self.run_suffix
+
+    def _shard(self, name):
+        shard_name = self.placement.get(name)
+        return next((shard for shard in self.shards if shard.name == shard_name), None)
+
+    def _job_kwargs(self, job):
+        """Merges manifest defaults and the job entry into deployment builder arguments"""
+        spec = {**self.defaults, **job}
+        kwargs = {
+            "namespace": "default",
+            "image": "busybox",
+            "container_name": job["name"],
+            "node_selector_key": os.getenv("NODE_SELECTOR_KEY", "kubernetes.io/os"),
+            "node_selector_value": os.getenv("NODE_SELECTOR_VALUE", "linux"),
+            "progress_deadline_seconds": 500,
+            "log_name": job["name"],
+            "log_description": job["name"],
+            "cleanup_object": True,
+        }
+        kwargs.update({key: spec[key] for key in JOB_FIELDS if key in spec})
+        if not isinstance(kwargs.get("command"), str):
+            kwargs["command"] = json.dumps(kwargs.get("command", []))
+
+        kwargs.update(self.job_kwargs)
+        # The shard's client, and its namespace when it has one, replace the run's
+        shard = self._shard(job["name"])
+        if shard is not None:
+            kwargs["api_client"] = shard.api_client
+            kwargs["namespace"] = shard.namespace or kwargs["namespace"]
+        kwargs.update(
+            monitor=False,
+            name=self._render_name(job["name"]),
+            # Dependencies are awaited by the scheduler before the job takes a concurrency slot
+            set_ready=job["name"],
+            wait_for_ready=False,
+            wait_for_ready_var=None,
+            wait_description=None,
+        )
+        kwargs.update(self._completion_kwargs(job))
+        return kwargs
+
+    def _completion_kwargs(self, job):
+        """Where the completion job runs, every other job waits on it, through its shard's client when it's on another shard"""
+        completion_job = next(job for job in self.jobs if job["name"] == self.completion_job)
+        spec = {**self.defaults, **completion_job}
+        kwargs = {
+            "completion_job_name": self._render_name(self.completion_job),
+            "completion_job_namespace": spec.get("namespace", "default"),
+            "completion_job_workload": spec.get("workload", "deployment"),
+        }
+        shard = self._shard(self.completion_job)
+        if shard is not None:
+            kwargs["completion_job_namespace"] = shard.namespace or kwargs["completion_job_namespace"]
+            if shard is not self._shard(job["name"]):
+                kwargs["completion_api_client"] = shard.api_client
+        return kwargs
+
+    async def place(self):
+        """Places the jobs on the shards, by free capacity unless SHARD_PLACEMENT=balanced, keeping dependent jobs together"""
+        jobs = [
+            {**self._job_kwargs(job), "name": job["name"], "depends_on": job.get("depends_on", []), "shard": {**self.defaults, **job}.get("shard")}
+            for job in self.jobs
+        ]
+        free = None
+        if sharding.get_placement() == "capacity":
+            free = await sharding.free_capacity(self.shards, set(sharding.demand(jobs)))
+        self.placement = sharding.place(jobs, self.shards, free)
+        for shard in self.shards:
+            placed = [name for name, shard_name in self.placement.items() if shard_name == shard.name]
+            log.info("Shard %s (%s/%s): %s", shard.name, shard.context or "default context", shard.namespace or "job namespaces", placed)
+        return self.placement
+
+    def job_specs(self):
+        """Deployment builder arguments for every job, e.g. to collect the images the run will pull"""
+        return [self._job_kwargs(job) for job in self.jobs]
+
+    async def _run_job(self, job, slots):
+        name = job["name"]
+        kwargs = self._job_kwargs(job)
+        timing = self.timings[name] = {"queued": time.monotonic()}
+        job_timer = get_timer(kwargs["log_name"], kwargs["namespace"], kwargs["name"])
+        job_timer.mark("queued", at=timing["queued"])
+
+        dependencies = job.get("depends_on", [])
+        if dependencies:
+            log.info("%s waiting for %s..", name, dependencies)
+            wait_timeout = kwargs.get("wait_timeout", 600)
+            try:
+                await asyncio.gather(
+                    *(readiness.wait_for(dependency, timeout=wait_timeout) for dependency in dependencies)
+                )
+            except (TimeoutError, readiness.DependencyFailed) as e:
+                reason = e if str(e) else f"timed out after {wait_timeout} seconds waiting for {dependencies}"
+                log.warning("%s will not start: %s", name, reason)
+                readiness.mark_failed(name, f"dependency not ready: {reason}")
+                timing["finished"] = time.monotonic()
+                # A failed dependency is reported by that job, this one is only skipped and doesn't trigger fail-fast
+                return kwargs["log_name"], "Skipped" if isinstance(e, readiness.DependencyFailed) else "Failed"
+        timing["dependencies_ready"] = time.monotonic()
+        job_timer.mark("dependencies_ready", at=timing["dependencies_ready"])
+
+        # Hold a slot from creation until the job is ready, or has completed for a Job, so long-lived jobs don't starve their dependents
+        task = None
+        try:
+            async with slots:
+                timing["started"] = time.monotonic()
+                task = asyncio.create_task(create_deployment(**kwargs))
+                ready = asyncio.ensure_future(readiness.wait_for(name))
+                try:
+                    await asyncio.wait({task, ready}, return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    if ready.done() and not ready.cancelled() and not ready.exception():
+                        timing["ready"] = time.monotonic()
+                    else:
+                        ready.cancel()
+
+            return await task
+        finally:
+            # asyncio.wait doesn't cancel what it waits on, cancel the job and let it clean up when the run is cancelled
+            if task is not None and not task.done():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+            timing["finished"] = time.monotonic()
+
+    async def run(self):
+        """Runs every job in the manifest, returns a list of (log_name, status) results"""
+        if self.shards:
+            await self.place()
+        log.info("Starting %d jobs with a concurrency of %d", len(self.jobs), self.concurrency)
+        self.started = time.monotonic()
+        slots = asyncio.Semaphore(self.concurrency)
+        job_results = await supervisor.supervise(
+            [(self._job_kwargs(job)["log_name"], self._run_job(job, slots), job.get("timeout")) for job in self.jobs],
+            run_timeout=self.run_timeout,
+            fail_fast=self.fail_fast,
+        )
+        self.report_critical_path()
+        if self.shards:
+            # Results are keyed by log name, as the run's exit status and summary are
+            log_names = {job["name"]: self._job_kwargs(job)["log_name"] for job in self.jobs}
+            sharding.report(self.shards, {log_names[name]: shard for name, shard in self.placement.items()}, job_results)
+        return job_results
+
+    def critical_path(self):
+        """Returns the chain of jobs that gated the end of the run, following the last dependency to become ready"""
+        finished = [name for name in self.timings if "finished" in self.timings[name]]
+        if not finished:
+            return []
+
+        by_name = {job["name"]: job for job in self.jobs}
+        path = [max(finished, key=lambda name: self.timings[name]["finished"])]
+        while True:
+            dependencies = [
+                dependency for dependency in by_name[path[-1]].get("depends_on", [])
+                if "ready" in self.timings.get(dependency, {})
+            ]
+            if not dependencies:
+                break
+            path.append(max(dependencies, key=lambda name: self.timings[name]["ready"]))
+        return list(reversed(path))
+
+    def report_critical_path(self):
+        path = self.critical_path()
+        if not path:
+            return
+        log.info("Critical path: %s", " -> ".join(path))
+        for name in path:
+            timing = self.timings[name]
+            started = timing.get("started", timing["queued"])
+            segments = {
+                "waited": started - timing["queued"],
+                "to_ready": timing["ready"] - started if "ready" in timing else None,
+                "total": timing["finished"] - started if "finished" in timing else None,
+            }
+            rendered = ", ".join(
+                f"{key}={value:.1f}s" for key, value in segments.items() if value is not None
+            )
+            log.info("  %s: %s", name, rendered)
+        log.info("Run wall-clock: %.1fs", time.monotonic() - self.started)
+
+
+async def main(manifest_path, **kwargs):
+    manifest = load_manifest(manifest_path)
+    return await Scheduler(manifest, **kwargs).run()
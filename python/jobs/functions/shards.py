@@ -0,0 +1,206 @@
+# Multi-cluster and multi-namespace sharding, places manifest jobs onto kubeconfig contexts and namespaces with their own clients
+
+import asyncio
+import decimal
+import json
+import os
+from kubernetes_asyncio import client, config
+from . import capacity
+from .clients import ClientManager
+from .helpers import markdown_table, set_summary
+from .logger import get_logger
+
+log = get_logger("Shards")
+
+
+def get_placement():
+    """capacity places on the shard with the most free CPU in the jobs' pools, balanced spreads jobs by shard weight"""
+    return os.getenv("SHARD_PLACEMENT", "capacity").lower()
+
+
+def get_sync_timeout():
+    return float(os.getenv("SHARD_SYNC_TIMEOUT", 30))
+
+
+class Shard:
+    """A kubeconfig context and namespace jobs can be placed on, with its own pooled client"""
+
+    def __init__(self, name, context=None, namespace=None, kubeconfig=None, weight=1):
+        self.name = name
+        self.context = context
+        self.namespace = namespace
+        self.kubeconfig = os.path.expanduser(kubeconfig) if kubeconfig else None
+        self.weight = float(weight)
+        self.clients = ClientManager()
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(
+            name=spec["name"],
+            context=spec.get("context"),
+            namespace=spec.get("namespace"),
+            kubeconfig=spec.get("kubeconfig"),
+            weight=spec.get("weight", 1),
+        )
+
+    @property
+    def api_client(self):
+        return self.clients.api_client
+
+    async def start(self):
+        """Loads the shard's context into its own configuration, a shard without one uses the run's loaded config"""
+        configuration = None
+        if self.context or self.kubeconfig:
+            configuration = client.Configuration()
+            await config.load_kube_config(
+                config_file=self.kubeconfig, context=self.context, client_configuration=configuration, persist_config=False
+            )
+        return await self.clients.start(configuration)
+
+    async def close(self):
+        await self.clients.close()
+
+
+def validate_shards(specs, path="<manifest>"):
+    """Checks the shards are mappings with unique names and positive weights, returning them unchanged"""
+    if not isinstance(specs, list) or not all(isinstance(spec, dict) and spec.get("name") for spec in specs):
+        raise ValueError(f"shards in {path} must be a list of mappings with a name")
+    names = [spec["name"] for spec in specs]
+    if len(names) != len(set(names)):
+        raise ValueError(f"Duplicate shard names in {path}")
+    for spec in specs:
+        weight = spec.get("weight", 1)
+        if not isinstance(weight, (int, float)) or weight <= 0:
+            raise ValueError(f'Shard "{spec["name"]}" weight must be a positive number, got {weight!r}')
+    return specs
+
+
+def load_shards(manifest=None):
+    """The manifest's shards, or the JSON list in SHARDS, an empty list runs every job on the run's own client"""
+    specs = (manifest or {}).get("shards")
+    if specs is None and os.getenv("SHARDS"):
+        specs = validate_shards(json.loads(os.getenv("SHARDS")), "SHARDS")
+    return [Shard.from_spec(spec) for spec in specs or ()]
+
+
+def components(jobs):
+    """Groups jobs connected by depends_on edges in either direction, in manifest order"""
+    parent = {job["name"]: job["name"] for job in jobs}
+
+    def find(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    for job in jobs:
+        for dependency in job.get("depends_on") or ():
+            parent[find(dependency)] = find(job["name"])
+
+    groups = {}
+    for job in jobs:
+        groups.setdefault(find(job["name"]), []).append(job)
+    return list(groups.values())
+
+
+def _pool(job):
+    return job.get("node_selector_key"), job.get("node_selector_value")
+
+
+def demand(jobs):
+    """CPU the jobs request per worker pool, {(node_selector_key, node_selector_value): cpu}"""
+    pools = {}
+    for job in jobs:
+        cpu = capacity.parse_quantity(job.get("cpu_limit")) * int(job.get("replicas", 1))
+        pools[_pool(job)] = pools.get(_pool(job), decimal.Decimal(0)) + cpu
+    return pools
+
+
+def pool_free(inventory, pools):
+    """Free CPU across the inventory's schedulable nodes of each pool"""
+    free = inventory.free()
+    return {
+        pool: sum((free[node.name][0] for node in inventory.nodes.values() if node.name in free and node.matches(*pool)), decimal.Decimal(0))
+        for pool in pools
+    }
+
+
+def place(jobs, shards, free=None):
+    """Places each group of dependent jobs on one shard, returning {job name: shard name}
+
+    A job's shard affinity places its whole group, conflicting affinities raise ValueError. Other groups go to
+    the shard whose pools keep the most free CPU once the group is placed, given free as {shard name: {pool: cpu}},
+    or to the least loaded shard by weight when free is None or the group fits nowhere.
+    """
+    by_name = {shard.name: shard for shard in shards}
+    placed_jobs = {shard.name: 0 for shard in shards}
+    placed_cpu = {shard.name: {} for shard in shards}
+    placement = {}
+
+    def headroom(shard_name, needed):
+        if free is None or free.get(shard_name) is None:
+            return None
+        return min(
+            free[shard_name].get(pool, decimal.Decimal(0)) - placed_cpu[shard_name].get(pool, decimal.Decimal(0)) - cpu
+            for pool, cpu in needed.items()
+        )
+
+    for group in components(jobs):
+        names = [job["name"] for job in group]
+        affinity = {job["shard"] for job in group if job.get("shard")}
+        if len(affinity) > 1:
+            raise ValueError(f"Dependent jobs {names} have conflicting shard affinities {sorted(affinity)}")
+        unknown = affinity - set(by_name)
+        if unknown:
+            raise ValueError(f"Jobs {names} have affinity to unknown shard {unknown.pop()!r}")
+
+        needed = demand(group)
+        if affinity:
+            target = affinity.pop()
+        else:
+            fitting = [
+                (room, shard.name) for shard in shards
+                if (room := headroom(shard.name, needed)) is not None and room >= 0
+            ]
+            if fitting:
+                target = max(fitting)[1]
+            else:
+                target = min(shards, key=lambda shard: placed_jobs[shard.name] / shard.weight).name
+
+        placed_jobs[target] += len(group)
+        for pool, cpu in needed.items():
+            placed_cpu[target][pool] = placed_cpu[target].get(pool, decimal.Decimal(0)) + cpu
+        placement.update((name, target) for name in names)
+    return placement
+
+
+async def free_capacity(shards, pools, timeout=None):
+    """Free CPU per pool of every shard from its cluster inventory, None for shards whose nodes couldn't be listed in time"""
+    timeout = get_sync_timeout() if timeout is None else timeout
+
+    async def shard_free(shard):
+        inventory = capacity.get_inventory(shard.api_client)
+        try:
+            async with asyncio.timeout(timeout):
+                await inventory.sync()
+        except Exception as e:
+            log.warning("Unable to read the capacity of shard %s, placing by weight: %s", shard.name, str(e) or "timed out")
+            return None
+        return pool_free(inventory, pools)
+
+    return dict(zip((shard.name for shard in shards), await asyncio.gather(*(shard_free(shard) for shard in shards))))
+
+
+def report(shards, placement, job_results):
+    """Logs each shard's jobs and failures and adds a per-shard table to the step summary"""
+    statuses = dict(job_results)
+    rows = []
+    for shard in shards:
+        jobs = [name for name, shard_name in placement.items() if shard_name == shard.name]
+        failed = [name for name in jobs if statuses.get(name) == "Failed"]
+        log.info("Shard %s ran %d jobs, %d failed: %s", shard.name, len(jobs), len(failed), jobs)
+        rows.append([shard.name, shard.context or "-", shard.namespace or "-", ", ".join(jobs) or "-", ", ".join(failed) or "-"])
+
+    if os.getenv("GITHUB_STEP_SUMMARY"):
+        set_summary("### Shards\n\n" + markdown_table(["Shard", "Context", "Namespace", "Jobs", "Failed"], rows))
+    return rows
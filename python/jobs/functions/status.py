@@ -0,0 +1,160 @@
+# Compact Deployment and Job status projections, built straight from raw watch JSON without model deserialization
+
+
+class DeploymentStatus:
+    """The handful of Deployment fields jobs act on, with conditions looked up by type"""
+
+    __slots__ = (
+        "name",
+        "resource_version",
+        "replicas",
+        "available_replicas",
+        "available",
+        "progressing",
+        "reason",
+        "message",
+    )
+
+    def __init__(self, name, resource_version=None, replicas=None, available_replicas=None, available=None, progressing=None, reason=None, message=None):
+        self.name = name
+        self.resource_version = resource_version
+        self.replicas = replicas
+        self.available_replicas = available_replicas
+        self.available = available
+        self.progressing = progressing
+        self.reason = reason
+        self.message = message
+
+    @classmethod
+    def from_raw(cls, obj):
+        """Projects a Deployment as decoded from the API's JSON into a snapshot"""
+        metadata = obj.get("metadata", {})
+        status = obj.get("status") or {}
+        conditions = {condition.get("type"): condition for condition in status.get("conditions") or ()}
+        available = conditions.get("Available", {})
+        progressing = conditions.get("Progressing", {})
+        # A failed rollout is reported on Progressing, otherwise Available carries the most useful message
+        reported = progressing if progressing.get("status") == "False" else available or progressing
+        return cls(
+            name=metadata.get("name"),
+            resource_version=metadata.get("resourceVersion"),
+            replicas=(obj.get("spec") or {}).get("replicas"),
+            available_replicas=status.get("availableReplicas"),
+            available=available.get("status"),
+            progressing=progressing.get("status"),
+            reason=reported.get("reason"),
+            message=reported.get("message"),
+        )
+
+    def state(self):
+        """Fields that matter to jobs, resource_version alone changing is not a state change"""
+        return (
+            self.replicas,
+            self.available_replicas,
+            self.available,
+            self.progressing,
+            self.reason,
+            self.message,
+        )
+
+    @property
+    def failed(self):
+        return self.progressing == "False" and self.reason == "ProgressDeadlineExceeded"
+
+    def is_ready(self, replicas):
+        return self.available_replicas == replicas and self.available == "True"
+
+    def __eq__(self, other):
+        return isinstance(other, DeploymentStatus) and self.name == other.name and self.state() == other.state()
+
+    def __repr__(self):
+        return (
+            f"{self.name}: available={self.available} ({self.available_replicas or 0}/{self.replicas}), "
+            f"progressing={self.progressing}, reason={self.reason}, message={self.message}"
+        )
+
+
+class JobStatus:
+    """The batch/v1 Job fields jobs act on, a Job is finished once its Complete or Failed condition is True"""
+
+    __slots__ = (
+        "name",
+        "resource_version",
+        "completions",
+        "active",
+        "succeeded_pods",
+        "failed_pods",
+        "complete",
+        "failure",
+        "reason",
+        "message",
+    )
+
+    def __init__(self, name, resource_version=None, completions=None, active=None, succeeded_pods=None, failed_pods=None, complete=None, failure=None, reason=None, message=None):
+        self.name = name
+        self.resource_version = resource_version
+        self.completions = completions
+        self.active = active
+        self.succeeded_pods = succeeded_pods
+        self.failed_pods = failed_pods
+        self.complete = complete
+        self.failure = failure
+        self.reason = reason
+        self.message = message
+
+    @classmethod
+    def from_raw(cls, obj):
+        """Projects a Job as decoded from the API's JSON into a snapshot"""
+        metadata = obj.get("metadata", {})
+        status = obj.get("status") or {}
+        conditions = {condition.get("type"): condition for condition in status.get("conditions") or ()}
+        complete = conditions.get("Complete", {})
+        failed = conditions.get("Failed", {})
+        # Failed carries the reason, e.g. BackoffLimitExceeded or DeadlineExceeded
+        reported = failed if failed.get("status") == "True" else complete
+        return cls(
+            name=metadata.get("name"),
+            resource_version=metadata.get("resourceVersion"),
+            completions=(obj.get("spec") or {}).get("completions"),
+            active=status.get("active"),
+            succeeded_pods=status.get("succeeded"),
+            failed_pods=status.get("failed"),
+            complete=complete.get("status"),
+            failure=failed.get("status"),
+            reason=reported.get("reason"),
+            message=reported.get("message"),
+        )
+
+    def state(self):
+        return (
+            self.completions,
+            self.active,
+            self.succeeded_pods,
+            self.failed_pods,
+            self.complete,
+            self.failure,
+            self.reason,
+            self.message,
+        )
+
+    @property
+    def failed(self):
+        return self.failure == "True"
+
+    @property
+    def succeeded(self):
+        return self.complete == "True"
+
+    def is_ready(self, replicas):
+        """A Job is only done with once it has completed, readiness of its pods means nothing to dependents"""
+        return self.succeeded
+
+    def __eq__(self, other):
+        return isinstance(other, JobStatus) and self.name == other.name and self.state() == other.state()
+
+    def __repr__(self):
+        return (
+            f"{self.name}: complete={self.complete}, failed={self.failure} "
+            f"(active={self.active or 0}, succeeded={self.succeeded_pods or 0}/{self.completions}, failed={self.failed_pods or 0}), "
+            f"reason={self.reason}, message={self.message}"
+        )
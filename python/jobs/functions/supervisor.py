@@ -0,0 +1,64 @@
+# Structured concurrency for a run's jobs, the first failure cancels the rest and every job still cleans up
+
+import asyncio
+import os
+from .logger import get_logger
+
+log = get_logger("Supervisor")
+
+
+class JobFailed(Exception):
+    """Raised inside the task group to cancel the sibling jobs of a job that failed"""
+
+
+def get_run_timeout():
+    run_timeout = os.getenv("RUN_TIMEOUT")
+    return float(run_timeout) if run_timeout else None
+
+
+def get_fail_fast():
+    return os.getenv("FAIL_FAST", "True").lower() == "true"
+
+
+async def supervise(jobs, run_timeout=None, fail_fast=True):
+    """Runs (log_name, coroutine, job_timeout) jobs in a task group, returning a (log_name, status) result per job
+
+    A job fails when it returns a Failed status, raises or runs past its job_timeout. With fail_fast the
+    first failure cancels the other jobs, whose cleanup still runs, and they are reported as Cancelled.
+    Jobs still running at the run_timeout are cancelled and reported as Failed.
+    """
+    results = {log_name: "Cancelled" for log_name, _, _ in jobs}
+
+    async def run(log_name, job, job_timeout):
+        try:
+            async with asyncio.timeout(job_timeout):
+                result = await job
+            status = result[1] if isinstance(result, tuple) else result
+        except TimeoutError:
+            log.error("%s timed out after %s seconds", log_name, job_timeout)
+            status = "Failed"
+        except Exception as e:
+            log.error("%s failed with an unexpected error: %s", log_name, e, exc_info=True)
+            status = "Failed"
+
+        results[log_name] = status
+        if fail_fast and status == "Failed":
+            raise JobFailed(log_name)
+
+    try:
+        async with asyncio.timeout(run_timeout):
+            async with asyncio.TaskGroup() as group:
+                for log_name, job, job_timeout in jobs:
+                    group.create_task(run(log_name, job, job_timeout))
+
+    except* JobFailed as failed:
+        failed_jobs = [str(e) for e in failed.exceptions]
+        log.error("%s failed, cancelled the remaining jobs", failed_jobs)
+
+    except* TimeoutError:
+        log.error("Run timed out after %s seconds, cancelled the remaining jobs", run_timeout)
+        for log_name, status in results.items():
+            if status == "Cancelled":
+                results[log_name] = "Failed"
+
+    return [(log_name, results[log_name]) for log_name, _, _ in jobs]
@@ -0,0 +1,235 @@
+# Run teardown and orphan sweeping, deletes Deployments and Jobs concurrently with an explicit propagation policy
+
+import asyncio
+import datetime
+import os
+from kubernetes_asyncio import client
+from kubernetes_asyncio.client.exceptions import ApiException
+from .helpers import get_run_id, RUN_LABEL
+from .informer import get_informer, INFORMERS
+from .logger import get_logger
+from . import reuse
+
+log = get_logger("Teardown")
+
+
+# (namespace, name) -> (log name, kind, client) of every Deployment, Job or DaemonSet this run created and has not deleted yet
+_created = {}
+
+
+def track(namespace, name, log_name, kind="Deployment", api_client=None):
+    """Records a Deployment, Job or DaemonSet the run created, so the teardown stage deletes it if its job doesn't
+
+    api_client is the client of the shard it was created on, the run's client is used when it's None.
+    """
+    _created[(namespace, name)] = (log_name, kind, api_client)
+
+
+def untrack(namespace, name):
+    _created.pop((namespace, name), None)
+
+
+def get_propagation_policy():
+    """Foreground deletes the ReplicaSets or pods before the Deployment or Job itself disappears
+
+    An explicit policy matters for Jobs, whose API default orphans their pods.
+    """
+    return os.getenv("TEARDOWN_PROPAGATION_POLICY", "Foreground")
+
+
+def get_wait():
+    return os.getenv("TEARDOWN_WAIT", "False").lower() == "true"
+
+
+async def shielded(coro):
+    """Runs cleanup to completion even when the caller is cancelled part way, then passes the cancellation on"""
+    task = asyncio.ensure_future(coro)
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await task
+        raise
+
+
+async def wait_for_deleted(informer, name, timeout):
+    """Waits until the informer has seen the named object go, raising TimeoutError after timeout"""
+    async with asyncio.timeout(timeout):
+        # Subscribe before checking the cache, so a delete landing in between isn't missed
+        async with informer.subscribe(name) as events:
+            await informer.synced.wait()
+            if informer.error is not None:
+                raise informer.error
+            if name not in informer.cache:
+                return
+            async for event_type, _ in events:
+                if event_type == "DELETED":
+                    return
+
+
+async def delete_deployment(
+    api_client,
+    namespace,
+    name,
+    log_name,
+    propagation_policy=None,
+    wait=None,
+    timeout=300,
+    label_selector=None,
+    kind="Deployment",
+):
+    """Deletes a Deployment, Job or DaemonSet, optionally waiting for it and its pods to be gone, returning Deleted, Gone or Failed
+
+    Waiting goes through the namespace's informer for label_selector, the run's own informer by default. There is
+    no DaemonSet informer, DaemonSets are deleted without waiting.
+    """
+    if kind == "Job":
+        delete = client.BatchV1Api(api_client=api_client).delete_namespaced_job
+    elif kind == "DaemonSet":
+        delete = client.AppsV1Api(api_client=api_client).delete_namespaced_daemon_set
+    else:
+        delete = client.AppsV1Api(api_client=api_client).delete_namespaced_deployment
+    propagation_policy = propagation_policy or get_propagation_policy()
+    wait = get_wait() if wait is None else wait
+    try:
+        await delete(
+            namespace=namespace,
+            name=name,
+            body={"propagationPolicy": propagation_policy},
+        )
+    except ApiException as e:
+        if e.status == 404:
+            untrack(namespace, name)
+            return "Gone"
+        log.error("Error deleting %s/%s: %s", namespace, name, e, extra={"job": log_name})
+        return "Failed"
+    except Exception as e:
+        log.error("Error deleting %s/%s: %s", namespace, name, e, extra={"job": log_name})
+        return "Failed"
+
+    untrack(namespace, name)
+    if wait and kind in INFORMERS:
+        try:
+            await wait_for_deleted(get_informer(namespace, api_client, label_selector=label_selector, kind=kind), name, timeout)
+        except TimeoutError:
+            log.warning("Timed out after %s seconds waiting for %s/%s to be deleted", timeout, namespace, name, extra={"job": log_name})
+            return "Failed"
+        except Exception as e:
+            log.warning("Unable to confirm %s/%s was deleted: %s", namespace, name, e, extra={"job": log_name})
+            return "Failed"
+    return "Deleted"
+
+
+async def delete_deployments(api_client, targets, propagation_policy=None, wait=None, timeout=300, label_selector=None, kind="Deployment"):
+    """Deletes (namespace, name, log_name) targets concurrently, returning a status per target in order"""
+    return await asyncio.gather(
+        *(
+            delete_deployment(
+                api_client,
+                namespace,
+                name,
+                log_name,
+                propagation_policy=propagation_policy,
+                wait=wait,
+                timeout=timeout,
+                label_selector=label_selector,
+                kind=kind,
+            )
+            for namespace, name, log_name in targets
+        )
+    )
+
+
+async def teardown_run(api_client, propagation_policy=None, wait=None, timeout=300):
+    """Deletes every Deployment and Job the run created that its job did not clean up, e.g. after a job crashed"""
+    targets = [
+        (object_client or api_client, namespace, name, log_name, kind)
+        for (namespace, name), (log_name, kind, object_client) in _created.items()
+    ]
+    if not targets:
+        return []
+    log.info("Deleting %d leftover objects..", len(targets))
+    results = await asyncio.gather(
+        *(
+            delete_deployment(
+                object_client, namespace, name, log_name, propagation_policy=propagation_policy, wait=wait, timeout=timeout, kind=kind
+            )
+            for object_client, namespace, name, log_name, kind in targets
+        )
+    )
+    for (_, namespace, name, _, _), result in zip(targets, results):
+        log.info("%s/%s: %s", namespace, name, result)
+    return results
+
+
+def find_stale(deployments, max_age_seconds, run_id, now=None):
+    """Returns the run labelled Deployments or DaemonSets older than max_age_seconds that belong to another run"""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    stale = []
+    for deployment in deployments:
+        labels = deployment.metadata.labels or {}
+        created = deployment.metadata.creation_timestamp
+        if RUN_LABEL not in labels or labels[RUN_LABEL] == run_id or created is None:
+            continue
+        if (now - created).total_seconds() >= max_age_seconds:
+            stale.append(deployment)
+    return stale
+
+
+async def _list(apps_api, label_selector, namespaces, kind="Deployment"):
+    resource = "daemon_set" if kind == "DaemonSet" else "deployment"
+    if not namespaces:
+        return (await getattr(apps_api, f"list_{resource}_for_all_namespaces")(label_selector=label_selector)).items
+    objects = []
+    for namespace in namespaces:
+        objects += (await getattr(apps_api, f"list_namespaced_{resource}")(namespace=namespace, label_selector=label_selector)).items
+    return objects
+
+
+async def sweep(api_client, max_age_seconds=None, namespaces=None, dry_run=False, wait=None, timeout=300):
+    """Deletes Deployments and pre-pull DaemonSets left behind by earlier runs, e.g. when the runner pod was killed mid-run
+
+    Deployments and DaemonSets carrying the run label of another run and older than max_age_seconds are deleted,
+    as are reusable environments nobody has leased since their reuse TTL ran out. Every namespace is swept unless
+    namespaces is given. Returns the (namespace, name) of each stale object. Jobs are left to their
+    activeDeadlineSeconds and ttlSecondsAfterFinished.
+    """
+    max_age_seconds = float(max_age_seconds if max_age_seconds is not None else os.getenv("SWEEP_MAX_AGE", 7200))
+    if namespaces is None and os.getenv("SWEEP_NAMESPACES"):
+        namespaces = [namespace.strip() for namespace in os.getenv("SWEEP_NAMESPACES").split(",") if namespace.strip()]
+
+    apps_api = client.AppsV1Api(api_client=api_client)
+    stale = find_stale(await _list(apps_api, RUN_LABEL, namespaces), max_age_seconds, get_run_id())
+    targets = [
+        (deployment.metadata.namespace, deployment.metadata.name, f"run {deployment.metadata.labels[RUN_LABEL]}")
+        for deployment in stale
+    ]
+    expired = [
+        deployment
+        for deployment in await _list(apps_api, f"{reuse.REUSABLE_LABEL}=true", namespaces)
+        if reuse.is_expired(deployment)
+    ]
+    reusable_targets = [(deployment.metadata.namespace, deployment.metadata.name, "expired reusable environment") for deployment in expired]
+    daemonset_targets = [
+        (daemonset.metadata.namespace, daemonset.metadata.name, f"run {daemonset.metadata.labels[RUN_LABEL]}")
+        for daemonset in find_stale(await _list(apps_api, RUN_LABEL, namespaces, kind="DaemonSet"), max_age_seconds, get_run_id())
+    ]
+
+    for namespace, name, owner in targets + reusable_targets + daemonset_targets:
+        log.info("%s %s/%s (%s)", "Would delete" if dry_run else "Deleting", namespace, name, owner, extra={"phase": "Sweep"})
+    if not dry_run:
+        # Wait through informers over every run's Deployments, the run's own informer doesn't see other runs
+        if targets:
+            await delete_deployments(api_client, targets, wait=wait, timeout=timeout, label_selector=RUN_LABEL)
+        if reusable_targets:
+            await delete_deployments(
+                api_client, reusable_targets, wait=wait, timeout=timeout, label_selector=f"{reuse.REUSABLE_LABEL}=true"
+            )
+        if daemonset_targets:
+            await delete_deployments(api_client, daemonset_targets, propagation_policy="Background", kind="DaemonSet")
+    log.info(
+        "Found %d stale Deployments and %d stale DaemonSets",
+        len(targets) + len(reusable_targets),
+        len(daemonset_targets),
+        extra={"phase": "Sweep"},
+    )
+    return [(namespace, name) for namespace, name, _ in targets + reusable_targets + daemonset_targets]
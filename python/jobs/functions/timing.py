@@ -0,0 +1,190 @@
+# Per-job lifecycle timings, exported as JSON lines, a Prometheus textfile and GitHub outputs
+
+import datetime
+import json
+import os
+import time
+from kubernetes_asyncio import client
+from .helpers import get_run_id, markdown_table, set_output, set_summary
+from .logger import get_logger
+
+
+# Phase name -> (start mark, end mark), a phase is reported once both of its marks are recorded
+PHASES = {
+    "dependency_wait": ("queued", "dependencies_ready"),
+    "admission": ("dependencies_ready", "admitted"),
+    "api_create": ("create_sent", "created"),
+    "scheduling": ("created", "scheduled"),
+    "image_pull": ("pulling", "pulled"),
+    "container_start": ("pulled", "started"),
+    "available": ("started", "available"),
+    "run": ("available", "completed"),
+    "delete": ("delete_sent", "deleted"),
+}
+
+
+log = get_logger("Timings")
+
+
+class JobTimer:
+    """Monotonic marks for one job's lifecycle, API timestamps are mapped onto the same clock"""
+
+    def __init__(self, job, namespace=None, name=None):
+        self.job = job
+        self.namespace = namespace
+        self.name = name
+        self.status = None
+        # Key of the job's workload spec, runs are only compared with earlier runs of the same spec
+        self.spec = None
+        self.marks = {}
+        # Anchor the wall clock to the monotonic clock, so API server timestamps can be placed on it
+        self._wall_anchor = time.time()
+        self._monotonic_anchor = time.monotonic()
+
+    def mark(self, event, at=None):
+        """Records the first occurrence of event, at the given monotonic time or now"""
+        if event not in self.marks:
+            self.marks[event] = time.monotonic() if at is None else at
+
+    def mark_wall(self, event, when):
+        """Records event from a wall clock datetime, e.g. a pod condition's lastTransitionTime"""
+        if when is not None:
+            self.mark(event, self._monotonic_anchor + (when.timestamp() - self._wall_anchor))
+
+    def phases(self):
+        """Returns the duration of each phase with both marks recorded, in seconds"""
+        durations = {}
+        for phase, (start, end) in PHASES.items():
+            if start in self.marks and end in self.marks:
+                durations[phase] = round(max(0.0, self.marks[end] - self.marks[start]), 3)
+        return durations
+
+    def total(self):
+        return round(max(self.marks.values()) - min(self.marks.values()), 3) if self.marks else 0.0
+
+
+_timers = {}
+
+
+def get_timer(job, namespace=None, name=None):
+    """Returns the timer for the job, created on first use"""
+    timer = _timers.get(job)
+    if timer is None:
+        timer = _timers[job] = JobTimer(job)
+    timer.namespace = timer.namespace or namespace
+    timer.name = timer.name or name
+    return timer
+
+
+def get_timers():
+    return list(_timers.values())
+
+
+def reset():
+    """Forgets every job timer, for running several runs in one process"""
+    _timers.clear()
+
+
+def event_time(event):
+    return event.event_time or event.first_timestamp or (event.metadata.creation_timestamp if event.metadata else None)
+
+
+async def collect_pod_timings(api_client, timer):
+    """Fills in scheduling, image pull and container start marks from the job's pod and its events"""
+    core_api = client.CoreV1Api(api_client=api_client)
+    try:
+        pods = await core_api.list_namespaced_pod(namespace=timer.namespace, label_selector=f"app={timer.name}")
+        if not pods.items:
+            return
+        pod = min(pods.items, key=lambda pod: pod.metadata.creation_timestamp)
+
+        for condition in pod.status.conditions or ():
+            if condition.type == "PodScheduled" and condition.status == "True":
+                timer.mark_wall("scheduled", condition.last_transition_time)
+        for container_status in pod.status.container_statuses or ():
+            state = container_status.state
+            # A Job's container has usually exited by the time the Job is Complete, its start is kept in terminated
+            if state and state.running:
+                timer.mark_wall("started", state.running.started_at)
+            elif state and state.terminated:
+                timer.mark_wall("started", state.terminated.started_at)
+
+        events = await core_api.list_namespaced_event(
+            namespace=timer.namespace, field_selector=f"involvedObject.name={pod.metadata.name}"
+        )
+        for event in sorted(events.items, key=lambda event: event_time(event) or datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)):
+            if event.reason == "Pulling":
+                timer.mark_wall("pulling", event_time(event))
+            elif event.reason == "Pulled":
+                # An image already present on the node has no Pulling event, the pull took no time
+                timer.mark_wall("pulling", event_time(event))
+                timer.mark_wall("pulled", event_time(event))
+
+    except Exception as e:
+        log.warning("Unable to collect pod timings: %s", e, extra={"job": timer.job})
+
+
+def export_jsonl(path):
+    with open(path, "a") as fh:
+        for timer in _timers.values():
+            print(
+                json.dumps({
+                    "run": get_run_id(),
+                    "job": timer.job,
+                    "namespace": timer.namespace,
+                    "status": timer.status,
+                    "phases": timer.phases(),
+                    "total": timer.total(),
+                }),
+                file=fh,
+            )
+
+
+def export_prometheus(path):
+    """Writes a node_exporter textfile, through a temporary file so the collector never reads it half written"""
+    run_id = get_run_id()
+    lines = [
+        "# HELP k8s_action_runner_phase_seconds Duration of each job lifecycle phase.",
+        "# TYPE k8s_action_runner_phase_seconds gauge",
+    ]
+    for timer in _timers.values():
+        for phase, seconds in timer.phases().items():
+            lines.append(f'k8s_action_runner_phase_seconds{{run="{run_id}",job="{timer.job}",phase="{phase}"}} {seconds}')
+    lines += [
+        "# HELP k8s_action_runner_job_seconds Total duration of each job.",
+        "# TYPE k8s_action_runner_job_seconds gauge",
+    ]
+    for timer in _timers.values():
+        lines.append(f'k8s_action_runner_job_seconds{{run="{run_id}",job="{timer.job}",status="{timer.status}"}} {timer.total()}')
+
+    with open(f"{path}.tmp", "w") as fh:
+        print("\n".join(lines), file=fh)
+    os.replace(f"{path}.tmp", path)
+
+
+def export_github():
+    """Sets the job_timings output and renders a per-job timing table into the step summary"""
+    timings = {timer.job: {"status": timer.status, "phases": timer.phases(), "total": timer.total()} for timer in _timers.values()}
+    set_output("job_timings", json.dumps(timings))
+
+    rows = [
+        [timer.job, timer.status or "-"]
+        + [f"{timer.phases()[phase]:.1f}s" if phase in timer.phases() else "-" for phase in PHASES]
+        + [f"{timer.total():.1f}s"]
+        for timer in _timers.values()
+    ]
+    set_summary("### Job Timings\n\n" + markdown_table(["Job", "Status", *PHASES, "Total"], rows))
+
+
+def export_all():
+    """Exports the timings to every configured destination"""
+    if not _timers:
+        return
+    if os.getenv("TIMINGS_JSONL"):
+        export_jsonl(os.getenv("TIMINGS_JSONL"))
+    if os.getenv("TIMINGS_PROM_FILE"):
+        export_prometheus(os.getenv("TIMINGS_PROM_FILE"))
+    if os.getenv("GITHUB_OUTPUT") and os.getenv("GITHUB_STEP_SUMMARY"):
+        export_github()
+    for timer in _timers.values():
+        log.info("%s total=%ss", timer.phases(), timer.total(), extra={"job": timer.job})
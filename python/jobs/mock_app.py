@@ -2,10 +2,8 @@
 
 import asyncio
 import os
-import sys
-import traceback
 from .functions.deployment import main as create_deployment
-from .functions.helpers import get_timestamp
+from .functions.logger import get_logger
 
 
 async def main(**kwargs):
@@ -14,18 +12,24 @@ async def main(**kwargs):
     try:
         rendered_name = job_name + "-" + os.getenv("NAME_APPEND").split("/", 1)[1]
         rendered_namespace = os.getenv("MOCK_APP_NAMESPACE", "default")
+        # "job" runs the app as a batch/v1 Job, the run then ends as soon as it exits
+        workload = os.getenv("MOCK_APP_WORKLOAD", "deployment")
         if os.getenv("COMPLETION_JOB_NAME") == job_name:
             os.environ["COMPLETION_JOB_NAME"] = rendered_name
             os.environ["COMPLETION_JOB_NAMESPACE"] = rendered_namespace
+            os.environ["COMPLETION_JOB_WORKLOAD"] = workload
         
         name, status = await create_deployment(
             monitor=kwargs.get("monitor", False),
+            api_client=kwargs.get("api_client"),
             
             name=rendered_name,
             namespace=rendered_namespace,
             
+            workload=workload,
             replicas=os.getenv("MOCK_APP_REPLICAS", 1),
             progress_deadline_seconds=os.getenv("MOCK_APP_DEPLOY_TIMEOUT", 500),
+            backoff_limit=os.getenv("MOCK_APP_BACKOFF_LIMIT", 0),
             
             image=os.getenv("MOCK_APP_IMAGE", "busybox"),
             container_name=os.getenv("MOCK_APP_CONTAINER_NAME", "sleep-container"),
@@ -40,6 +44,8 @@ async def main(**kwargs):
             == "true",
             wait_for_ready_var=os.getenv("MOCK_APP_WAIT_FOR_VAR", "MOCK_ENV_READY"),
             wait_description=os.getenv("MOCK_APP_WAIT_FOR_DESC", "Mock Environment"),
+            wait_timeout=float(os.getenv("MOCK_APP_WAIT_TIMEOUT", 600)),
+            watch_timeout=float(os.getenv("MOCK_APP_WATCH_TIMEOUT", 1200)),
             
             log_name=os.getenv("MOCK_APP_LOG_NAME", "MockApp"),
             log_description=os.getenv("MOCK_APP_LOG_DESC", "Mock Application"),
@@ -49,9 +55,8 @@ async def main(**kwargs):
         return name, status
 
     except Exception as e:
-        print(f"[{get_timestamp()}] Unexpected Error: ", e)
-        traceback.print_exc(file=sys.stdout)
-        exit(1)
+        get_logger().error("Unexpected Error: %s", e)
+        raise
 
 
 if __name__ == "__main__":
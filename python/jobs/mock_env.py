@@ -2,10 +2,8 @@
 
 import asyncio
 import os
-import sys
-import traceback
 from .functions.deployment import main as create_deployment
-from .functions.helpers import get_timestamp
+from .functions.logger import get_logger
 
 
 async def main(**kwargs):
@@ -20,6 +18,7 @@ async def main(**kwargs):
         
         name, status = await create_deployment(
             monitor=kwargs.get("monitor", False),
+            api_client=kwargs.get("api_client"),
             job_name=os.getenv("MOCK_ENV_JOB_NAME", "mock-env"),
             
             name=rendered_name,
@@ -41,18 +40,21 @@ async def main(**kwargs):
             == "true",
             wait_for_ready_var=os.getenv("MOCK_ENV_WAIT_FOR_VAR", None),
             wait_description=os.getenv("MOCK_ENV_WAIT_FOR_DESC", None),
+            wait_timeout=float(os.getenv("MOCK_ENV_WAIT_TIMEOUT", 600)),
+            watch_timeout=float(os.getenv("MOCK_ENV_WATCH_TIMEOUT", 1200)),
 
             log_name=os.getenv("MOCK_ENV_LOG_NAME", "MockEnv"),
             log_description=os.getenv("MOCK_ENV_LOG_DESC", "Mock Environment"),
             cleanup_object=os.getenv("MOCK_ENV_CLEANUP_RESOURCE", "True").lower()
             == "true",
+            reuse=os.getenv("MOCK_ENV_REUSE", "False").lower() == "true",
+            reuse_ttl=float(os.getenv("MOCK_ENV_REUSE_TTL", 3600)),
         )
         return name, status
 
     except Exception as e:
-        print(f"[{get_timestamp()}] Unexpected Error: ", e)
-        traceback.print_exc(file=sys.stdout)
-        exit(1)
+        get_logger().error("Unexpected Error: %s", e)
+        raise
 
 
 if __name__ == "__main__":
@@ -4,15 +4,26 @@
 import argparse
 import asyncio
 import os
-import sys
-import traceback
+import signal
 import uuid
-from .jobs.functions.helpers import get_timestamp, set_summary
+from .jobs.functions.helpers import set_summary
 from .jobs import mock_env, mock_app
+from .jobs.functions.clients import ClientManager
+from .jobs.functions.informer import stop_informers
+from .jobs.functions import capacity, history, logger, logs, prepull, scheduler, shards, supervisor, teardown, timing
 from kubernetes_asyncio import config
 
 
+log = logger.get_logger()
+
+
 async def main():
+    # Records are written by a background thread, LOG_LEVEL=DEBUG adds every watch event
+    logger.configure()
+    clients = ClientManager()
+    shard_list = []
+    # Turn the SIGTERM sent when the runner pod is stopped into a cancellation, so the run still tears down
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
     try:
         # Parse local argument, and set Kubernetes Authentication
         parser = argparse.ArgumentParser()
@@ -20,7 +31,31 @@ async def main():
             "-l",
             "--local",
         )
-        if parser.parse_args().local:
+        parser.add_argument(
+            "-m",
+            "--manifest",
+            default=os.getenv("RUN_MANIFEST"),
+            help="YAML/JSON run manifest of jobs and their depends_on edges",
+        )
+        parser.add_argument(
+            "--sweep",
+            action="store_true",
+            help="Only delete Deployments left behind by earlier runs, then exit",
+        )
+        parser.add_argument(
+            "--sweep-max-age",
+            type=float,
+            default=os.getenv("SWEEP_MAX_AGE", 7200),
+            help="Age in seconds after which another run's Deployments are considered stale",
+        )
+        parser.add_argument(
+            "--prepull",
+            action="store_true",
+            default=os.getenv("PREPULL_IMAGES", "False").lower() == "true",
+            help="Pre-pull the jobs' images onto their worker pool nodes while the jobs start",
+        )
+        args = parser.parse_args()
+        if args.local:
             await config.load_kube_config()
             random_uuid = uuid.uuid4()
             short_uuid = str(random_uuid).split("-")[0]
@@ -43,12 +78,81 @@ async def main():
         else:
             config.load_incluster_config()
 
-        # Initiate and run jobs asynchronously
-        job_results = await asyncio.gather(
-            mock_env.main(),
-            mock_app.main(),
-        )
-        print(f"[{get_timestamp()}] Overall Job Results: {job_results}")
+        # One pooled client is shared by every job for the whole run
+        api_client = await clients.start()
+
+        # Manifest jobs are spread over the shards' contexts and namespaces, each with its own pooled client,
+        # when the manifest or SHARDS lists any
+        manifest = scheduler.load_manifest(args.manifest) if args.manifest else None
+        shard_list = shards.load_shards(manifest) if manifest else []
+        await asyncio.gather(*(shard.start() for shard in shard_list))
+
+        # Remove what earlier runs left behind, on its own or before this run starts
+        if args.sweep or os.getenv("SWEEP_ON_START", "False").lower() == "true":
+            await teardown.sweep(api_client, max_age_seconds=args.sweep_max_age)
+            # Shards without a context of their own are in the cluster just swept
+            for shard in shard_list:
+                if shard.context or shard.kubeconfig:
+                    await teardown.sweep(shard.api_client, max_age_seconds=args.sweep_max_age)
+            if args.sweep:
+                return
+
+        # Initiate and run jobs asynchronously, from the run manifest when one is provided
+        if manifest:
+            run = scheduler.Scheduler(manifest, shards=shard_list, api_client=api_client)
+            job_specs = run.job_specs()
+            jobs = run.run()
+        else:
+            job_specs = [
+                {
+                    "image": os.getenv(f"{job}_IMAGE", "busybox"),
+                    "node_selector_key": os.getenv("NODE_SELECTOR_KEY", "kubernetes.io/os"),
+                    "node_selector_value": os.getenv("NODE_SELECTOR_VALUE", "linux"),
+                }
+                for job in ("MOCK_ENV", "MOCK_APP")
+            ]
+            # The first job to fail cancels the other, each job's own deadline comes from MOCK_*_JOB_TIMEOUT
+            jobs = supervisor.supervise(
+                [
+                    (
+                        os.getenv(f"{job}_LOG_NAME", log_name),
+                        job_main(api_client=api_client),
+                        float(os.getenv(f"{job}_JOB_TIMEOUT")) if os.getenv(f"{job}_JOB_TIMEOUT") else None,
+                    )
+                    for job, log_name, job_main in (
+                        ("MOCK_ENV", "MockEnv", mock_env.main),
+                        ("MOCK_APP", "MockApp", mock_app.main),
+                    )
+                ],
+                run_timeout=supervisor.get_run_timeout(),
+                fail_fast=supervisor.get_fail_fast(),
+            )
+
+        # Warm the worker pool nodes' image caches alongside the jobs, so jobs still waiting on
+        # dependencies start on nodes that already have their image
+        if args.prepull:
+            warmup = asyncio.create_task(prepull.warmup(api_client, job_specs))
+        try:
+            job_results = await jobs
+        finally:
+            if args.prepull and not warmup.done():
+                warmup.cancel()
+                await asyncio.gather(warmup, return_exceptions=True)
+        log.info("Overall Job Results: %s", job_results)
+
+        # Delete anything the jobs did not clean up themselves, before timings are exported
+        await teardown.teardown_run(api_client)
+
+        # Export per-phase timings for every job
+        for job_name, job_status in job_results:
+            timing.get_timer(job_name).status = job_status
+        timing.export_all()
+
+        # Record the run and compare it with earlier runs of the same jobs, when RUN_HISTORY_DB is set
+        verdict = await asyncio.to_thread(history.record_and_check, timing.get_timers())
+
+        # Show what the failed jobs' containers logged last
+        logs.report_failures(job_results)
 
         # Check for failed jobs
         failed_jobs = []
@@ -60,17 +164,39 @@ async def main():
 
         # Exit with the appropriate status post-jobs
         if failed_jobs:
-            print(f"[{get_timestamp()}] The following jobs have failed: {failed_jobs}")
+            log.error("The following jobs have failed: %s", failed_jobs)
             set_summary(f"The follow jobs have failed: {failed_jobs}")
             exit(1)
+        elif history.should_fail(verdict):
+            log.error("The run regressed against earlier runs")
+            exit(1)
         else:
-            print(f"[{get_timestamp()}] All jobs have completed successfully")
+            log.info("All jobs have completed successfully")
+
+    except asyncio.CancelledError:
+        log.warning("Run was terminated, tearing down..")
+        exit(1)
 
     except Exception as e:
-        print(f"[{get_timestamp()}] Unexpected Error: ", e)
-        traceback.print_exc(file=sys.stdout)
+        log.error("Unexpected Error: %s", e, exc_info=True)
         exit(1)
 
+    finally:
+        # Delete what a failed or terminated run left behind, a no-op once the run has torn down
+        if clients.api_client is not None:
+            await teardown.teardown_run(clients.api_client)
+
+        # Close the shared watches and log streams once every job has finished, then the client they use
+        await logs.stop_streams()
+        await stop_informers()
+        await capacity.stop_inventories()
+        log.info("API client metrics: %s", clients.metrics())
+        for shard in shard_list:
+            log.info("Shard %s API client metrics: %s", shard.name, shard.clients.metrics())
+            await shard.close()
+        await clients.close()
+        logger.shutdown()
+
 
 if __name__ == "__main__":
     asyncio.run(main())
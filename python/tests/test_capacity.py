@@ -0,0 +1,122 @@
+import asyncio
+import decimal
+import pytest
+from python.jobs.functions import capacity
+
+
+def node(name, cpu="2", memory="4Gi", labels=None, taints=()):
+    return capacity.Node.from_raw({
+        "metadata": {"name": name, "labels": {"workerNode": "true"} if labels is None else labels},
+        "spec": {"taints": list(taints)},
+        "status": {
+            "allocatable": {"cpu": cpu, "memory": memory},
+            "conditions": [{"type": "Ready", "status": "True"}],
+        },
+    })
+
+
+def pod(name, app, node_name, cpu="500m"):
+    return {
+        "metadata": {"name": name, "namespace": "default", "labels": {"app": app}},
+        "spec": {"nodeName": node_name, "containers": [{"resources": {"requests": {"cpu": cpu}}}]},
+    }
+
+
+def inventory(*nodes):
+    inventory = capacity.ClusterInventory(api_client=None)
+    inventory.nodes = {n.name: n for n in nodes}
+    for informer in inventory._informers:
+        informer.synced.set()
+    return inventory
+
+
+@pytest.mark.parametrize(
+    "quantity, expected",
+    [("100m", "0.1"), ("2", "2"), ("1.5", "1.5"), ("100Mi", 100 * 2**20), ("1G", 10**9), ("1e3", 1000)],
+)
+def test_parse_quantity(quantity, expected):
+    assert capacity.parse_quantity(quantity) == decimal.Decimal(expected)
+
+
+def test_pod_requests_take_the_larger_of_containers_and_init_containers():
+    pod = {
+        "spec": {
+            "containers": [
+                {"resources": {"requests": {"cpu": "100m", "memory": "64Mi"}}},
+                {"resources": {"requests": {"cpu": "200m"}}},
+            ],
+            "initContainers": [{"resources": {"requests": {"cpu": "50m", "memory": "128Mi"}}}],
+        }
+    }
+    assert capacity.pod_requests(pod) == (decimal.Decimal("0.3"), decimal.Decimal(128 * 2**20))
+
+
+def test_only_tolerated_pool_nodes_match():
+    pool_taint = {"key": "workerNode", "value": "true", "effect": "NoSchedule"}
+    other_taint = {"key": "gpu", "value": "true", "effect": "NoSchedule"}
+    assert node("a", taints=[pool_taint]).matches("workerNode", "true")
+    assert not node("b", taints=[other_taint]).matches("workerNode", "true")
+    assert not node("c", labels={}).matches("workerNode", "true")
+
+
+def test_jobs_that_can_never_fit_fail_immediately():
+    with pytest.raises(capacity.CapacityError):
+        inventory(node("a", cpu="1")).check_fits_at_all("workerNode", "true", (decimal.Decimal(2), decimal.Decimal(0)))
+    with pytest.raises(capacity.CapacityError):
+        inventory().check_fits_at_all("workerNode", "true", (decimal.Decimal(1), decimal.Decimal(0)))
+
+
+def test_queued_job_is_admitted_once_capacity_frees_up():
+    async def run():
+        cluster = inventory(node("a", cpu="1"))
+        cluster.pods = {("default", "busy"): ("a", (decimal.Decimal("0.8"), decimal.Decimal(0)), ("default", "busy"))}
+        admission = asyncio.create_task(cluster.admit("workerNode", "true", "500m", "64Mi"))
+        await asyncio.sleep(0)
+        assert not admission.done()
+
+        cluster._informers[1]._dispatch("DELETED", (("default", "busy"), "a", (0, 0), ("default", "busy")))
+        reservation = await asyncio.wait_for(admission, timeout=1)
+        assert reservation.placements[0][0] == "a"
+
+        # The reservation holds the room until released
+        assert cluster.place("workerNode", "true", (decimal.Decimal("0.6"), decimal.Decimal(0)), 1) is None
+        reservation.release()
+        assert cluster.place("workerNode", "true", (decimal.Decimal("0.6"), decimal.Decimal(0)), 1) is not None
+
+    asyncio.run(run())
+
+
+def test_bound_pods_take_over_their_reservation():
+    async def run():
+        cluster = inventory(node("a", cpu="2"))
+        reservation = await cluster.admit("workerNode", "true", "500m", "64Mi", replicas=2, owner=("default", "job"))
+        assert cluster.free()["a"][0] == decimal.Decimal(1)
+
+        # One replica is bound, it counts once on the node and the other is still reserved
+        pods = cluster._informers[1]
+        pods._dispatch("ADDED", pods._project(pod("job-1", "job", "a")))
+        pods._dispatch("ADDED", pods._project(pod("job-2", "job", None)))
+        assert cluster.free()["a"][0] == decimal.Decimal(1)
+        pods._dispatch("MODIFIED", pods._project(pod("job-2", "job", "a")))
+        assert cluster.free()["a"][0] == decimal.Decimal(1)
+
+        # Other jobs' pods don't take over the reservation
+        pods._dispatch("ADDED", pods._project(pod("other-1", "other", "a")))
+        assert cluster.free()["a"][0] == decimal.Decimal("0.5")
+        reservation.release()
+        assert cluster.free()["a"][0] == decimal.Decimal("0.5")
+
+    asyncio.run(run())
+
+
+def test_failed_watch_is_raised_to_queued_jobs():
+    async def run():
+        cluster = inventory(node("a", cpu="1"))
+        admission = asyncio.create_task(cluster.admit("workerNode", "true", "1", "64Mi", replicas=2))
+        await asyncio.sleep(0)
+        assert not admission.done()
+        cluster._informers[0]._fail(PermissionError("nodes is forbidden"))
+        with pytest.raises(PermissionError):
+            await asyncio.wait_for(admission, timeout=1)
+
+    asyncio.run(run())
@@ -0,0 +1,214 @@
+import asyncio
+import contextlib
+import json
+import aiohttp
+import pytest
+from kubernetes_asyncio import client as kubernetes_client
+from kubernetes_asyncio.client.exceptions import ApiException
+from python.jobs.functions import deployment, readiness
+from python.jobs.functions.deployment import _is_retryable, _retry_delay, _wait_for_completion, build_body
+from python.jobs.functions.status import DeploymentStatus, JobStatus
+
+
+def api_exception(status, headers=None):
+    e = ApiException(status=status, reason="error")
+    e.headers = headers
+    return e
+
+
+def test_retry_after_is_honored():
+    assert _retry_delay(api_exception(429, {"Retry-After": "3"}), attempt=0) == 3
+
+
+def test_retry_after_is_capped():
+    assert _retry_delay(api_exception(429, {"Retry-After": "3600"}), attempt=0, max_delay=30) == 30
+
+
+def test_backoff_without_retry_after_is_bounded():
+    for attempt in range(10):
+        delay = _retry_delay(api_exception(503), attempt, base_delay=0.5, max_delay=30)
+        assert 0 <= delay <= min(30, 0.5 * 2**attempt)
+
+
+def test_invalid_retry_after_falls_back_to_backoff():
+    assert 0 <= _retry_delay(api_exception(429, {"Retry-After": "soon"}), attempt=1, base_delay=0.5) <= 1
+
+
+def test_retryable_statuses():
+    assert _is_retryable(api_exception(429))
+    assert _is_retryable(api_exception(500))
+    assert not _is_retryable(api_exception(409))
+    assert not _is_retryable(api_exception(403))
+
+
+class StubInformer:
+    """Replays a fixed list of events to every subscriber"""
+
+    namespace = "default"
+
+    def __init__(self, events):
+        self.events = events
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, name):
+        async def events():
+            for event in self.events:
+                yield event
+            await asyncio.Event().wait()
+
+        yield events()
+
+
+def test_completion_is_shared_with_jobs_that_subscribe_late():
+    readiness.reset()
+    ready = DeploymentStatus("main", replicas=1, available_replicas=1, available="True")
+
+    async def run():
+        first = await _wait_for_completion(StubInformer([("MODIFIED", ready)]), "main", "first", simulated_run_seconds=0)
+        # The completion job has since been cleaned up, no further events will arrive
+        late = await asyncio.wait_for(_wait_for_completion(StubInformer([]), "main", "late"), timeout=1)
+        deleted = await _wait_for_completion(StubInformer([("DELETED", ready)]), "main", "deleted")
+        return first, late, deleted
+
+    assert asyncio.run(run()) == ("Completed", "Completed", "Completed")
+    readiness.reset()
+
+
+def test_deleted_completion_job_fails_waiters():
+    readiness.reset()
+    pending = DeploymentStatus("main", replicas=1, available_replicas=0, available="False")
+
+    async def run():
+        deleted = await _wait_for_completion(StubInformer([("DELETED", pending)]), "main", "first")
+        late = await asyncio.wait_for(_wait_for_completion(StubInformer([]), "main", "late"), timeout=1)
+        return deleted, late
+
+    assert asyncio.run(run()) == ("Failed", "Failed")
+    readiness.reset()
+
+
+def test_completion_job_workload_completes_without_simulated_run():
+    readiness.reset()
+    running = JobStatus("main", active=1)
+    complete = JobStatus("main", succeeded_pods=1, complete="True")
+
+    async def run():
+        # A Job is done when it says so, the simulated run would otherwise hold this for an hour
+        first = await asyncio.wait_for(
+            _wait_for_completion(StubInformer([("MODIFIED", running), ("MODIFIED", complete)]), "main", "first", simulated_run_seconds=3600, kind="Job"),
+            timeout=1,
+        )
+        late = await asyncio.wait_for(_wait_for_completion(StubInformer([]), "main", "late", kind="Job"), timeout=1)
+        return first, late
+
+    assert asyncio.run(run()) == ("Completed", "Completed")
+    readiness.reset()
+
+
+def test_failed_completion_job_workload_fails_waiters():
+    readiness.reset()
+    failed = JobStatus("main", failed_pods=1, failure="True", reason="BackoffLimitExceeded")
+
+    async def run():
+        return await _wait_for_completion(StubInformer([("MODIFIED", failed)]), "main", "first", kind="Job")
+
+    assert asyncio.run(run()) == "Failed"
+    readiness.reset()
+
+
+def test_job_workload_renders_a_batch_job(monkeypatch):
+    monkeypatch.setenv("NAME_APPEND", "owner/repo-1")
+    spec = {
+        "name": "load",
+        "image": "busybox",
+        "container_name": "load",
+        "command": '["true"]',
+        "node_selector_key": "pool",
+        "node_selector_value": "perf",
+        "replicas": 2,
+        "watch_timeout": 900,
+    }
+    assert build_body(**spec)["kind"] == "Deployment"
+
+    body = build_body(workload="job", **spec)
+    assert body["kind"] == "Job" and body["apiVersion"] == "batch/v1"
+    assert (body["spec"]["completions"], body["spec"]["parallelism"], body["spec"]["backoffLimit"]) == (2, 2, 0)
+    assert body["spec"]["activeDeadlineSeconds"] == 900
+    assert body["spec"]["ttlSecondsAfterFinished"] == 600
+    assert body["spec"]["template"]["spec"]["restartPolicy"] == "Never"
+    assert body["spec"]["template"]["metadata"]["labels"]["app"] == "load"
+
+
+def test_bodies_are_plain_json_without_unset_fields(monkeypatch):
+    monkeypatch.setenv("NAME_APPEND", "owner/repo-1")
+    body = build_body(
+        name="env",
+        image="busybox",
+        container_name="env",
+        command='["sleep", "60"]',
+        cpu_limit="100m",
+        memory_limit="100Mi",
+        node_selector_key="pool",
+        node_selector_value="perf",
+    )
+    assert json.loads(json.dumps(body)) == body
+    assert "progressDeadlineSeconds" not in body["spec"]
+    assert "restartPolicy" not in body["spec"]["template"]["spec"]
+    assert body["spec"]["template"]["spec"]["tolerations"][0]["key"] == "pool"
+
+
+class ScriptedApi:
+    """Stands in for AppsV1Api, raising the scripted errors in order before succeeding"""
+
+    calls = []
+    errors = []
+
+    def __init__(self, api_client=None):
+        pass
+
+    async def _call(self, verb, **kwargs):
+        ScriptedApi.calls.append((verb, kwargs))
+        if ScriptedApi.errors:
+            raise ScriptedApi.errors.pop(0)
+
+    async def create_namespaced_deployment(self, **kwargs):
+        await self._call("create", **kwargs)
+
+    async def patch_namespaced_deployment(self, **kwargs):
+        await self._call("patch", **kwargs)
+
+
+def submit(monkeypatch, errors, **kwargs):
+    monkeypatch.setattr(kubernetes_client, "AppsV1Api", ScriptedApi)
+    monkeypatch.setattr(deployment, "_retry_delay", lambda e, attempt: 0)
+    ScriptedApi.calls, ScriptedApi.errors = [], list(errors)
+    body = {"kind": "Deployment", "metadata": {"name": "env"}}
+    return asyncio.run(deployment.submit_workload(None, body, "default", **kwargs))
+
+
+def test_throttled_and_server_errors_are_retried(monkeypatch):
+    assert submit(monkeypatch, [api_exception(429), api_exception(503)]) == 3
+    assert [verb for verb, _ in ScriptedApi.calls] == ["create"] * 3
+
+
+def test_client_errors_are_not_retried(monkeypatch):
+    with pytest.raises(ApiException):
+        submit(monkeypatch, [api_exception(403)])
+    assert len(ScriptedApi.calls) == 1
+
+
+def test_conflict_after_a_lost_create_counts_as_created(monkeypatch):
+    assert submit(monkeypatch, [aiohttp.ClientConnectionError(), api_exception(409)]) == 2
+
+
+def test_conflict_on_a_first_create_is_raised(monkeypatch):
+    with pytest.raises(ApiException):
+        submit(monkeypatch, [api_exception(409)])
+
+
+def test_server_side_apply_patches_with_the_field_manager(monkeypatch):
+    assert submit(monkeypatch, [], server_side_apply=True) == 1
+    ((verb, kwargs),) = ScriptedApi.calls
+    assert verb == "patch" and kwargs["name"] == "env" and kwargs["force"] is True
+    assert kwargs["field_manager"] == "k8s-action-runner"
+    assert kwargs["_content_type"] == "application/apply-patch+yaml"
@@ -0,0 +1,53 @@
+from python.jobs.functions import history
+from python.jobs.functions.timing import JobTimer
+
+
+def timed(job, seconds, status="Completed", spec="spec"):
+    timer = JobTimer(job)
+    timer.status = status
+    timer.spec = spec
+    timer.mark("created", at=100.0)
+    timer.mark("scheduled", at=100.0 + seconds)
+    return timer
+
+
+def record_runs(store, durations, **kwargs):
+    for index, seconds in enumerate(durations):
+        store.record(f"run-{index}", [timed("app", seconds, **kwargs)], recorded_at=index)
+
+
+def test_significant_slowdown_regresses(tmp_path):
+    store = history.RunHistory(str(tmp_path / "history.db"))
+    record_runs(store, [10.0, 10.4, 9.8, 10.1, 10.2, 9.9])
+    store.record("slow", [timed("app", 14.0)], recorded_at=100)
+    results = {result["phase"]: result for result in store.check("slow", min_runs=5)}
+    assert results["scheduling"]["regressed"]
+    assert results["scheduling"]["baseline"] == 10.05
+    assert history.verdict_of(results.values()) == "regressed"
+
+    store.record("steady", [timed("app", 10.3)], recorded_at=101)
+    assert history.verdict_of(store.check("steady", min_runs=5)) == "pass"
+    store.close()
+
+
+def test_failed_runs_and_other_specs_are_not_baseline(tmp_path):
+    store = history.RunHistory(str(tmp_path / "history.db"))
+    record_runs(store, [10.0] * 6, status="Failed")
+    store.record("other-spec", [timed("app", 10.0, spec="other")], recorded_at=50)
+    store.record("current", [timed("app", 30.0)], recorded_at=100)
+    results = store.check("current", min_runs=1)
+    assert all(result["samples"] == 0 for result in results)
+    assert history.verdict_of(results) == "insufficient_history"
+    store.close()
+
+
+def test_noise_within_threshold_passes():
+    # Significant by z-score but only 2% slower, below the 10% threshold
+    assert not history.compare([10.0, 10.0, 10.0, 10.0, 10.0], 10.2)[3]
+    assert history.compare([10.0, 10.0, 10.0, 10.0, 10.0], 12.0)[3]
+
+
+def test_spec_key_ignores_names():
+    spec = {"image": "busybox", "command": '["true"]', "replicas": 1}
+    assert history.spec_key({**spec, "name": "a-1"}) == history.spec_key({**spec, "name": "a-2"})
+    assert history.spec_key(spec) != history.spec_key({**spec, "replicas": 2})
@@ -0,0 +1,160 @@
+import asyncio
+from kubernetes_asyncio import client
+from python.dev.fake_apiserver import FakeApiServer
+from python.jobs.functions.informer import DeploymentInformer
+from python.jobs.functions.status import DeploymentStatus
+
+
+def make_status(name, available="False", available_replicas=None):
+    return DeploymentStatus(name, replicas=1, available=available, available_replicas=available_replicas)
+
+
+def subscribed_informer(*names):
+    informer = DeploymentInformer("default", api_client=None, label_selector="run=test")
+    queues = {name: asyncio.Queue() for name in names}
+    for name, queue in queues.items():
+        informer._subscribers[name] = {queue}
+    return informer, queues
+
+
+def drain(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+
+def test_dispatch_only_notifies_on_state_changes():
+    informer, queues = subscribed_informer("job")
+    informer._dispatch("ADDED", make_status("job"))
+    informer._dispatch("MODIFIED", make_status("job"))
+    informer._dispatch("MODIFIED", make_status("job", available="True", available_replicas=1))
+
+    events = drain(queues["job"])
+    assert [event_type for event_type, _ in events] == ["ADDED", "MODIFIED"]
+    assert informer.cache["job"].available == "True"
+
+
+def test_relist_emits_deleted_for_missing_deployments():
+    informer, queues = subscribed_informer("gone", "kept")
+    informer._dispatch("ADDED", make_status("gone"))
+    informer._dispatch("ADDED", make_status("kept"))
+    drain(queues["gone"]), drain(queues["kept"])
+
+    informer._relist([make_status("kept", available="True", available_replicas=1)])
+
+    assert [event_type for event_type, _ in drain(queues["gone"])] == ["DELETED"]
+    assert [event_type for event_type, _ in drain(queues["kept"])] == ["MODIFIED"]
+    assert "gone" not in informer.cache
+
+
+def test_fatal_error_is_raised_to_subscribers():
+    async def run():
+        informer = DeploymentInformer("default", api_client=None, label_selector="run=test")
+        async with informer.subscribe("job") as events:
+            informer._fail(PermissionError("forbidden"))
+            async for _ in events:
+                pass
+
+    try:
+        asyncio.run(run())
+    except PermissionError as e:
+        assert str(e) == "forbidden"
+    else:
+        raise AssertionError("subscriber did not see the informer error")
+
+
+async def until(predicate, timeout=5):
+    async with asyncio.timeout(timeout):
+        while not predicate():
+            await asyncio.sleep(0.02)
+
+
+def run_against_server(test, **kwargs):
+    """Runs test(server, informer) with a Deployment informer watching the fake API server"""
+
+    async def run():
+        server = FakeApiServer(rollout_delay=60, **kwargs)
+        configuration = client.Configuration()
+        configuration.host = await server.start()
+        api_client = client.ApiClient(configuration=configuration)
+        informer = DeploymentInformer("default", api_client, label_selector="run=test", watch_timeout_seconds=5)
+        try:
+            return await test(server, informer)
+        finally:
+            await informer.stop()
+            await api_client.close()
+            await server.stop()
+
+    return asyncio.run(run())
+
+
+def store(server, name, namespace="default"):
+    body = {"metadata": {"name": name, "labels": {"run": "test"}}, "spec": {"replicas": 1}}
+    server._store(namespace, server._new_deployment(namespace, body), "ADDED")
+
+
+def test_watch_resumes_from_the_last_version_after_a_server_timeout():
+    async def test(server, informer):
+        informer.start()
+        await informer.synced.wait()
+        await until(lambda: server.call_counts["watch deployments"] >= 2)
+        store(server, "job")
+        await until(lambda: "job" in informer.cache)
+        return server.call_counts["list deployments"], server.watch_versions
+
+    lists, versions = run_against_server(test, watch_timeout=0.1)
+    assert lists == 1
+    assert len(versions) >= 2 and set(versions) <= {"0", "1"}
+
+
+def test_expired_watch_event_relists():
+    async def test(server, informer):
+        server.watch_faults.append(("event", 410))
+        informer.start()
+        await informer.synced.wait()
+        await until(lambda: server.call_counts["list deployments"] == 2)
+        store(server, "job")
+        await until(lambda: "job" in informer.cache)
+        return informer.error
+
+    assert run_against_server(test) is None
+
+
+def test_expired_watch_status_relists():
+    async def test(server, informer):
+        server.watch_faults.append(("status", 410))
+        informer.start()
+        await informer.synced.wait()
+        await until(lambda: server.call_counts["list deployments"] == 2)
+        store(server, "job")
+        await until(lambda: "job" in informer.cache)
+        return informer.error
+
+    assert run_against_server(test) is None
+
+
+def test_bookmarks_advance_the_version_without_dispatching():
+    async def test(server, informer):
+        dispatched = []
+        informer._dispatch = lambda event_type, status: dispatched.append(status.name)
+        informer.start()
+        await informer.synced.wait()
+        # Another namespace's change moves the resource version without reaching this watch
+        store(server, "elsewhere", namespace="other")
+        await until(lambda: "1" in server.watch_versions)
+        return dispatched, server.call_counts["list deployments"]
+
+    assert run_against_server(test, watch_timeout=0.2, bookmark_interval=0.05) == ([], 1)
+
+
+def test_truncated_watch_event_reconnects_from_the_last_version():
+    async def test(server, informer):
+        store(server, "job")
+        server.watch_faults.append(("truncated", None))
+        informer.start()
+        await informer.synced.wait()
+        await until(lambda: server.call_counts["watch deployments"] >= 2)
+        return informer.error, server.call_counts["list deployments"], server.watch_versions[:2]
+
+    assert run_against_server(test) == (None, 1, ["1", "1"])
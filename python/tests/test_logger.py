@@ -0,0 +1,46 @@
+import asyncio
+import io
+import json
+import logging
+from python.jobs.functions import logger
+
+
+def run_logged(fmt, level="INFO"):
+    stream = io.StringIO()
+    logger.configure(level=level, fmt=fmt, stream=stream)
+
+    async def job():
+        logger.bind(job="App", namespace="perf", phase="Watch")
+        logger.get_logger().debug("ADDED %s", "app")
+        logger.get_logger().info("App is running")
+
+    try:
+        asyncio.run(job())
+        logger.get_logger("Scheduler").warning("App will not start")
+    finally:
+        logger.shutdown()
+    return stream.getvalue().splitlines()
+
+
+def test_text_lines_carry_the_job_context():
+    lines = run_logged("text")
+    assert len(lines) == 2
+    assert lines[0].endswith("][App][Watch] App is running")
+    # The job's context stays with the task that bound it
+    assert lines[1].endswith("][Scheduler] WARNING: App will not start")
+
+
+def test_json_lines_and_debug_level():
+    entries = [json.loads(line) for line in run_logged("json", level="DEBUG")]
+    assert [entry["level"] for entry in entries] == ["DEBUG", "INFO", "WARNING"]
+    assert entries[1] == {**entries[1], "job": "App", "namespace": "perf", "phase": "Watch", "message": "App is running"}
+    assert "job" not in entries[2] and entries[2]["component"] == "Scheduler"
+
+
+def test_timestamps_are_formatted_once_per_second():
+    formatter = logger.TextFormatter()
+    first = logging.LogRecord("k8s_action_runner", logging.INFO, __file__, 0, "a", None, None)
+    second = logging.LogRecord("k8s_action_runner", logging.INFO, __file__, 0, "b", None, None)
+    second.created = int(first.created) + 0.999
+    first.created = int(first.created) + 0.001
+    assert formatter.timestamp(first) is formatter.timestamp(second)
@@ -0,0 +1,83 @@
+import asyncio
+from python.jobs.functions import logs
+
+
+def raw_pod(name, *containers, app="app"):
+    return {
+        "metadata": {"name": name, "labels": {"app": app}},
+        "status": {
+            "containerStatuses": [
+                {"name": container, "restartCount": restarts, "state": {state: {}}}
+                for container, restarts, state in containers
+            ]
+        },
+    }
+
+
+def followed_stream(name):
+    stream = logs.LogStream(None, "default", name, name.title(), "unused.log")
+    stream.followed = []
+    stream.follow = lambda *instance: stream.followed.append(instance)
+    return stream
+
+
+def test_each_started_container_instance_is_followed_once():
+    stream = followed_stream("app")
+    informer = logs._PodInformer(None, "default", "run=test")
+    informer.register(stream)
+
+    informer._dispatch("ADDED", informer._project(raw_pod("app-1", ("main", 0, "waiting"))))
+    informer._dispatch("MODIFIED", informer._project(raw_pod("app-1", ("main", 0, "running"))))
+    informer._dispatch("MODIFIED", informer._project(raw_pod("app-1", ("main", 1, "running"))))
+    assert stream.followed == [("app-1", "main", 0), ("app-1", "main", 1)]
+
+
+def test_shared_informer_dispatches_pods_by_app_label():
+    app, env = followed_stream("app"), followed_stream("env")
+    informer = logs._PodInformer(None, "default", "run=test")
+    informer.register(app)
+
+    informer._dispatch("ADDED", informer._project(raw_pod("app-1", ("main", 0, "running"))))
+    informer._dispatch("ADDED", informer._project(raw_pod("env-1", ("main", 0, "running"), app="env")))
+    informer._dispatch("ADDED", informer._project(raw_pod("other-1", ("main", 0, "running"), app="other")))
+    assert app.followed == [("app-1", "main", 0)]
+
+    # A job registering after its pods started picks them up from the informer's cache
+    informer.register(env)
+    assert env.followed == [("env-1", "main", 0)]
+
+    informer.unregister(app)
+    informer._dispatch("MODIFIED", informer._project(raw_pod("app-1", ("main", 1, "running"))))
+    assert app.followed == [("app-1", "main", 0)]
+
+
+def test_buffered_lines_are_flushed_on_stop(tmp_path):
+    path = tmp_path / "App.log"
+    stream = logs.LogStream(None, "default", "app", "App", str(path), buffer_lines=2, tail_lines=2)
+
+    async def run():
+        stream._file = open(path, "a")
+        stream._writer = asyncio.create_task(stream._write())
+        # More lines than the buffer holds, the writer drains it as lines are put
+        for line in ("one", "two", "three"):
+            await stream._buffer.put(line)
+        await stream.stop()
+
+    asyncio.run(run())
+    assert path.read_text() == "one\ntwo\nthree\n"
+    assert list(stream.tail) == ["two", "three"]
+
+
+def test_failed_jobs_tail_goes_to_the_summary(tmp_path, monkeypatch):
+    summary = tmp_path / "summary.md"
+    monkeypatch.setenv("GITHUB_STEP_SUMMARY", str(summary))
+    logs.reset()
+    for log_name in ("App", "Env"):
+        stream = logs._streams[log_name] = logs.LogStream(None, "default", log_name.lower(), log_name, f"{log_name}.log")
+        stream.tail.extend([f"{log_name} exited 1"])
+
+    sections = logs.report_failures([("App", "Failed"), ("Env", "Completed"), ("Other", "Failed")])
+    assert len(sections) == 1
+    assert "App exited 1" in summary.read_text()
+    assert "Env exited 1" not in summary.read_text()
+    logs.reset()
@@ -0,0 +1,99 @@
+import asyncio
+import pytest
+from python.jobs.functions import prepull
+
+
+def pod(*waiting_reasons, name="prepull-0", node="node-0"):
+    return {
+        "metadata": {"name": name, "creationTimestamp": "2026-01-01T12:00:00Z"},
+        "spec": {"nodeName": node, "containers": [{"name": f"image-{i}"} for i in range(len(waiting_reasons))]},
+        "status": {
+            "containerStatuses": [
+                {"name": f"image-{i}", "state": {"waiting": {"reason": reason}} if reason else {"running": {}}}
+                for i, reason in enumerate(waiting_reasons)
+            ]
+        },
+    }
+
+
+def daemonset(desired, generation=1, observed=1):
+    return {
+        "metadata": {"name": "prepull", "generation": generation},
+        "status": {"observedGeneration": observed, "desiredNumberScheduled": desired},
+    }
+
+
+def test_images_are_grouped_by_worker_pool():
+    specs = [
+        {"image": "busybox", "node_selector_key": "workerNode", "node_selector_value": "true"},
+        {"image": "busybox", "node_selector_key": "workerNode", "node_selector_value": "true"},
+        {"image": "alpine", "node_selector_key": "workerNode", "node_selector_value": "true"},
+        {"image": "busybox", "node_selector_key": "kubernetes.io/os", "node_selector_value": "linux"},
+    ]
+    assert prepull.collect_images(specs) == {
+        ("workerNode", "true"): ["busybox", "alpine"],
+        ("kubernetes.io/os", "linux"): ["busybox"],
+    }
+
+
+def test_daemonset_tolerates_the_worker_pool(monkeypatch):
+    monkeypatch.setenv("NAME_APPEND", "owner/repo-1")
+    body = prepull.build_daemonset_body("prepull", ["busybox", "alpine"], "workerNode", "true")
+    pod_spec = body["spec"]["template"]["spec"]
+    assert [container["image"] for container in pod_spec["containers"]] == ["busybox", "alpine"]
+    assert pod_spec["nodeSelector"] == {"workerNode": "true"}
+    assert pod_spec["tolerations"][0]["key"] == "workerNode" and pod_spec["tolerations"][0]["effect"] == "NoSchedule"
+
+
+def test_image_is_pulled_once_no_container_is_pulling():
+    assert prepull.is_pulled(pod(None, "CrashLoopBackOff"))
+    assert not prepull.is_pulled(pod(None, "ContainerCreating"))
+    assert not prepull.is_pulled(pod("ImagePullBackOff"))
+
+
+def test_pool_warmup_waits_for_every_scheduled_pod_to_pull():
+    async def run():
+        warmup = prepull.PoolWarmup(None, "default", "prepull")
+        daemonsets, pods = warmup._informers
+        for informer in warmup._informers:
+            informer.synced.set()
+        waiter = asyncio.create_task(warmup.wait())
+
+        # Not yet processed by the DaemonSet controller, 0 desired doesn't mean no nodes match
+        daemonsets._dispatch("ADDED", daemonsets._project(daemonset(0, generation=1, observed=0)))
+        daemonsets._dispatch("MODIFIED", daemonsets._project(daemonset(2)))
+        pods._dispatch("ADDED", pods._project(pod(None, name="a", node="node-a")))
+        pods._dispatch("ADDED", pods._project(pod("ContainerCreating", name="b", node="node-b")))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        pods._dispatch("MODIFIED", pods._project(pod(None, name="b", node="node-b")))
+        return await asyncio.wait_for(waiter, 1)
+
+    assert asyncio.run(run()) is True
+
+
+def test_pool_warmup_returns_when_no_node_matches():
+    async def run():
+        warmup = prepull.PoolWarmup(None, "default", "prepull")
+        daemonsets, _ = warmup._informers
+        for informer in warmup._informers:
+            informer.synced.set()
+        daemonsets._relist([daemonsets._project(daemonset(0))])
+        return await asyncio.wait_for(warmup.wait(), 1)
+
+    assert asyncio.run(run()) is False
+
+
+def test_pool_warmup_raises_a_failed_watch():
+    async def run():
+        warmup = prepull.PoolWarmup(None, "default", "prepull")
+        daemonsets, pods = warmup._informers
+        daemonsets.synced.set()
+        waiter = asyncio.create_task(warmup.wait())
+        await asyncio.sleep(0)
+        pods._fail(PermissionError("pods is forbidden"))
+        await asyncio.wait_for(waiter, 1)
+
+    with pytest.raises(PermissionError):
+        asyncio.run(run())
@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+from python.jobs.functions import readiness
+
+
+@pytest.fixture(autouse=True)
+def clear_signals():
+    readiness._signals.clear()
+    yield
+    readiness._signals.clear()
+
+
+def test_waiter_wakes_when_marked_ready():
+    async def run():
+        waiter = asyncio.create_task(readiness.wait_for("env", timeout=5))
+        await asyncio.sleep(0)
+        readiness.mark_ready("env")
+        await waiter
+        return readiness.is_ready("env")
+
+    assert asyncio.run(run())
+
+
+def test_wait_times_out():
+    with pytest.raises(TimeoutError):
+        asyncio.run(readiness.wait_for("never", timeout=0.01))
+
+
+def test_failure_propagates_to_waiters():
+    async def run():
+        waiter = asyncio.create_task(readiness.wait_for("env", timeout=5))
+        await asyncio.sleep(0)
+        readiness.mark_failed("env", "ProgressDeadlineExceeded")
+        await waiter
+
+    with pytest.raises(readiness.DependencyFailed, match="ProgressDeadlineExceeded"):
+        asyncio.run(run())
+
+
+def test_failure_after_ready_is_ignored():
+    async def run():
+        readiness.mark_ready("env")
+        readiness.mark_failed("env", "cleanup")
+        await readiness.wait_for("env", timeout=1)
+        return readiness.is_ready("env")
+
+    assert asyncio.run(run())
+
+
+def test_timed_out_waiter_does_not_cancel_the_signal():
+    async def run():
+        with pytest.raises(TimeoutError):
+            await readiness.wait_for("env", timeout=0.01)
+        readiness.mark_ready("env")
+        await readiness.wait_for("env", timeout=1)
+
+    asyncio.run(run())
@@ -0,0 +1,81 @@
+import datetime
+from kubernetes_asyncio import client
+from python.jobs.functions import reuse
+from python.jobs.functions.deployment import build_deployment_body
+
+NOW = datetime.datetime(2026, 1, 1, 12, tzinfo=datetime.timezone.utc)
+
+
+def body(name, image="busybox"):
+    return build_deployment_body(
+        name=name,
+        image=image,
+        container_name="sleep-container",
+        command='["sleep", "60"]',
+        cpu_limit="100m",
+        memory_limit="100Mi",
+        node_selector_key="kubernetes.io/os",
+        node_selector_value="linux",
+    )
+
+
+def environment(annotations, available="True", available_replicas=1):
+    return client.V1Deployment(
+        metadata=client.V1ObjectMeta(name="env", annotations=annotations),
+        spec=client.V1DeploymentSpec(replicas=1, selector=client.V1LabelSelector(), template=client.V1PodTemplateSpec()),
+        status=client.V1DeploymentStatus(
+            available_replicas=available_replicas,
+            conditions=[client.V1DeploymentCondition(type="Available", status=available)],
+        ),
+    )
+
+
+def in_an_hour():
+    return reuse._format_time(NOW + datetime.timedelta(hours=1))
+
+
+def test_spec_hash_ignores_the_run_specific_name(monkeypatch):
+    monkeypatch.setenv("NAME_APPEND", "owner/repo-1")
+    assert reuse.spec_hash(body("env-run-1")) == reuse.spec_hash(body("env-run-2"))
+    assert reuse.spec_hash(body("env-run-1")) != reuse.spec_hash(body("env-run-1", image="alpine"))
+
+
+def test_reusable_deployments_drop_the_run_label(monkeypatch):
+    monkeypatch.setenv("NAME_APPEND", "owner/repo-1")
+    marked = reuse.mark_reusable(body("env"), "digest", lease_seconds=60, ttl_seconds=60)
+    assert "k8s-action-runner/run" not in marked["metadata"]["labels"]
+    assert "k8s-action-runner/run" not in marked["spec"]["template"]["metadata"]["labels"]
+    assert marked["metadata"]["annotations"][reuse.LEASE_HOLDER_ANNOTATION] == "repo-1"
+
+
+def test_only_healthy_unleased_matches_are_adoptable():
+    free = environment({reuse.SPEC_HASH_ANNOTATION: "digest"})
+    other_spec = environment({reuse.SPEC_HASH_ANNOTATION: "other"})
+    unhealthy = environment({reuse.SPEC_HASH_ANNOTATION: "digest"}, available="False", available_replicas=0)
+    leased = environment({
+        reuse.SPEC_HASH_ANNOTATION: "digest",
+        reuse.LEASE_HOLDER_ANNOTATION: "run-1",
+        reuse.LEASE_EXPIRES_ANNOTATION: in_an_hour(),
+    })
+    adoptable = reuse.find_adoptable([free, other_spec, unhealthy, leased], "digest", "run-2", now=NOW)
+    assert adoptable == [free]
+
+
+def test_expired_leases_can_be_taken_over():
+    lapsed = environment({
+        reuse.SPEC_HASH_ANNOTATION: "digest",
+        reuse.LEASE_HOLDER_ANNOTATION: "run-1",
+        reuse.LEASE_EXPIRES_ANNOTATION: reuse._format_time(NOW - datetime.timedelta(minutes=1)),
+    })
+    assert reuse.find_adoptable([lapsed], "digest", "run-2", now=NOW) == [lapsed]
+
+
+def test_unleased_environments_expire_after_their_ttl():
+    expired = environment({reuse.REUSE_UNTIL_ANNOTATION: reuse._format_time(NOW - datetime.timedelta(minutes=1))})
+    kept = environment({reuse.REUSE_UNTIL_ANNOTATION: in_an_hour()})
+    leased = environment({
+        reuse.REUSE_UNTIL_ANNOTATION: reuse._format_time(NOW - datetime.timedelta(minutes=1)),
+        reuse.LEASE_HOLDER_ANNOTATION: "run-1",
+        reuse.LEASE_EXPIRES_ANNOTATION: in_an_hour(),
+    })
+    assert [reuse.is_expired(d, now=NOW) for d in (expired, kept, leased)] == [True, False, False]
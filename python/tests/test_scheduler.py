@@ -0,0 +1,41 @@
+import pytest
+from python.jobs.functions.scheduler import load_manifest, validate_manifest
+
+
+def manifest(*jobs, **kwargs):
+    return {"completion_job": jobs[-1]["name"], "jobs": list(jobs), **kwargs}
+
+
+def test_valid_manifest():
+    validate_manifest(manifest({"name": "env"}, {"name": "app", "depends_on": ["env"]}, concurrency=2))
+
+
+def test_unknown_dependency_is_rejected():
+    with pytest.raises(ValueError, match="unknown job"):
+        validate_manifest(manifest({"name": "app", "depends_on": ["env"]}))
+
+
+def test_cycle_is_rejected():
+    with pytest.raises(ValueError, match="cycle"):
+        validate_manifest(manifest(
+            {"name": "a", "depends_on": ["b"]},
+            {"name": "b", "depends_on": ["a"]},
+        ))
+
+
+def test_scalar_depends_on_is_rejected():
+    with pytest.raises(ValueError, match="must be a list"):
+        validate_manifest(manifest({"name": "env"}, {"name": "app", "depends_on": "env"}))
+
+
+@pytest.mark.parametrize("concurrency", [0, -1, "2"])
+def test_invalid_concurrency_is_rejected(concurrency):
+    with pytest.raises(ValueError, match="concurrency"):
+        validate_manifest(manifest({"name": "app"}, concurrency=concurrency))
+
+
+def test_empty_manifest_file_is_rejected(tmp_path):
+    path = tmp_path / "manifest.yaml"
+    path.write_text("")
+    with pytest.raises(ValueError, match="empty"):
+        load_manifest(path)
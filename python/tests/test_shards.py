@@ -0,0 +1,78 @@
+import decimal
+import pytest
+from python.jobs.functions.scheduler import validate_manifest
+from python.jobs.functions.shards import Shard, components, demand, load_shards, place
+
+POOL = ("pool", "perf")
+
+
+def job(name, depends_on=(), shard=None, cpu="1", replicas=1):
+    return {
+        "name": name,
+        "depends_on": list(depends_on),
+        "shard": shard,
+        "cpu_limit": cpu,
+        "replicas": replicas,
+        "node_selector_key": POOL[0],
+        "node_selector_value": POOL[1],
+    }
+
+
+def shards(*names, **weights):
+    return [Shard(name, weight=weights.get(name, 1)) for name in names]
+
+
+def test_dependent_jobs_form_one_component():
+    jobs = [job("env"), job("app", ["env"]), job("other"), job("report", ["app"])]
+    assert [[j["name"] for j in group] for group in components(jobs)] == [["env", "app", "report"], ["other"]]
+
+
+def test_affinity_places_the_whole_component():
+    jobs = [job("env"), job("app", ["env"], shard="west")]
+    assert place(jobs, shards("east", "west")) == {"env": "west", "app": "west"}
+
+
+def test_conflicting_affinities_are_rejected():
+    jobs = [job("env", shard="east"), job("app", ["env"], shard="west")]
+    with pytest.raises(ValueError, match="conflicting"):
+        place(jobs, shards("east", "west"))
+
+
+def test_unknown_affinity_is_rejected():
+    with pytest.raises(ValueError, match="unknown shard"):
+        place([job("env", shard="north")], shards("east"))
+
+
+def test_components_go_to_the_shard_with_the_most_room():
+    jobs = [job("a", cpu="2"), job("b", ["a"], cpu="2"), job("c", cpu="3")]
+    free = {"east": {POOL: decimal.Decimal(6)}, "west": {POOL: decimal.Decimal(5)}}
+    # a and b leave east with 2 free, so c only fits on west
+    assert place(jobs, shards("east", "west"), free) == {"a": "east", "b": "east", "c": "west"}
+
+
+def test_falls_back_to_weight_when_nothing_fits():
+    jobs = [job(name, cpu="10") for name in "abc"]
+    free = {"east": {POOL: decimal.Decimal(1)}, "west": None}
+    assert place(jobs, shards("east", "west", west=2), free) == {"a": "east", "b": "west", "c": "west"}
+
+
+def test_demand_sums_replicas_per_pool():
+    assert demand([job("a", cpu="500m", replicas=2), job("b", cpu="1")]) == {POOL: decimal.Decimal(2)}
+
+
+def test_shards_load_from_env(monkeypatch):
+    monkeypatch.setenv("SHARDS", '[{"name": "east", "context": "perf-east", "namespace": "perf", "weight": 2}]')
+    (shard,) = load_shards({})
+    assert (shard.name, shard.context, shard.namespace, shard.weight) == ("east", "perf-east", "perf", 2.0)
+
+
+def test_manifest_affinity_must_name_a_shard():
+    manifest = {"completion_job": "app", "shards": [{"name": "east"}], "jobs": [{"name": "app", "shard": "west"}]}
+    with pytest.raises(ValueError, match="unknown shard"):
+        validate_manifest(manifest)
+
+
+def test_duplicate_shards_are_rejected():
+    manifest = {"completion_job": "app", "shards": [{"name": "east"}, {"name": "east"}], "jobs": [{"name": "app"}]}
+    with pytest.raises(ValueError, match="Duplicate shard"):
+        validate_manifest(manifest)
@@ -0,0 +1,19 @@
+from python.dev.startup import KUBECONFIG, PHASES, measure, parse_importtime
+
+
+def test_importtime_output_is_parsed():
+    output = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       120 |        120 |   json.decoder",
+        "import time:       300 |        420 | json",
+    ])
+    assert parse_importtime(output) == {"json.decoder": (120, 120), "json": (300, 420)}
+
+
+def test_startup_is_measured_through_the_first_api_client(tmp_path):
+    kubeconfig = tmp_path / "kubeconfig.yaml"
+    kubeconfig.write_text(KUBECONFIG)
+    phases, imports = measure("python.main", str(kubeconfig), importtime=True)
+    assert set(phases) == set(PHASES) and all(ms > 0 for ms in phases.values())
+    # The client stack loads within the measured window, whether at import or with the first ApiClient
+    assert "kubernetes_asyncio.client" in imports and "aiohttp" in imports
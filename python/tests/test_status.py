@@ -0,0 +1,73 @@
+from python.jobs.functions.status import DeploymentStatus, JobStatus
+
+
+def raw_deployment(conditions, available_replicas=None, replicas=1):
+    return {
+        "metadata": {"name": "job", "resourceVersion": "7"},
+        "spec": {"replicas": replicas},
+        "status": {"availableReplicas": available_replicas, "conditions": conditions},
+    }
+
+
+def test_conditions_are_looked_up_by_type():
+    status = DeploymentStatus.from_raw(raw_deployment([
+        {"type": "Progressing", "status": "True", "reason": "NewReplicaSetAvailable"},
+        {"type": "Available", "status": "True", "reason": "MinimumReplicasAvailable"},
+    ], available_replicas=1))
+    assert status.progressing == "True"
+    assert status.available == "True"
+    assert status.reason == "MinimumReplicasAvailable"
+    assert status.is_ready(1)
+    assert not status.failed
+
+
+def test_progress_deadline_exceeded_is_failed():
+    status = DeploymentStatus.from_raw(raw_deployment([
+        {"type": "Available", "status": "False", "reason": "MinimumReplicasUnavailable"},
+        {"type": "Progressing", "status": "False", "reason": "ProgressDeadlineExceeded", "message": "timed out"},
+    ]))
+    assert status.failed
+    assert status.message == "timed out"
+    assert not status.is_ready(1)
+
+
+def test_missing_status_is_not_ready():
+    status = DeploymentStatus.from_raw({"metadata": {"name": "job"}})
+    assert status.name == "job"
+    assert not status.is_ready(1)
+    assert not status.failed
+
+
+def test_resource_version_alone_is_not_a_state_change():
+    first = DeploymentStatus.from_raw(raw_deployment([]))
+    second = DeploymentStatus.from_raw(raw_deployment([]))
+    second.resource_version = "8"
+    assert first == second
+
+
+def raw_job(conditions, active=None, succeeded=None, failed=None):
+    return {
+        "metadata": {"name": "job", "resourceVersion": "7"},
+        "spec": {"completions": 1},
+        "status": {"active": active, "succeeded": succeeded, "failed": failed, "conditions": conditions},
+    }
+
+
+def test_job_is_done_once_complete():
+    running = JobStatus.from_raw(raw_job([], active=1))
+    assert not running.succeeded and not running.failed
+    complete = JobStatus.from_raw(raw_job([{"type": "Complete", "status": "True"}], succeeded=1))
+    assert complete.succeeded and complete.is_ready(1)
+    assert complete != running
+
+
+def test_job_failure_reports_its_reason():
+    status = JobStatus.from_raw(raw_job(
+        [
+            {"type": "FailureTarget", "status": "True", "reason": "BackoffLimitExceeded"},
+            {"type": "Failed", "status": "True", "reason": "BackoffLimitExceeded", "message": "Job has reached the specified backoff limit"},
+        ],
+        failed=1,
+    ))
+    assert status.failed and not status.succeeded
+    assert status.reason == "BackoffLimitExceeded"
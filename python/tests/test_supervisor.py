@@ -0,0 +1,52 @@
+import asyncio
+from python.jobs.functions.supervisor import supervise
+
+
+async def job(name, status, delay=0.0, cleaned_up=None):
+    try:
+        await asyncio.sleep(delay)
+        return name, status
+    finally:
+        if cleaned_up is not None:
+            cleaned_up.append(name)
+
+
+def test_first_failure_cancels_and_cleans_up_siblings():
+    async def run():
+        cleaned_up = []
+        results = await supervise([
+            ("env", job("env", "Failed"), None),
+            ("app", job("app", "Completed", delay=10, cleaned_up=cleaned_up), None),
+        ])
+        return results, cleaned_up
+
+    results, cleaned_up = asyncio.run(run())
+    assert results == [("env", "Failed"), ("app", "Cancelled")]
+    assert cleaned_up == ["app"]
+
+
+def test_without_fail_fast_every_job_finishes():
+    results = asyncio.run(supervise(
+        [("env", job("env", "Failed"), None), ("app", job("app", "Completed", delay=0.01), None)],
+        fail_fast=False,
+    ))
+    assert results == [("env", "Failed"), ("app", "Completed")]
+
+
+def test_errors_and_job_deadlines_fail_the_job():
+    async def broken():
+        raise RuntimeError("boom")
+
+    results = asyncio.run(supervise(
+        [("broken", broken(), None), ("slow", job("slow", "Completed", delay=10), 0.01)],
+        fail_fast=False,
+    ))
+    assert results == [("broken", "Failed"), ("slow", "Failed")]
+
+
+def test_run_deadline_fails_unfinished_jobs():
+    results = asyncio.run(supervise(
+        [("fast", job("fast", "Completed"), None), ("slow", job("slow", "Completed", delay=10), None)],
+        run_timeout=0.05,
+    ))
+    assert results == [("fast", "Completed"), ("slow", "Failed")]
@@ -0,0 +1,106 @@
+import asyncio
+import datetime
+from kubernetes_asyncio import client
+from python.jobs.functions import teardown
+from python.jobs.functions.helpers import RUN_LABEL
+from python.jobs.functions.informer import DeploymentInformer
+from python.jobs.functions.status import DeploymentStatus
+from python.jobs.functions.teardown import find_stale, shielded, wait_for_deleted
+
+NOW = datetime.datetime(2026, 1, 1, 12, tzinfo=datetime.timezone.utc)
+
+
+def deployment(name, labels, age_seconds):
+    return client.V1Deployment(
+        metadata=client.V1ObjectMeta(
+            name=name,
+            namespace="default",
+            labels=labels,
+            creation_timestamp=NOW - datetime.timedelta(seconds=age_seconds),
+        )
+    )
+
+
+def test_only_old_deployments_of_other_runs_are_stale():
+    deployments = [
+        deployment("old", {RUN_LABEL: "run-1"}, 7200),
+        deployment("recent", {RUN_LABEL: "run-1"}, 60),
+        deployment("current", {RUN_LABEL: "run-2"}, 7200),
+        deployment("unlabelled", {"app": "unlabelled"}, 7200),
+    ]
+    stale = find_stale(deployments, max_age_seconds=3600, run_id="run-2", now=NOW)
+    assert [d.metadata.name for d in stale] == ["old"]
+
+
+class SweptApi:
+    """AppsV1Api stand-in listing one stale prepull DaemonSet and no Deployments, recording deletes"""
+
+    deleted = []
+
+    def __init__(self, api_client=None):
+        pass
+
+    async def list_deployment_for_all_namespaces(self, label_selector):
+        return client.V1DeploymentList(items=[])
+
+    async def list_daemon_set_for_all_namespaces(self, label_selector):
+        daemonset = client.V1DaemonSet(metadata=deployment("prepull-abc", {RUN_LABEL: "run-1"}, 7200).metadata)
+        return client.V1DaemonSetList(items=[daemonset])
+
+    async def delete_namespaced_daemon_set(self, namespace, name, body):
+        self.deleted.append(("DaemonSet", namespace, name, body["propagationPolicy"]))
+
+    async def delete_namespaced_deployment(self, namespace, name, body):
+        self.deleted.append(("Deployment", namespace, name, body["propagationPolicy"]))
+
+
+def test_sweep_deletes_prepull_daemonsets_of_other_runs(monkeypatch):
+    monkeypatch.setenv("NAME_APPEND", "owner/repo-2")
+    monkeypatch.setattr(client, "AppsV1Api", SweptApi)
+    SweptApi.deleted = []
+    swept = asyncio.run(teardown.sweep(None, max_age_seconds=3600))
+    assert swept == [("default", "prepull-abc")]
+    assert SweptApi.deleted == [("DaemonSet", "default", "prepull-abc", "Background")]
+
+
+def test_wait_for_deleted_returns_on_delete_event():
+    async def run():
+        informer = DeploymentInformer("default", api_client=None)
+        informer.synced.set()
+        status = DeploymentStatus("app", replicas=1)
+        informer._dispatch("ADDED", status)
+        waiter = asyncio.create_task(wait_for_deleted(informer, "app", timeout=1))
+        await asyncio.sleep(0)
+        informer._dispatch("DELETED", status)
+        await waiter
+
+    asyncio.run(run())
+
+
+def test_wait_for_deleted_returns_when_already_gone():
+    async def run():
+        informer = DeploymentInformer("default", api_client=None)
+        informer.synced.set()
+        await wait_for_deleted(informer, "app", timeout=1)
+
+    asyncio.run(run())
+
+
+def test_shielded_cleanup_finishes_when_cancelled():
+    async def run():
+        finished = []
+
+        async def cleanup():
+            await asyncio.sleep(0.01)
+            finished.append(True)
+
+        job = asyncio.create_task(shielded(cleanup()))
+        await asyncio.sleep(0)
+        job.cancel()
+        try:
+            await job
+        except asyncio.CancelledError:
+            pass
+        return finished, job.cancelled()
+
+    assert asyncio.run(run()) == ([True], True)
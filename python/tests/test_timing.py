@@ -0,0 +1,75 @@
+import asyncio
+import datetime
+from kubernetes_asyncio import client
+from python.jobs.functions import timing
+from python.jobs.functions.helpers import markdown_table
+
+
+def test_phases_need_both_marks():
+    timer = timing.JobTimer("job")
+    timer.mark("queued", at=10.0)
+    timer.mark("dependencies_ready", at=12.5)
+    timer.mark("create_sent", at=12.5)
+    assert timer.phases() == {"dependency_wait": 2.5}
+    assert timer.total() == 2.5
+
+
+def test_first_mark_wins():
+    timer = timing.JobTimer("job")
+    timer.mark("queued", at=1.0)
+    timer.mark("queued", at=5.0)
+    assert timer.marks["queued"] == 1.0
+
+
+def test_wall_clock_marks_share_the_monotonic_clock():
+    timer = timing.JobTimer("job")
+    timer.mark("created", at=timer._monotonic_anchor)
+    scheduled = datetime.datetime.fromtimestamp(timer._wall_anchor + 3, tz=datetime.timezone.utc)
+    timer.mark_wall("scheduled", scheduled)
+    assert timer.phases()["scheduling"] == 3.0
+
+
+class FinishedJobPods:
+    """CoreV1Api stand-in listing one Job pod whose container already exited"""
+
+    def __init__(self, api_client=None):
+        pass
+
+    async def list_namespaced_pod(self, namespace, label_selector):
+        started = datetime.datetime.fromtimestamp(1000, tz=datetime.timezone.utc)
+        terminated = client.V1ContainerStateTerminated(exit_code=0, started_at=started)
+        status = client.V1ContainerStatus(
+            name="job", image="busybox", image_id="", ready=False, restart_count=0, state=client.V1ContainerState(terminated=terminated)
+        )
+        return client.V1PodList(
+            items=[client.V1Pod(metadata=client.V1ObjectMeta(name="job-abc", creation_timestamp=started), status=client.V1PodStatus(container_statuses=[status]))]
+        )
+
+    async def list_namespaced_event(self, namespace, field_selector):
+        return client.CoreV1EventList(items=[])
+
+
+def test_completed_job_container_start_comes_from_terminated_state(monkeypatch):
+    monkeypatch.setattr(client, "CoreV1Api", FinishedJobPods)
+    timer = timing.JobTimer("job", "default", "job")
+    asyncio.run(timing.collect_pod_timings(None, timer))
+    assert timer.marks["started"] == timer._monotonic_anchor + (1000 - timer._wall_anchor)
+
+
+def test_prometheus_textfile(tmp_path, monkeypatch):
+    monkeypatch.setenv("NAME_APPEND", "owner/repo-1")
+    monkeypatch.setattr(timing, "_timers", {})
+    timer = timing.get_timer("MockApp", "default", "mock-app-repo-1")
+    timer.status = "Completed"
+    timer.mark("created", at=1.0)
+    timer.mark("scheduled", at=1.5)
+
+    path = tmp_path / "runner.prom"
+    timing.export_prometheus(str(path))
+    text = path.read_text()
+    assert 'k8s_action_runner_phase_seconds{run="repo-1",job="MockApp",phase="scheduling"} 0.5' in text
+    assert not (tmp_path / "runner.prom.tmp").exists()
+
+
+def test_markdown_table():
+    assert markdown_table(["Job", "Total"], [["a", "1s"]]) == "| Job | Total |\n|---|---|\n| a | 1s |"